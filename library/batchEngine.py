@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+# LIBRARIES
+import numpy as np
+import os
+
+from board import get_lines
+
+class BatchC4(object):
+    '''
+    Connect 4 Engine that plays N games at once with vectorized numpy operations.
+    Meant for generating data : instead of one C4 object (and one python loop) per game,
+    every call to step() advances all unfinished games by one move.
+
+    The games are held in stacked arrays :
+    grids     : (N, height, width) int8 array (6x7 by default), 0 for empty positions, 1 for Player 1 and -1 for Player 2
+    col_moves : (N, 7) number of positions left in each column of each game
+    done      : (N,) True once a game is over
+    winners   : (N,) winner of each game (p1 = 1, p2 = -1, tie = 0)
+
+    The running sum of every vector (row, column and diagonal of N_connect (4) positions) is kept in
+    line_sums (N, N_vectors) (69 vectors for connect 4 on a 6x7 grid), which is all we need to check
+    for winners and to run the SetAI policy.
+
+    gametype works as in C4 :
+    setset  : SetAI, SetAI
+    setrand : RandomAI, SetAI
+    randrand: RandomAI, RandomAI
+    Policies can also be given directly as functions policy(engine, games, marker) returning
+    the chosen column of each game in games (see random_policy and set_policy).
+
+    The columns played in each game are kept in moves (N, N_positions), so the games can also be
+    saved as move records (see make_game_records and gameRecord.MoveSink).
+    '''
+
+    # Constructor
+    def __init__(self, N_games, gametype='setset', p1_policy=None, p2_policy=None, grid_size=(6,7), seed=None, N_connect=4):
+
+        self.N_games     = N_games
+        self.height      = grid_size[0]
+        self.width       = grid_size[1]
+        self.N_positions = self.height*self.width
+        self.N_connect   = N_connect
+
+        # Random number generator (each batch has its own so runs can be reproduced)
+        self.rng = np.random.RandomState(seed)
+
+        # Players
+        policies = {'setset'   : (BatchC4.set_policy, BatchC4.set_policy),
+                    'setrand'  : (BatchC4.random_policy, BatchC4.set_policy),
+                    'randrand' : (BatchC4.random_policy, BatchC4.random_policy)}
+        p1, p2 = policies[gametype]
+        if(p1_policy != None): p1 = p1_policy
+        if(p2_policy != None): p2 = p2_policy
+
+        # Player types (for the game records)
+        types = {BatchC4.set_policy : 'SetAI', BatchC4.random_policy : 'RandomAI'}
+        self.player_types = (types.get(p1, 'Other'), types.get(p2, 'Other'))
+        self.policies = {1 : p1, -1 : p2}
+
+        # Vector tables :
+        # lines     : (N_vectors, N_connect) position indices of each vector
+        # incidence : (N_positions, N_vectors) 1 where a position is part of a vector
+        self.lines     = get_lines(grid_size, N_connect)
+        self.incidence = np.zeros((self.N_positions, len(self.lines)), dtype=np.int8)
+        self.incidence[self.lines, np.arange(len(self.lines))[:, None]] = 1
+
+        # Game arrays
+        self.grids     = np.zeros((N_games, self.height, self.width), dtype=np.int8)
+        self.col_moves = np.zeros((N_games, self.width), dtype=np.int64) + self.height
+        self.line_sums = np.zeros((N_games, len(self.lines)), dtype=np.int8)
+        self.done      = np.zeros(N_games, dtype=bool)
+        self.winners   = np.zeros(N_games, dtype=np.int8)
+        self.N_moves   = np.zeros(N_games, dtype=np.int64)
+
+        # Marker of the player to move in each game (randomize who starts)
+        self.to_move = np.where(self.rng.rand(N_games) < 0.5, 1, -1).astype(np.int8)
+        self.starts  = self.to_move.copy()
+
+        # Column of each move (-1 after the end of the game)
+        self.moves = np.zeros((N_games, self.N_positions), dtype=np.int8) - 1
+
+    def play_games(self):
+        '''
+        Runs through all the games!
+        '''
+        while not self.done.all():
+            self.step()
+
+        return self.winners
+
+    def step(self):
+        '''
+        Advance every unfinished game by one move.
+        Player 1 moves in the games where it is its turn, then Player 2 in the others.
+        '''
+        active = ~self.done
+
+        for marker in (1, -1):
+            games = np.where(active & (self.to_move == marker))[0]
+            if len(games) == 0:
+                continue
+
+            # Player chooses which column to play in
+            cols = self.policies[marker](self, games, marker)
+            self.apply_moves(games, cols, marker)
+
+        # Switch turns (only matters for unfinished games)
+        self.to_move[active] *= -1
+
+        return 0
+
+    def apply_moves(self, games, cols, marker):
+        '''
+        Place a marker in column cols[i] of game games[i], then check for winners and full grids.
+        '''
+        # Double check to make sure the moves are valid
+        if (self.col_moves[games, cols] == 0).any():
+            raise ValueError('BatchC4.apply_moves : column is full in games {}'.format(games[self.col_moves[games, cols] == 0]))
+
+        # Get rows corresponding to the column choices and update grids
+        rows = self.col_moves[games, cols] - 1
+        self.grids[games, rows, cols] = marker
+        self.col_moves[games, cols] -= 1
+        self.moves[games, self.N_moves[games]] = cols
+        self.N_moves[games] += 1
+
+        # Update sums of the vectors going through the new pieces
+        self.line_sums[games] += marker*self.incidence[rows*self.width + cols]
+
+        # Check for winners (only vectors through the new piece can reach the target)
+        won = (self.line_sums[games] == self.N_connect*marker).any(axis=1)
+        self.winners[games[won]] = marker
+
+        # Games are over when someone won or there are no more moves
+        self.done[games] = won | (self.N_moves[games] == self.N_positions)
+
+        return 0
+
+    def playable_cells(self, games):
+        '''
+        (len(games), N_positions) boolean array, True for the positions where a piece can be placed
+        (same as the Board.bool_grid of each game, flattened).
+        '''
+        col_moves = self.col_moves[games]
+        playable  = np.zeros((len(games), self.N_positions), dtype=bool)
+
+        g, c = np.where(col_moves > 0)
+        playable[g, (col_moves[g, c] - 1)*self.width + c] = True
+
+        return playable
+
+    def random_choice(self, mask):
+        '''
+        For each row of a boolean mask, return the index of a random True value
+        (rows must have at least one True value).
+        '''
+        keys = self.rng.rand(*mask.shape)
+        keys[~mask] = -1
+
+        return keys.argmax(axis=1)
+
+    def random_policy(self, games, marker):
+        '''
+        Same as RandomAI : random column with available moves.
+        '''
+        return self.random_choice(self.col_moves[games] > 0)
+
+    def set_policy(self, games, marker):
+        '''
+        Same strategy as the SetAI, for all games at once.
+        By order of preference :
+        - Vector that lets player win on this turn
+        - Vector that keeps opponent from winning on next turn
+        - Random vector with available position
+        Then, like the SetAI, the first available position in that vector is played.
+        '''
+        playable_cells = self.playable_cells(games)
+        playable_lines = playable_cells[:, self.lines].any(axis=2)
+        sums           = self.line_sums[games]
+
+        winning = playable_lines & (sums ==  (self.N_connect - 1)*marker)
+        losing  = playable_lines & (sums == -(self.N_connect - 1)*marker)
+
+        # Choose which set of vectors to pick from in each game
+        has_win  = winning.any(axis=1)
+        has_lose = losing.any(axis=1)
+        candidates = np.where(has_win[:, None], winning, np.where(has_lose[:, None], losing, playable_lines))
+
+        # Pick a vector, and the first available position in that vector
+        vector_choice   = self.random_choice(candidates)
+        vector_cells    = self.lines[vector_choice]
+        vector_playable = playable_cells[np.arange(len(games))[:, None], vector_cells]
+        position_choice = vector_cells[np.arange(len(games)), vector_playable.argmax(axis=1)]
+
+        return position_choice % self.width
+
+    def make_game_arrays(self):
+        '''
+        Same as C4.make_game_array for every game : (N, N_positions + 1) array with the
+        flattened grids followed by the winner marker.
+        '''
+        return np.hstack((self.grids.reshape(self.N_games, -1), self.winners[:, None])).astype(np.int64)
+
+    def make_game_records(self):
+        '''
+        List of gameRecord.GameRecord, one per game (moves, starting player, winner and player types).
+        '''
+        from gameRecord import GameRecord
+
+        return [GameRecord(self.moves[i, :self.N_moves[i]], start=self.starts[i], winner=self.winners[i],
+                           player_types=self.player_types, grid_size=(self.height, self.width), N_connect=self.N_connect)
+                for i in range(self.N_games)]
+
+    def save_games(self, output_file):
+        '''
+        Saves games to output_file, in the same csv format as C4.save_game.
+        If output_file doesn't exist, it will create it and make a header.
+        '''
+        header = ''
+        if (os.path.isfile(output_file) == False):
+            header = ','.join(['pos_{:02d}'.format(p) for p in range(1, self.N_positions + 1)] + ['winner'])
+
+        with open(output_file, 'ab') as f:
+            np.savetxt(f, self.make_game_arrays(), fmt='%d', delimiter=',', header=header, comments='')
+
+        pass
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+'''
+Benchmark suite for the engine, players and data I/O.
+
+Every benchmark is run a few times after a warmup, and the median is reported :
+- games/sec of C4.play_game for each gametype (learnset needs keras), and with one C4 reused for every game
+- time to build a Board
+- time per call of Board.update, Board.check_vectors, SetAI.move and LearningAI.move
+  (LearningAI with a small model made by tools.generate_CNN, needs keras)
+- games/sec and LearningAI.move time with a numpyModel.NumpyModel (same architecture, random weights)
+- games/sec written by C4.save_game (one file open per game, and through a gameIO.GameSink)
+- games/sec loaded by tools.load_shape_ttsplit (needs sklearn)
+- import time of the modules used by the workers (board, players, connect4Engine), in a new
+  interpreter and without numpy (imported first).  These have a budget (IMPORT_BUDGET, seconds) : 
+  a module over budget, or one that pulls in keras, tensorflow or sklearn, fails the run (exit code 1).
+
+Benchmarks that need a missing library are skipped.  Results are saved as JSON so they can be
+compared between commits, and --baseline fails (exit code 1) when a metric is worse than the
+baseline by more than --threshold.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --baseline bench.json --threshold 0.2
+'''
+
+# LIBRARIES
+import numpy as np
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from board import Board
+from connect4Engine import C4
+from players import SetAI, LearningAI
+from numpyModel import NumpyModel
+
+
+# Import time budget (seconds, numpy excluded) of the modules loaded by every worker
+IMPORT_BUDGET = {'board' : 0.05, 'players' : 0.05, 'connect4Engine' : 0.05}
+
+# Libraries that should never be imported by these modules
+HEAVY_MODULES = ('keras', 'tensorflow', 'torch', 'sklearn')
+
+
+def measure(run, N_calls, warmup=1, repeats=5):
+    '''
+    Call run() (which does N_calls operations) warmup times, then repeats times.
+    Returns the median time per operation in seconds.
+    run can return the time it measured itself (to leave out its setup), otherwise the whole call is timed.
+    '''
+    for i in range(warmup):
+        run()
+
+    times = []
+    for i in range(repeats):
+        start   = time.perf_counter()
+        elapsed = run()
+        if (elapsed is None):
+            elapsed = time.perf_counter() - start
+        times.append(elapsed/N_calls)
+
+    return float(np.median(times))
+
+
+def random_games(N_games, seed=0):
+    '''
+    Move lists of random games (column choices until someone wins or the grid is full),
+    played on Board objects so benchmarks can replay them.
+    '''
+    rng   = np.random.RandomState(seed)
+    games = []
+    for g in range(N_games):
+        board  = Board()
+        player = SetAI(p=1)
+        moves  = []
+        while (board.N_moves_left > 0):
+            player.choice = rng.choice(np.flatnonzero(board.col_moves))
+            board.update(player)
+            moves.append((player.marker, player.choice))
+            if board.check_vectors(player):
+                break
+            player = SetAI(p=-player.marker)
+        games.append(moves)
+    return games
+
+
+def play_positions(moves):
+    '''
+    Board after a list of moves, and the players who made them.
+    '''
+    board   = Board()
+    players = {1 : SetAI(p=1), -1 : SetAI(p=-1)}
+    for marker, choice in moves:
+        players[marker].choice = choice
+        board.update(players[marker])
+    return board, players
+
+
+def bench_games(gametype, N_games, keras_model=None, reuse=False, **kw):
+    def run():
+        if (reuse):
+            engine = C4(gametype=gametype, keras_model=keras_model)
+            for i in range(N_games):
+                engine.reset()
+                engine.play_game()
+        else:
+            for i in range(N_games):
+                C4(gametype=gametype, keras_model=keras_model).play_game()
+    return 1./measure(run, N_games, **kw)
+
+
+def bench_board(N_boards, **kw):
+    def run():
+        for i in range(N_boards):
+            Board()
+    return measure(run, N_boards, **kw)
+
+
+def bench_update(games, **kw):
+    N_calls = sum(len(g) for g in games)
+    players = {1 : SetAI(p=1), -1 : SetAI(p=-1)}
+
+    def run():
+        boards  = [Board() for g in games]
+        elapsed = 0.
+        for board, moves in zip(boards, games):
+            start = time.perf_counter()
+            for marker, choice in moves:
+                p = players[marker]
+                p.choice = choice
+                board.update(p)
+            elapsed += time.perf_counter() - start
+        return elapsed
+
+    return measure(run, N_calls, **kw)
+
+
+def bench_check_vectors(games, **kw):
+    positions = [play_positions(g[:len(g)//2 + 1]) for g in games]
+
+    def run():
+        for board, players in positions:
+            board.check_vectors(players[1])
+            board.check_vectors(players[-1])
+
+    return measure(run, 2*len(positions), **kw)
+
+
+def bench_move(player, games, **kw):
+    positions = [play_positions(g[:len(g)//2])[0] for g in games]
+
+    def run():
+        for board in positions:
+            player.move(board)
+
+    return measure(run, len(positions), **kw)
+
+
+def bench_save(N_games, tmp_dir, sink=False, **kw):
+    np.random.seed(0)
+    engines = [C4(gametype='setset') for i in range(N_games)]
+    for e in engines:
+        e.play_game()
+
+    def run():
+        output_file = os.path.join(tmp_dir, 'save.csv')
+        if os.path.isfile(output_file):
+            os.remove(output_file)
+
+        start = time.perf_counter()
+        if (sink):
+            from gameIO import GameSink
+            with GameSink(output_file) as s:
+                for e in engines:
+                    e.sink = s
+                    e.save_game()
+        else:
+            for e in engines:
+                e.save_game(output_file, verbose=False)
+        return time.perf_counter() - start
+
+    return 1./measure(run, N_games, **kw)
+
+
+def bench_load(N_games, tmp_dir, **kw):
+    from tools import load_shape_ttsplit
+    from batchEngine import BatchC4
+
+    data_file = os.path.join(tmp_dir, 'load.csv')
+    if os.path.isfile(data_file):
+        os.remove(data_file)
+    engine = BatchC4(N_games, seed=0)
+    engine.play_games()
+    engine.save_games(data_file)
+
+    return 1./measure(lambda : load_shape_ttsplit(data_file), N_games, **kw)
+
+
+def import_time(module, repeats=5):
+    '''
+    Median time (seconds) to import module in a new python process (after numpy, which every
+    module needs anyway), and the list of heavy libraries (HEAVY_MODULES) it imported.
+    '''
+    code = ('import sys, time, numpy\n'
+            't = time.perf_counter()\n'
+            'import {}\n'
+            'print(time.perf_counter() - t)\n'
+            'print(",".join(m for m in {} if m in sys.modules))').format(module, HEAVY_MODULES)
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    times = []
+    for i in range(repeats):
+        out = subprocess.run([sys.executable, '-c', code], cwd=here, capture_output=True, text=True, check=True).stdout.split('\n')
+        times.append(float(out[0]))
+        heavy = [m for m in out[1].split(',') if m]
+
+    return float(np.median(times)), heavy
+
+
+def check_imports(verbose=True):
+    '''
+    Import time of each module of IMPORT_BUDGET.  Returns (metrics, list of problems).
+    '''
+    metrics  = {}
+    problems = []
+    for module, budget in IMPORT_BUDGET.items():
+        t, heavy = import_time(module)
+        metrics['import_time_' + module] = {'value' : t, 'unit' : 's', 'higher_is_better' : False}
+        if(verbose): print('{:32s} {:12.6g} s (budget {} s)'.format('import_time_' + module, t, budget))
+
+        if (t > budget):
+            problems.append('{} takes {:.3f}s to import (budget {}s)'.format(module, t, budget))
+        if (len(heavy) > 0):
+            problems.append('{} imports {}'.format(module, ', '.join(heavy)))
+
+    return metrics, problems
+
+
+def run_benchmarks(quick=False, warmup=1, repeats=5, verbose=True):
+    '''
+    Run all benchmarks.  Returns a dictionary of metrics :
+    name -> {'value', 'unit', 'higher_is_better'} (or {'skipped' : reason}).
+    '''
+    scale   = 0.2 if quick else 1.
+    kw      = {'warmup' : warmup, 'repeats' : repeats}
+    metrics = {}
+    tmp_dir = tempfile.mkdtemp()
+
+    def add(name, unit, higher_is_better, fn, *args, **kwargs):
+        try:
+            value = fn(*args, **kwargs)
+            metrics[name] = {'value' : value, 'unit' : unit, 'higher_is_better' : higher_is_better}
+            if(verbose): print('{:32s} {:12.6g} {}'.format(name, value, unit))
+        except ImportError as e:
+            metrics[name] = {'skipped' : str(e)}
+            if(verbose): print('{:32s} skipped ({})'.format(name, e))
+
+    games = random_games(int(200*scale) + 1)
+    np.random.seed(0)
+
+    # Tiny model for the LearningAI (needs keras)
+    model = None
+    try:
+        from tools import generate_CNN
+        model = generate_CNN()
+    except ImportError as e:
+        model_error = str(e)
+
+    try:
+        add('games_per_sec_setset',     'games/s', True,  bench_games, 'setset',    int(100*scale) + 1, **kw)
+        add('games_per_sec_setrand',    'games/s', True,  bench_games, 'setrand',   int(100*scale) + 1, **kw)
+        add('games_per_sec_setset_reuse', 'games/s', True, bench_games, 'setset',   int(100*scale) + 1, reuse=True, **kw)
+        add('board_init_latency',       's/call', False, bench_board, int(1000*scale) + 1, **kw)
+        if (model is not None):
+            add('games_per_sec_learnset', 'games/s', True,  bench_games, 'learnset', int(20*scale) + 1, keras_model=model, **kw)
+            add('learningai_move_latency', 's/call', False, bench_move, LearningAI(model), games[:int(50*scale) + 1], **kw)
+        else:
+            for name in ('games_per_sec_learnset', 'learningai_move_latency'):
+                metrics[name] = {'skipped' : model_error}
+                if(verbose): print('{:32s} skipped ({})'.format(name, model_error))
+
+        numpy_model = NumpyModel.random(seed=0)
+        add('games_per_sec_learnset_numpy', 'games/s', True, bench_games, 'learnset', int(100*scale) + 1, keras_model=numpy_model, **kw)
+        add('learningai_numpy_move_latency', 's/call', False, bench_move, LearningAI(numpy_model), games, **kw)
+
+        add('board_update_latency',     's/call', False, bench_update, games, **kw)
+        add('check_vectors_latency',    's/call', False, bench_check_vectors, games, **kw)
+        add('setai_move_latency',       's/call', False, bench_move, SetAI(p=1), games, **kw)
+        add('save_game_per_sec',        'games/s', True, bench_save, int(500*scale) + 1, tmp_dir, **kw)
+        add('save_game_sink_per_sec',   'games/s', True, bench_save, int(500*scale) + 1, tmp_dir, sink=True, **kw)
+        add('load_shape_ttsplit_per_sec', 'games/s', True, bench_load, int(20000*scale), tmp_dir, **kw)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    return metrics
+
+
+def compare(metrics, baseline, threshold=0.1):
+    '''
+    List of metrics that got worse than the baseline by more than threshold (fraction).
+    '''
+    regressions = []
+    for name, m in metrics.items():
+        b = baseline.get(name)
+        if ('value' not in m) or (b is None) or ('value' not in b):
+            continue
+
+        if (m['higher_is_better']):
+            change = (b['value'] - m['value'])/b['value']
+        else:
+            change = (m['value'] - b['value'])/b['value']
+
+        if (change > threshold):
+            regressions.append((name, b['value'], m['value'], change))
+
+    return regressions
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the engine, players and data I/O.')
+    parser.add_argument('--output',    default=None, help='save results to this JSON file')
+    parser.add_argument('--baseline',  default=None, help='JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed slowdown (fraction) before failing')
+    parser.add_argument('--warmup',    type=int, default=1, help='warmup runs per benchmark')
+    parser.add_argument('--repeats',   type=int, default=5, help='measured runs per benchmark')
+    parser.add_argument('--quick',     action='store_true', help='smaller benchmarks')
+    args = parser.parse_args()
+
+    metrics = run_benchmarks(quick=args.quick, warmup=args.warmup, repeats=args.repeats)
+    import_metrics, import_problems = check_imports()
+    metrics.update(import_metrics)
+    results = {'time'     : time.strftime('%Y-%m-%d %H:%M:%S'),
+               'python'   : platform.python_version(),
+               'numpy'    : np.__version__,
+               'platform' : platform.platform(),
+               'metrics'  : metrics}
+
+    if (args.output is not None):
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    for p in import_problems:
+        print('IMPORT BUDGET', p)
+    if (len(import_problems) > 0):
+        sys.exit(1)
+
+    if (args.baseline is not None):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['metrics']
+
+        regressions = compare(metrics, baseline, args.threshold)
+        for name, before, after, change in regressions:
+            print('REGRESSION {} : {:.6g} -> {:.6g} ({:+.1%})'.format(name, before, after, change))
+        if (len(regressions) > 0):
+            sys.exit(1)
+        print('No regressions (threshold {:.0%})'.format(args.threshold))
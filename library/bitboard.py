@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+# import libraries
+from board import Board, InvalidMoveError
+
+class BitBoard(Board):
+    '''
+    Alternative Board object that keeps track of the game with bitboards.
+
+    Each player's tokens are stored as the bits of a single integer, and a third integer
+    (the mask) holds every occupied position.  Move application and win detection are then
+    done with a handful of shift-and-mask operations instead of looping over the vectors.
+
+    Bit layout (6x7 grid) : each column uses height+1 bits, counted from the bottom of the
+    column, the extra bit acting as a separator so shifts don't wrap into the next column.
+
+        6 13 20 27 34 41 48   <- separator row (always empty)
+        5 12 19 26 33 40 47
+        4 11 18 25 32 39 46
+        3 10 17 24 31 38 45
+        2  9 16 23 30 37 44
+        1  8 15 22 29 36 43
+        0  7 14 21 28 35 42
+
+    For the default grid size everything fits in 49 bits (a 64 bit word).  Python integers have
+    no size limit, so bigger grids work the same way (only slower once they pass 64 bits).
+
+    The object still exposes grid, col_moves, N_moves_left, winner, update(Player) and
+    check_vectors(Player), so it can be passed to C4 (board_class=BitBoard) and used by
+    the existing players.  The game grid is still kept up to date (one element per move)
+    for the LearningAI, and the vectors used by the SetAI are only built if a player
+    actually asks for them.
+    '''
+
+    # Constructor
+    def __init__(self, grid_size=(6,7), verbose=False, N_connect=4):
+
+        # Number of bits used per column and bottom bit of each column
+        self.col_bits   = grid_size[0] + 1
+        self.bottom_bit = [1 << (c*self.col_bits) for c in range(grid_size[1])]
+
+        # Shifts used to check for N_connect in a row (see win_shifts)
+        self.win_shifts = win_shifts(grid_size[0], N_connect)
+
+        # Grid dimensions, game grids and bookkeeping (same as Board, the vector views are 
+        # only made if they are asked for), reset also clears the bitboards.
+        Board.__init__(self, grid_size, verbose, N_connect)
+
+    def reset(self):
+        '''
+        Back to an empty board (see Board.reset).
+        '''
+        # Bitboards : one per player (indexed by marker) and the mask of occupied positions
+        self.bitboards = {1 : 0, -1 : 0}
+        self.mask      = 0
+
+        return Board.reset(self)
+
+    def update(self, Player):
+        '''
+        Same as Board.update, but the move is applied to the bitboards.
+        The grids are also updated so that the players can still look at them.
+        '''
+
+        # Extract column choice :
+        choice = Player.choice
+
+        # Double check to make sure it is a valid move:
+        if (choice < 0) or (choice >= self.width) or (self.col_moves[choice] == 0):
+            raise InvalidMoveError(self, Player)
+
+        # Bit of the lowest empty position in the column :
+        # adding the bottom bit to the column's mask carries into the next free position.
+        move_bit = (self.mask + self.bottom_bit[choice]) & ~self.mask
+
+        self.bitboards[Player.marker] |= move_bit
+        self.mask |= move_bit
+
+        # Update values in main grid and boolean grid
+        row = self.col_moves[choice] - 1
+        self.grid[row, choice] = Player.marker
+        self.bool_grid[row, choice] = False
+        if (row != 0):
+            self.bool_grid[row-1, choice] = True
+
+        # Update move counters
+        self.col_moves[choice] -= 1
+        self.N_moves_left -= 1
+
+        return 0
+
+    def check_vectors(self, Player):
+        '''
+        Check if the player has N_connect tokens in a row with bit shifts.
+        For each direction, pos & (pos >> shift) marks pairs of tokens,
+        and doing it again with 2*shift marks groups of four (see win_shifts).
+        '''
+        pos = self.bitboards[Player.marker]
+
+        for shifts in self.win_shifts:
+            m = pos
+            for s in shifts:
+                m &= m >> s
+            if (m):
+                self.winner = Player.marker
+                return True
+
+        return False
+
+
+# Shifts for each grid height and N_connect (see win_shifts)
+_win_shifts = {}
+
+def win_shifts(height, N_connect=4):
+    '''
+    Shifts that find N_connect tokens in a row, for each direction (vertical, horizontal,
+    diagonal (/) and diagonal (\)) : after m &= m >> s for every s of a direction, the bits left
+    in m mark the start of a group of N_connect.  Each step doubles the length of the groups
+    (without going past N_connect), so 4 in a row takes 2 shifts : (shift, 2*shift).
+    Returns a list of 4 tuples, shared between objects.
+    '''
+    key = (height, N_connect)
+    if key in _win_shifts:
+        return _win_shifts[key]
+
+    col_bits = height + 1
+    shifts   = []
+    for shift in (1, col_bits, col_bits + 1, col_bits - 1):
+        steps, length = [], 1
+        while (length < N_connect):
+            step = min(length, N_connect - length)
+            steps.append(step*shift)
+            length += step
+        shifts.append(tuple(steps))
+
+    _win_shifts[key] = shifts
+
+    return shifts
+
+
+def grid_to_bitboards(grid):
+    '''
+    Convert a game grid (Board.grid) to bitboards, with the same layout as BitBoard.
+    Returns ({1 : Player 1 bits, -1 : Player 2 bits}, mask of occupied positions).
+    '''
+    height, width = grid.shape
+    bitboards = {1 : 0, -1 : 0}
+
+    for c in range(width):
+        for r in range(height):
+            marker = int(grid[height - 1 - r, c])
+            if (marker != 0):
+                bitboards[marker] |= 1 << (c*(height + 1) + r)
+
+    return bitboards, bitboards[1] | bitboards[-1]
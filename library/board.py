@@ -2,32 +2,181 @@
 
 # import libraries
 import numpy as np
-from pprint import pprint
+
+
+class Geometry(object):
+    '''
+    Tables that only depend on the grid size and N_connect (number of pieces in a row to win).
+    They are built once per geometry by get_geometry and shared by every Board (and the other engines),
+    so none of the arrays should be modified.
+
+    lines          : (N_vectors, N_connect) flattened position indices (row*width + column) of every vector,
+                     in the same order as Board.vectors : rows, columns, diagonals going down towards
+                     the right and diagonals going up towards the right
+    cell_lines     : for each flattened position, the indices of the vectors going through it
+    line_slices    : for each vector, the slice of the flattened grid it covers (used to make views)
+    column_grid    : (height, width) column number of each position
+    first_column   : index of the first column vector (24 for connect 4 on a 6x7 grid)
+    first_diagonal : index of the first diagonal vector (45 for connect 4 on a 6x7 grid)
+    '''
+
+    # Constructor
+    def __init__(self, grid_size=(6,7), N_connect=4):
+        height, width = grid_size
+        n = N_connect
+
+        self.height      = height
+        self.width       = width
+        self.N_connect   = N_connect
+        self.N_positions = height*width
+
+        # Every vector is a run of n positions of the flattened grid, starting at 'start'
+        # with a constant step between positions (one entry per vector).
+        starts, steps = [], []
+
+        # Rows
+        for i in range(height):
+            for j in range(width - n + 1):
+                starts.append(i*width + j); steps.append(1)
+
+        # Columns
+        self.first_column = len(starts)
+        for i in range(width):
+            for j in range(height - n + 1):
+                starts.append(j*width + i); steps.append(width)
+
+        # Diagonals going down towards the right
+        self.first_diagonal = len(starts)
+        for i in range(height - n + 1):
+            for j in range(width - n + 1):
+                starts.append(i*width + j); steps.append(width + 1)
+
+        # Diagonals going up towards the right (flipped grid)
+        for i in range(height - n + 1):
+            for j in range(width - n + 1):
+                starts.append((height - 1 - i)*width + j); steps.append(1 - width)
+
+        starts = np.array(starts, dtype=np.int64)
+        steps  = np.array(steps, dtype=np.int64)
+        self.lines = starts[:, None] + steps[:, None]*np.arange(n)
+
+        # Slices (the stop of a backward slice that ends on position 0 has to be None)
+        self.line_slices = []
+        for start, step in zip(starts.tolist(), steps.tolist()):
+            stop = start + step*n
+            self.line_slices.append(slice(start, stop if stop >= 0 else None, step))
+
+        # Position -> vectors
+        incidence = np.zeros((self.N_positions, len(self.lines)), dtype=bool)
+        incidence[self.lines, np.arange(len(self.lines))[:, None]] = True
+        self.cell_lines = [np.flatnonzero(row) for row in incidence]
+
+        # Column number of each position
+        self.column_grid = np.zeros((height, width), dtype=np.int64) + np.arange(width)
+
+        for a in [self.lines, self.column_grid] + self.cell_lines:
+            a.flags.writeable = False
+
+
+# Geometries built so far, one entry per (grid size, N_connect) (see get_geometry)
+_geometries = {}
+
+def get_geometry(grid_size=(6,7), N_connect=4):
+    '''
+    Shared Geometry object of a grid size and N_connect (built the first time it is asked for).
+    '''
+    key = (int(grid_size[0]), int(grid_size[1]), int(N_connect))
+    if key not in _geometries:
+        _geometries[key] = Geometry(key[:2], key[2])
+
+    return _geometries[key]
+
+
+def get_lines(grid_size=(6,7), N_connect=4):
+    '''
+    Returns a (N_vectors, N_connect) integer array with the flattened position indices (row*width + column)
+    of every vector, in the same order as Board.vectors (see Geometry).
+    The array is built once per grid size and N_connect and shared, so it should not be modified.
+    '''
+    return get_geometry(grid_size, N_connect).lines
+
+
+def get_cell_lines(grid_size=(6,7), N_connect=4):
+    '''
+    Returns a list with, for each flattened position, the integer array of the vectors (rows of get_lines)
+    going through it.  Built once per grid size and N_connect and shared, like get_lines.
+    '''
+    return get_geometry(grid_size, N_connect).cell_lines
+
+
+class InvalidMoveError(Exception):
+    '''
+    Raised by Board.update when a player chooses a column that is full or doesn't exist.
+    Holds the offending game state (copy of the grid, choice, available columns and player info)
+    so that it can be logged or looked at later.
+    '''
+    def __init__(self, Board, Player):
+        self.choice      = Player.choice
+        self.available   = [i for i,v in enumerate(Board.col_moves) if v != 0]
+        self.marker      = Player.marker
+        self.player_type = getattr(Player, 'player_type', None)
+        self.player_name = getattr(Player, 'name', None)
+        self.grid        = Board.grid.copy()
+
+        Exception.__init__(self, 'Invalid move by {} ({}) : column {}, available columns {}'.format(
+            self.player_name, self.player_type, self.choice, self.available))
+
 
 class Board(object):
 
     # Constructor
-    def __init__(self, grid_size=(6,7), verbose=False):
+    def __init__(self, grid_size=(6,7), verbose=False, N_connect=4):
         
         # Define Grid/Board height width and number of positions
-        # this part was implemented in case we want to play games with different sizes.
-        # Complete implementation for this functionality is pending.
+        # Any grid size works, as well as any number of pieces in a row to win (N_connect),
+        # as long as it fits in the grid.
         self.height      = grid_size[0]
         self.width       = grid_size[1]
         self.N_positions = self.height*self.width
-        self.winner      = 0 # winner of game (p1 = 1, p2 =-1, tie=0
+        self.N_connect   = N_connect
+        if (N_connect > max(self.height, self.width)):
+            raise ValueError('Board : N_connect ({}) does not fit in a {}x{} grid'.format(N_connect, self.height, self.width))
+
+        # Tables shared by every Board with the same geometry
+        self.geometry = get_geometry(grid_size, N_connect)
 
         # Initialize game grids and vectors
         # Details in their respective functions
         self.init_grids(grid_size)
         self.init_vectors()
 
+        # Array to keep track of how many positions are left in each column
+        self.col_moves = np.zeros(self.width, dtype=np.int64)
+
+        # Empty board
+        self.reset()
+
+    def reset(self):
+        '''
+        Back to an empty board, reusing the arrays (and the vector views) of the current one,
+        so the same Board can be used for many games.
+        '''
+        self.grid[:]       = 0
+        self.bool_grid[:]  = False
+        self.bool_grid[-1] = True # Mark initial available positions
+        self.vector_sums[:] = 0
+        self.col_moves[:]   = self.height
+
         # Define number of moves left (same as N_positions for now)
         # Used to flag and break out of game loop if no players win.
         self.N_moves_left = int(self.N_positions)
+        self.winner       = 0 # winner of game (p1 = 1, p2 =-1, tie=0
 
-        # Array to keep track of how many positions are left in each column
-        self.col_moves = np.zeros(self.width, dtype=np.int64) + self.height
+        # Vectors affected by the last move and marker of the player who made it
+        self.last_vectors = self.cell_vectors[0][:0]
+        self.last_marker  = 0
+
+        return 0
 
     def init_grids(self, grid_size):
         '''
@@ -39,117 +188,66 @@ class Board(object):
         self.bool_grid : boolean numpy array with True values where players may place a piece, and 
         False values for filled or inaccessible positions.
         
-        self.col_grid : Holds the column number of each position on the grid.  This was made to make it easier
-        to look up columns when dealing with diagonals.
+        self.column_grid : Holds the column number of each position on the grid.  This was made to make it easier
+        to look up columns when dealing with diagonals.  It never changes, so it is shared between Boards
+        (see Geometry).
         '''
         
-        # Initialize grids to help manage the game
+        # Initialize grids to help manage the game (filled in by reset)
         self.grid          = np.zeros(grid_size) # Main game grid
         self.bool_grid     = np.zeros_like(self.grid, dtype=bool) # Grid for available moves
-        self.bool_grid[-1] = True # Mark initial available positions
 
         # Grid to hold column numbers
-        self.column_grid = [[i for i in range(self.width)] for j in range(self.height)] 
-        self.column_grid = np.array(self.column_grid)
+        self.column_grid = self.geometry.column_grid
 
         return 0
 
     def init_vectors(self):
         '''
             Vectors (as we call them) are an important part of the functionality of this code.
-            They provide views of sections of the main grids.  Each view is a 4 element section representing
+            They provide views of sections of the main grids.  Each view is a N_connect (4) element section representing
             a row, column, or diagonal.  The vectors for the game grid are used to see if a player has won, 
             while the boolean grid vectors are used in the decision process of the SetAI.  The vectors from 
             the column grid are simply used loop up which column each element of the the other vectors are in.
+
+            The position indices of every vector are the same for all Boards of a given size, so they are
+            built once (see Geometry) : self.cell_vectors lists the indices of the vectors going through
+            each position (flattened row*width + column), and self.vector_sums holds the running sum of every
+            vector.  This way Board.update only has to touch the vectors that go through the new piece, and 
+            check_vectors only has to look at those (4 to 13 vectors instead of all of them).
+
+            The views themselves (self.vectors, self.bool_vectors and self.column_vectors) are rarely needed
+            (the players work with the position indices), so they are only made the first time they are
+            asked for (see __getattr__ and make_views).
         '''
-        # Initialize lists to store vectors
-        self.vectors        = []
-        self.bool_vectors   = []
-        self.column_vectors = []
+        self.cell_vectors = self.geometry.cell_lines
 
-        # We split the work into three sections : row, column, and diagonal vectors
-        
-        # Initialize Row Vectors
-        for i, r in enumerate(self.grid):
-            # Loop over vector starting points
-            for j in range(self.width - 3):
-                # Make view of next 4 elements
-                grid_view = r[j:j+4].view()
-                bool_view = self.bool_grid[i][j:j+4].view()
-                col_view  = self.column_grid[i][j:j+4]
-                
-                # Append views to respective lists
-                self.vectors.append(grid_view)
-                self.bool_vectors.append(bool_view)
-                self.column_vectors.append(col_view)
-
-                
-        # For column vectors, we do pretty much the same thing as for the row vectors
-        # except we use the Transpose of the grid. 
-        grid_T = self.grid.transpose()
-        bool_T = self.bool_grid.transpose()
-        col_T  = self.column_grid.transpose()
-
-        # Loop over columns (rows in transpose of grid)
-        for i in range(len(grid_T)):
-            # Loop over vector starting points
-            for j in range(self.height - 3):
-                # Make views of the next 4 elements in each grid
-                grid_view = grid_T[i][j:j+4].view()
-                bool_view = bool_T[i][j:j+4].view()
-                col_view  = col_T[i][j:j+4]
-                
-                # Append views to respective lists
-                self.vectors.append(grid_view)
-                self.bool_vectors.append(bool_view)
-                self.column_vectors.append(col_view)
-
-        # Diagonal vectors got a little confusing but we split them up into 2 parts :
-        # Looking at the grid we start by diagonals going from the top left corner
-        # down towards the right.  We loop over these for each row and column.
-        # We then get diagonal vectors starting from the bottom left of the grid 
-        # going up towards the right.  To do this we flip the grid on it's y axis
-        # and do the same thing as before.  
-        
-        # To actually grab each diagonal we divide the grid into smaller 4x4 slices
-        # and use the numpy_arr.diagonal method
-
-        # Left-Right Down up Diagonals
-        max_offset = self.width - 4
-        for i in range(self.height - 3):
-            # Define grid-subset :
-            sub_grid = self.grid[i:i+4]
-            sub_bool = self.bool_grid[i:i+4]
-            sub_col  = self.column_grid[i:i+4]
- 
-            for j in range(max_offset + 1):
-                d_grid = sub_grid.diagonal(offset=j).view()
-                d_bool = sub_bool.diagonal(offset=j).view()
-                d_col  = sub_col.diagonal(offset=j).view()
-
-                self.vectors.append(d_grid)
-                self.bool_vectors.append(d_bool)
-                self.column_vectors.append(d_col)
-
-        # # Left-Right down up Diagonals
-        # Flip on y axis
-        flip_grid = np.flip(self.grid, axis=0)
-        flip_bool = np.flip(self.bool_grid, axis=0)
-        flip_col  = np.flip(self.column_grid, axis=0)
-        max_offset = self.width - 4
-        for i in range(self.height - 3):
-            # Define grid-subset :
-            sub_grid = flip_grid[i:i+4]
-            sub_bool = flip_bool[i:i+4]
-            sub_col  = flip_col[i:i+4]
-
-            for j in range(max_offset + 1):
-                d_grid = sub_grid.diagonal(offset=j).view()
-                d_bool = sub_bool.diagonal(offset=j).view()
-                d_col = sub_col.diagonal(offset=j).view()
-                self.vectors.append(d_grid)
-                self.bool_vectors.append(d_bool)
-                self.column_vectors.append(d_col)
+        # Running sums of each vector (updated in Board.update)
+        self.vector_sums = np.zeros(len(self.geometry.lines), dtype=np.int64)
+
+        return 0
+
+    def __getattr__(self, name):
+        '''
+        Only called when an attribute is missing : the vector views are made the first time they are requested.
+        '''
+        if name in ('vectors', 'bool_vectors', 'column_vectors'):
+            self.make_views()
+            return self.__dict__[name]
+
+        raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, name))
+
+    def make_views(self):
+        '''
+        Views of each vector over the flattened grids (slices, so they follow the grids as the game goes on).
+        '''
+        flat_grid = self.grid.reshape(-1)
+        flat_bool = self.bool_grid.reshape(-1)
+        flat_col  = self.column_grid.reshape(-1)
+
+        self.vectors        = [flat_grid[s] for s in self.geometry.line_slices]
+        self.bool_vectors   = [flat_bool[s] for s in self.geometry.line_slices]
+        self.column_vectors = [flat_col[s]  for s in self.geometry.line_slices]
 
         return 0
 
@@ -165,18 +263,8 @@ class Board(object):
         choice = Player.choice
 
         # Double check to make sure it is a valid move:
-        available = [i for i,v in enumerate(self.col_moves) if v != 0]
-
-        # Error Message and pause if nothing (ran into some problems while implementing)
-        if choice not in available:
-                print('Choice Error in Board.update')
-                print('available:', available)
-                print('player choice:', Player.choice)
-                print('playertype:', Player.player_type)
-                print('playername:', Player.name)
-                self.display_grid()
-                input()
-                return -1
+        if (choice < 0) or (choice >= self.width) or (self.col_moves[choice] == 0):
+            raise InvalidMoveError(self, Player)
 
         # Get row corresponding to the column choice
         row = self.col_moves[choice] - 1
@@ -187,38 +275,35 @@ class Board(object):
         if (row != 0):
             self.bool_grid[row-1, choice] = True
 
-        # Update number of moves left in that column :
-        if(self.col_moves[choice] > 0):
-            self.col_moves[choice] -= 1
+        # Update the sums of the vectors going through the new piece
+        self.last_vectors = self.cell_vectors[row*self.width + choice]
+        self.last_marker  = Player.marker
+        self.vector_sums[self.last_vectors] += Player.marker
 
-        # Another Error Message
-        elif self.col_moves[choice]  == 0:
-            print('Error : number of moves in that column {} is already 0'.format(choice))
-            return -1
-
-        # Update number of moves left (also an error message):
-        if (self.N_moves_left <= 0):
-            print('Error : there are no more moves')
-            return -1
-        else :
-            self.N_moves_left -= 1
+        # Update number of moves left in that column, and in the game
+        self.col_moves[choice] -= 1
+        self.N_moves_left -= 1
 
         return 0
 
     def check_vectors(self, Player):
         '''
-        Loop through all grid vectors to find if a player has won.
-        Returns True if so.
+        Find if a player has won.  Returns True if so.
         
-        Because Players are marked as 1 or -1, it gets the sum of the elements in a vector, 
-        and compares it to the target value of the player (4 or -4).
+        Because Players are marked as 1 or -1, the sum of the elements in a vector
+        is compared to the target value of the player (N_connect*marker : 4 or -4 for connect 4).
+        The sums are kept up to date by Board.update, so if the player made the last move
+        we only have to look at the vectors going through that piece.  Otherwise we look
+        at the sums of all vectors.
         '''
-        flag = False
-        for v in self.vectors:
-            if sum(v) == Player.target:
-                self.winner = Player.marker
-                flag = True
-                break
+        target = self.N_connect*Player.marker
+        if (self.last_marker == Player.marker):
+            flag = bool((self.vector_sums[self.last_vectors] == target).any())
+        else:
+            flag = bool((self.vector_sums == target).any())
+
+        if (flag):
+            self.winner = Player.marker
         return flag
 
 
@@ -240,7 +325,7 @@ class Board(object):
                 elif(self.grid[i][j] == 0):
                      display[i][j] = '_'
 
-        display = np.vstack((display, np.arange(7)))
+        display = np.vstack((display, np.arange(self.width)))
         for r in display:
             txt = ''
             for c in r :
@@ -256,12 +341,16 @@ class Board(object):
         Simply lists all the grid vectors and corresponding bool vectors side by side.
         Separates them into rows, columns and diagonals.
         '''
+        # Index of the first column and diagonal vectors (24 and 45 for a 6x7 grid)
+        first_column   = self.geometry.first_column
+        first_diagonal = self.geometry.first_diagonal
+
         for i in range(len(self.vectors)):
             if (i ==0):
                 print('ROWS')
-            if (i==24):
+            if (i==first_column):
                 print('COLUMNS')
-            if (i == 45):
+            if (i == first_diagonal):
                 print('DIAGONALS')
 
             print(self.vectors[i], self.bool_vectors[i])
@@ -2,11 +2,57 @@
 
 # LIBRARIES
 import numpy as np
+import logging
 import os
 
-from board import Board
+from board import Board, InvalidMoveError
+from gameRecord import GameRecord
 from players import *
 
+# Warnings of the engine (nothing is printed unless the application sets up logging)
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class ConsoleObserver(object):
+    '''
+    Displays a game as it is being played (what C4 used to print with verbose=True).
+    C4 sends events to its observer (if it has one) with notify(event, engine, player) :
+    start, turn (before each move), moved, win, invalid_move (with the error) and end.
+    Any object with a notify method can be used as an observer (ex: to log games).
+    '''
+
+    def __init__(self, pause=False):
+        self.pause = pause # Wait for a key between each move
+
+    def notify(self, event, engine, player=None, error=None):
+        if (event == 'start'):
+            p = engine.player_list
+            print('Game Type       :', engine.gametype)
+            print('Players         : {} ({}), {} ({})'.format(p[0].name, p[0].marker, p[1].name, p[1].marker))
+            print('Starting Player :', (p[0].name, p[0].player_type))
+
+        elif (event == 'turn'):
+            # Display Turn info (player, moves left, etc...) and board (before players choice)
+            print('Player: {}, Moves Left: {}'.format(player.name, engine.Board.N_moves_left))
+            engine.Board.display_grid()
+            if (self.pause) : input()
+
+        elif (event == 'moved'):
+            if (player.player_type == 'LearningAI'):
+                player.print_move_weights()
+
+        elif (event == 'win'):
+            print(player.name, 'wins!', '({})'.format(player.player_type))
+
+        elif (event == 'invalid_move'):
+            print(error)
+
+        elif (event == 'end'):
+            # print end game board
+            engine.Board.display_grid()
+
+
 class C4(object):
     '''
     Connect 4 Engine designed to be connected to other scripts.
@@ -15,26 +61,76 @@ class C4(object):
     the types of AIs playing.  types are passed as strings, options are :
     setset        : SetAI, SetAI
     setrand       : SetAI, RandomAI
+    searchset     : SearchAI, SetAI
     anything else : LearnAI, SetAI
+
+    board_class can be used to swap the Board object for another implementation
+    with the same interface (ex: bitboard.BitBoard, which is faster).
+
+    The same C4 object can play many games in a row : reset() clears the Board (without rebuilding it)
+    and shuffles the players again.
+        engine = C4(gametype='setset', sink=sink)
+        for n in range(N_games):
+            engine.play_game()
+            engine.save_game()
+            engine.reset()
+
+    grid_size and N_connect set the size of the grid and the number of pieces in a row needed
+    to win (6x7 and connect 4 by default).  The LearningAI needs a model trained on the same grid size.
+
+    sink is an optional gameIO.GameSink (buffered writer) used by save_game
+    when no output_file is given.  The same sink can be shared by many C4 objects.
+    With a gameRecord.MoveSink, the whole game is saved (moves, starting player, winner and
+    player types, see make_game_record) instead of the final grid.
+
+    profiler is an optional profiling.GameProfiler that times player moves, board updates,
+    win checks and saves (nothing is timed when it is None).
+
+    Nothing is printed or waited for unless an observer is given (verbose=True uses a ConsoleObserver).
+    Invalid moves (full or nonexistent column) raise a board.InvalidMoveError, or with on_invalid='record'
+    the game is stopped and the error (which holds the game state) is kept in self.invalid_move.
+    Stopped games have no winner but are not ties either, so save_game skips them.
+
+    players can be given directly as [Player 1, Player 2] (any Player objects, gametype is then only
+    used for display), and first sets the marker of the player who starts (1 or -1) instead of
+    shuffling the players (ex: tournament.py alternates it between games).  reset(first) changes it.
     '''
 
     # Constructor
-    def __init__(self, gametype=None, keras_model=None, verbose=False, pause=False,p1_name=None, p2_name=None):
+    def __init__(self, gametype=None, keras_model=None, verbose=False, pause=False,p1_name=None, p2_name=None, board_class=Board, sink=None, profiler=None, observer=None, on_invalid='raise', grid_size=(6,7), N_connect=4, players=None, first=None):
 
         # Parameters
         self.verbose     = verbose     # To display grid as the game is being played and other outputs
         self.pause       = pause       # To pause the game between each move
+        self.sink        = sink        # Buffered writer for save_game (optional)
+        self.profiler    = profiler    # Timing of each phase of the game (optional)
+        self.gametype    = gametype
+        self.on_invalid  = on_invalid  # 'raise' or 'record' (see class docstring)
+        self.invalid_move = None       # InvalidMoveError of the game (when recorded)
+        self.first       = first       # Marker of the starting player (None : random)
+
+        # Display / event observer (off by default)
+        if (observer is None) and (verbose):
+            observer = ConsoleObserver(pause)
+        self.observer = observer
    
         # Flag for breaking out of game loop (if winner or no more moves)
         self.flag = False
 
+        # Moves of the game (see play_game and make_game_record)
+        self.moves = []
+        self.start = 0
+
         # Instantiate Game Objects
 
         # Board/Grid
-        self.Board = Board()
+        self.Board = board_class(grid_size, N_connect=N_connect)
 
         # Players
-        if (gametype == "setset"):
+        if (players is not None):
+            p1, p2 = players
+
+        elif (gametype == "setset"):
             p1 = SetAI(p= 1)
             p2 = SetAI(p=-1)
 
@@ -42,6 +138,10 @@ class C4(object):
             p1 = RandomAI(p=1)
             p2 = SetAI(p=-1)
 
+        elif (gametype == 'searchset') :
+            p1 = SearchAI(p=1)
+            p2 = SetAI(p=-1)
+
         else:
             # LearningAI will not work if no model is provided
             p1 = LearningAI(p=1, keras_model=keras_model)
@@ -54,14 +154,41 @@ class C4(object):
             
         # Put players in a list and shuffle to randomize who starts
         self.player_list = [p1, p2]
-        np.random.shuffle(self.player_list)
+        self.order_players()
+
+        # Game info
+        if (self.observer is not None):
+            self.observer.notify('start', self)
+
+    def order_players(self):
+        '''
+        Put the starting player first in player_list (random unless self.first is set).
+        '''
+        if (self.first is None):
+            np.random.shuffle(self.player_list)
+        elif (self.player_list[0].marker != self.first):
+            self.player_list.reverse()
+
+        return 0
+
+    def reset(self, first=None):
+        '''
+        Get ready for a new game : empty Board, new random starting player
+        (or the player with marker first, see class docstring).
+        '''
+        self.Board.reset()
+        self.flag = False
+        self.invalid_move = None
+        self.moves = []
+
+        if (first is not None):
+            self.first = first
+        self.order_players()
 
-        # Print stuff if verbose
-        if(self.verbose):
-            print('Game Type       :', gametype)
-            print('Players         : {} ({}), {} ({})'.format(self.player_list[0].name, self.player_list[0].marker, self.player_list[1].name, self.player_list[1].marker))
-            print('Starting Player :', (self.player_list[0].name, self.player_list[0].player_type))
+        if (self.observer is not None):
+            self.observer.notify('start', self)
 
+        return 0
 
     def play_game(self):
         '''
@@ -71,38 +198,57 @@ class C4(object):
         # Move counter (various purposes)
         move = 0
 
-        for i in range(21):                 # Main Game loop
+        # Columns played, in order, and the marker of the starting player (see make_game_record)
+        self.moves = []
+        self.start = self.player_list[0].marker
+
+        # Profiler (see profiling.GameProfiler) and observer
+        prof = self.profiler
+        obs  = self.observer
+
+        for i in range((self.Board.N_positions + 1)//2): # Main Game loop (one round per pair of moves)
             for player in self.player_list: # Loop over player turns
                 move += 1               # Update move number
 
-                if (self.verbose):
-                    # Display Turn info (player, moves left, etc...) and board (before players choice)
-                    txt = 'Player: {}, Moves Left: {}'.format(player.name, self.Board.N_moves_left)
-                    print(txt)
-                    self.Board.display_grid()
-                    if (self.pause) : input()
+                if (obs is not None): obs.notify('turn', self, player)
 
                 # Player chooses which column to play in
-                player.move(self.Board) 
+                if (prof is None): player.move(self.Board)
+                else: prof.call('move', player, player.move, self.Board)
 
-                if(player.player_type == 'LearningAI' and self.verbose==True):
-                    player.print_move_weights()
+                if (obs is not None): obs.notify('moved', self, player)
                 
                 # Board updates based on player's choice
-                self.Board.update(player) 
+                try:
+                    if (prof is None): self.Board.update(player)
+                    else: prof.call('update', player, self.Board.update, player)
+                except InvalidMoveError as error:
+                    if (self.on_invalid != 'record'):
+                        raise
+                    # Stop the game and keep the error
+                    self.invalid_move = error
+                    if (obs is not None): obs.notify('invalid_move', self, player, error=error)
+                    self.flag = True
+                    break
 
+                self.moves.append(int(player.choice))
                 
                 # Check if player has won 
-                self.flag = self.Board.check_vectors(player)
+                if (prof is None): self.flag = self.Board.check_vectors(player)
+                else: self.flag = prof.call('check_vectors', player, self.Board.check_vectors, player)
 
                 # Break out of loop if player has won (don't go to next players turn)
                 if (self.flag):
-                    if(self.verbose) :
-                        print(player.name, 'wins!', '({})'.format(player.player_type))
+                    if (obs is not None): obs.notify('win', self, player)
                     
                     self.Board.winner = player.player # save winner
                     break
 
+                # Grid is full (can happen on the first player's turn when the number of positions is odd)
+                if(self.Board.N_moves_left == 0):
+                    self.flag = True
+                    break
+
                 # END PLAYER LOOP
                   
             # Check if there are any mores moves
@@ -114,16 +260,49 @@ class C4(object):
 
             # END MAIN GAME LOOP
 
-        # print end game board
-        if (self.verbose):
-            self.Board.display_grid()
+        if (prof is not None):
+            prof.game_done()
+
+        if (obs is not None):
+            obs.notify('end', self)
 
-    def save_game(self, output_file, verbose=True):
+    def save_game(self, output_file=None, verbose=False):
         '''
         Saves game to output_file.
         If output_file doesn't exist, it will create it and make a header.
+        If no output_file is given, the game is added to self.sink (buffered, see gameIO.GameSink).
+        verbose prints the name of the file the game is saved to.
+
+        A game stopped by an invalid move (on_invalid='record') is not saved : its winner is still 0
+        and it would read as a tie.  Returns 0 when the game is saved and 1 when it is skipped.
         '''
-        
+        if (self.invalid_move is not None):
+            logger.warning('C4.save_game : game stopped by an invalid move (%s), not saved', self.invalid_move)
+            return 1
+
+        if (self.profiler is not None):
+            return self.profiler.call('save_game', None, self.write_game, output_file, verbose)
+
+        return self.write_game(output_file, verbose)
+
+    def write_game(self, output_file, verbose):
+        '''
+        Does the work for save_game.
+        '''
+
+        # Buffered writer : the sink takes care of the file and header
+        if (output_file is None):
+            if (self.sink is None):
+                raise ValueError('C4.save_game : no output_file given and no sink set')
+            if hasattr(self.sink, 'write_record'):
+                self.sink.write_record(self.make_game_record())
+            else:
+                self.sink.write(self.make_game_array(self.Board))
+            return 0
+
+        # Create Game array (see function)
+        game_array = self.make_game_array(self.Board)
+
         # Check to see if the output_file already exists
         # if not, create it with a header
         # if so, just add row to the file
@@ -137,17 +316,8 @@ class C4(object):
             f.write(header)
             f.close()
 
-        # Create Game array (see function)
-        game_array = self.make_game_array(Board)
-
         # Convert Game Array to csv line
-        txt = ''
-        for i in game_array:
-            txt += '{},'.format(str(i))
-            
-        # Take of excess comma from loop and add an end line character
-        txt = txt.strip(',')
-        txt += '\n'
+        txt = ','.join([str(i) for i in game_array]) + '\n'
 
         # Save to ouput file
         if(verbose==True): print('saving game to', output_file)
@@ -155,14 +325,14 @@ class C4(object):
         f.write(txt)
         f.close()
 
-        pass
+        return 0
                   
     def create_header(self):
         '''
         Creates header for csv file (string)
-        This is its own function in case we implement variable grid sizes.
+        Columns are named after the positions of the grid, so the header depends on the grid size.
         '''
-        N_positions = 42
+        N_positions = self.Board.N_positions
         header      = ''
         
         for p in range(1, N_positions + 1):
@@ -186,4 +356,16 @@ class C4(object):
         game_array.append(self.Board.winner)
 
         return game_array
-                  
+
+    def make_game_record(self):
+        '''
+        The last game as a gameRecord.GameRecord (moves in order, starting player, winner and player types).
+        Raises a ValueError for a game stopped by an invalid move (it has no result to record).
+        '''
+        if (self.invalid_move is not None):
+            raise ValueError('C4.make_game_record : game stopped by an invalid move ({})'.format(self.invalid_move))
+
+        types = {p.marker : p.player_type for p in self.player_list}
+
+        return GameRecord(self.moves, start=self.start, winner=self.Board.winner, player_types=(types[1], types[-1]),
+                          grid_size=(self.Board.height, self.Board.width), N_connect=self.Board.N_connect)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+'''
+Position deduplication index for game datasets.
+
+SetAI self play ends on the same grids (or their mirror images) over and over.  PositionIndex
+reads game files in a streaming pass and keeps one entry per canonical position (a grid and its
+mirror image are the same position, see inference.canonical_positions) with the number of
+games that ended on it and how many were won by each player.
+
+The index can then be exported as a deduplicated game file (one row per position, labeled with
+the most common result) along with the statistics of each row, to be used as sample weights
+or soft labels.  New shards can be added to a saved index at any time, and indexes can be merged.
+
+Usage from a script :
+    index = PositionIndex.load('index.npz')      # or PositionIndex() for a new one
+    index.add_file('data/shard_00012.csv')
+    index.save('index.npz')
+    index.export('dedup.c4b')
+
+Usage from the command line (adds the files to the index, creating it if needed) :
+    python dedup.py index.npz data/shard_*.csv --export dedup.c4b
+'''
+
+# LIBRARIES
+import numpy as np
+import argparse
+import os
+
+from gameIO import iter_game_chunks, BinaryGameSink, GameSink
+from inference import canonical_positions
+
+
+class PositionIndex(object):
+    '''
+    Hash index : canonical position key -> row in the grids and stats arrays.
+    stats columns are : number of games, Player 1 wins, ties, Player 2 wins.
+    '''
+
+    # Constructor
+    def __init__(self, grid_size=(6,7)):
+        self.grid_size = grid_size
+        self.rows      = {}   # key -> row
+        self.files     = []   # Files added to the index (so they are not counted twice)
+
+        # Arrays grow as needed, only the first len(self.rows) rows are used
+        self.grids = np.zeros((1024, grid_size[0], grid_size[1]), dtype=np.int8)
+        self.stats = np.zeros((1024, 4), dtype=np.int64)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def N_games(self):
+        return int(self.stats[:len(self.rows), 0].sum())
+
+    def grow(self, N):
+        '''
+        Make room for at least N rows.
+        '''
+        if (N > len(self.grids)):
+            size = max(N, 2*len(self.grids))
+            self.grids = np.concatenate((self.grids, np.zeros((size - len(self.grids),) + self.grids.shape[1:], dtype=np.int8)))
+            self.stats = np.concatenate((self.stats, np.zeros((size - len(self.stats), 4), dtype=np.int64)))
+
+    def add(self, X, winners, counts=None):
+        '''
+        Add games (grids X, shape (N, height, width) or (N, height, width, 1), and their winners).
+        counts : optional (N, 4) statistics of each row (see class docstring), used when merging indexes.
+        '''
+        X = np.asarray(X).reshape(len(X), self.grid_size[0], self.grid_size[1])
+        keys, mirrored = canonical_positions(X)
+
+        # Rows of each game (new positions get new rows)
+        rows = np.zeros(len(keys), dtype=np.int64)
+        for i, k in enumerate(keys):
+            r = self.rows.get(k)
+            if (r is None):
+                r = len(self.rows)
+                self.rows[k] = r
+                self.grow(r + 1)
+                self.grids[r] = X[i, :, ::-1] if mirrored[i] else X[i]
+            rows[i] = r
+
+        # Game statistics
+        if (counts is None):
+            winners = np.asarray(winners)
+            counts  = np.zeros((len(X), 4), dtype=np.int64)
+            counts[:, 0] = 1
+            counts[:, 1] = winners == 1
+            counts[:, 2] = winners == 0
+            counts[:, 3] = winners == -1
+        np.add.at(self.stats, rows, counts)
+
+        return 0
+
+    def add_file(self, filename, chunk_size=100000):
+        '''
+        Add every game of a file (csv or .c4b) in a streaming pass.
+        Files already in the index are skipped.
+        '''
+        name = os.path.abspath(filename)
+        if name in self.files:
+            return 0
+
+        for X, winners in iter_game_chunks(filename, chunk_size, self.grid_size):
+            self.add(X, winners)
+
+        self.files.append(name)
+
+        return 0
+
+    def merge(self, other):
+        '''
+        Add the entries of another index (ex: built on other shards, in another process).
+        '''
+        N = len(other)
+        self.add(other.grids[:N], None, counts=other.stats[:N])
+        self.files += [f for f in other.files if f not in self.files]
+
+        return 0
+
+    def winners(self):
+        '''
+        Most common result of each position (ties between results go to 0).
+        '''
+        stats  = self.stats[:len(self.rows)]
+        result = np.array([1, 0, -1], dtype=np.int8)[stats[:, 1:].argmax(axis=1)]
+
+        # Equal number of wins for both players
+        result[stats[:, 1] == stats[:, 3]] = 0
+
+        return result
+
+    def export(self, output_file, stats_file=None):
+        '''
+        Write one row per position to output_file (.c4b for binary, csv otherwise),
+        with the most common result as the winner.
+        The statistics of each row (same order) are saved to stats_file (defaults to output_file + '.stats.npz') :
+        weights (number of games) and p1_win_rate (soft label).
+        Returns the number of rows.
+        '''
+        N = len(self.rows)
+        if os.path.isfile(output_file):
+            os.remove(output_file)
+
+        sink = BinaryGameSink(output_file, grid_size=self.grid_size) if output_file.endswith('.c4b') else GameSink(output_file)
+        with sink:
+            sink.write_many(np.hstack((self.grids[:N].reshape(N, -1), self.winners()[:, None])))
+
+        stats = self.stats[:N]
+        stats_file = output_file + '.stats.npz' if stats_file is None else stats_file
+        np.savez(stats_file, weights=stats[:, 0], p1_wins=stats[:, 1], ties=stats[:, 2], p2_wins=stats[:, 3],
+                 p1_win_rate=stats[:, 1]/np.maximum(stats[:, 0], 1))
+
+        return N
+
+    def save(self, path):
+        '''
+        Save the index (to keep adding shards to it later).
+        '''
+        N = len(self.rows)
+
+        # Keys as rows of bytes (two packed bitboards, see inference.position_keys), also for an empty index
+        key_len = (2*self.grid_size[0]*self.grid_size[1] + 7)//8
+        keys    = np.zeros((N, key_len), dtype=np.uint8)
+        for k, r in self.rows.items():
+            keys[r] = np.frombuffer(k, dtype=np.uint8)
+
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, keys=keys, grids=self.grids[:N], stats=self.stats[:N],
+                     files=np.array(self.files, dtype=str), grid_size=np.array(self.grid_size))
+        os.replace(path + '.tmp', path)
+
+    @staticmethod
+    def load(path):
+        '''
+        Load a saved index.
+        '''
+        data  = np.load(path)
+        index = PositionIndex(tuple(int(s) for s in data['grid_size']))
+        N     = len(data['keys'])
+
+        index.grow(N)
+        index.grids[:N] = data['grids']
+        index.stats[:N] = data['stats']
+        index.rows      = {k.tobytes() : r for r, k in enumerate(data['keys'])}
+        index.files     = data['files'].tolist()
+
+        return index
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Build or update a deduplicated position index over game files.')
+    parser.add_argument('index', help='index file (.npz), created if it does not exist')
+    parser.add_argument('files', nargs='*', help='game files to add (csv or .c4b)')
+    parser.add_argument('--export', default=None, help='write the deduplicated dataset to this file')
+    args = parser.parse_args()
+
+    index = PositionIndex.load(args.index) if os.path.isfile(args.index) else PositionIndex()
+    for f in args.files:
+        index.add_file(f)
+        print('added {} ({} positions, {} games)'.format(f, len(index), index.N_games()))
+    index.save(args.index)
+
+    if (args.export is not None):
+        print('exported {} positions to {}'.format(index.export(args.export), args.export))
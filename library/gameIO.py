@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+
+# LIBRARIES
+import numpy as np
+import itertools
+import os
+import struct
+
+
+def make_header(N_positions=42):
+    '''
+    Creates header for csv game files (string) : pos_01, ..., pos_N, winner
+    '''
+    cols = ['pos_{:02d}'.format(p) for p in range(1, N_positions + 1)]
+    return ','.join(cols + ['winner']) + '\n'
+
+
+class GameSink(object):
+    '''
+    Buffered writer for game csv files (same format as C4.save_game).
+
+    The file is kept open and rows are stored in memory until flush_size games
+    have been written, at which point they are all written at once.
+    The header is written when the file is new (or empty).
+    Data is flushed when the sink is closed, so it should either be closed or used
+    as a context manager :
+
+        with GameSink('games.csv') as sink:
+            for n in range(1000):
+                engine = C4(gametype='setset', sink=sink)
+                engine.play_game()
+                engine.save_game()
+    '''
+
+    # Constructor
+    def __init__(self, output_file, flush_size=1000, header=None):
+        self.output_file = output_file
+        self.flush_size  = flush_size
+        self.header      = header  # Made from the length of the first row if None
+        self.buffer      = []
+        self.N_games     = 0       # Number of games written (including buffered ones)
+
+        self.f = open(output_file, 'a')
+        self.needs_header = (self.f.tell() == 0)
+
+    def write(self, game_array):
+        '''
+        Add a game (list of integers, see C4.make_game_array) to the buffer.
+        '''
+        self.buffer.append(','.join([str(int(i)) for i in game_array]) + '\n')
+        self.N_games += 1
+
+        if (self.needs_header and self.header is None):
+            self.header = make_header(len(game_array) - 1)
+
+        if (len(self.buffer) >= self.flush_size):
+            self.flush()
+
+        pass
+
+    def write_many(self, game_arrays):
+        '''
+        Add several games at once (ex: BatchC4.make_game_arrays()).
+        '''
+        for g in game_arrays:
+            self.write(g)
+
+        pass
+
+    def flush(self):
+        '''
+        Write buffered rows to the file.
+        '''
+        if (self.needs_header and self.header is not None):
+            self.f.write(self.header)
+            self.needs_header = False
+
+        if (len(self.buffer) > 0):
+            self.f.write(''.join(self.buffer))
+            self.buffer = []
+
+        self.f.flush()
+
+        pass
+
+    def close(self):
+        '''
+        Flush remaining rows and close the file.
+        '''
+        if not self.f.closed:
+            self.flush()
+            self.f.close()
+
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        # Last chance to save buffered games if the sink was never closed
+        if hasattr(self, 'f'):
+            self.close()
+
+
+# Binary game files
+#
+# Small fixed size header followed by one record per game :
+#   header : magic (4 bytes, b'C4GB'), version (uint16), height (uint8), width (uint8),
+#            record size in bytes (uint16), 6 reserved bytes  -> 16 bytes
+#   record : height*width int8 cells (flattened grid, 1, -1 or 0) followed by the winner (int8)
+# The number of games is not stored, it is given by the file size, so games can simply be appended.
+BINARY_MAGIC   = b'C4GB'
+BINARY_VERSION = 1
+HEADER_FORMAT  = '<4sHBBH6x'
+HEADER_SIZE    = struct.calcsize(HEADER_FORMAT)
+
+
+def read_binary_header(filename):
+    '''
+    Returns (height, width, record_size) of a binary game file.
+    '''
+    with open(filename, 'rb') as f:
+        raw = f.read(HEADER_SIZE)
+
+    if (len(raw) < HEADER_SIZE):
+        raise ValueError('{} is not a binary game file (header too short)'.format(filename))
+
+    magic, version, height, width, record_size = struct.unpack(HEADER_FORMAT, raw)
+    if (magic != BINARY_MAGIC) or (version != BINARY_VERSION):
+        raise ValueError('{} is not a binary game file (version {})'.format(filename, BINARY_VERSION))
+
+    return height, width, record_size
+
+
+class BinaryGameSink(GameSink):
+    '''
+    Same as GameSink, but games are written in the binary format (see load_binary_games).
+    Can be passed to C4 as its sink.
+    '''
+
+    # Constructor
+    def __init__(self, output_file, flush_size=1000, grid_size=(6,7)):
+        self.output_file = output_file
+        self.flush_size  = flush_size
+        self.grid_size   = grid_size
+        self.record_size = grid_size[0]*grid_size[1] + 1
+        self.buffer      = []
+        self.N_buffered  = 0 # Games in the buffer (write_many adds a whole array at once)
+        self.N_games     = 0
+
+        self.f = open(output_file, 'ab')
+
+        # New file : write header, otherwise make sure we are appending to the same kind of file
+        if (self.f.tell() == 0):
+            self.f.write(struct.pack(HEADER_FORMAT, BINARY_MAGIC, BINARY_VERSION, grid_size[0], grid_size[1], self.record_size))
+        elif (read_binary_header(output_file) != (grid_size[0], grid_size[1], self.record_size)):
+            self.f.close()
+            raise ValueError('{} holds games with a different grid size'.format(output_file))
+
+    def write(self, game_array):
+        '''
+        Add a game (flattened grid followed by the winner, see C4.make_game_array) to the buffer.
+        '''
+        self.buffer.append(np.asarray(game_array, dtype=np.int8))
+        self.N_games    += 1
+        self.N_buffered += 1
+
+        if (self.N_buffered >= self.flush_size):
+            self.flush()
+
+        pass
+
+    def write_many(self, game_arrays):
+        '''
+        Add several games at once (ex: BatchC4.make_game_arrays()).
+        '''
+        game_arrays = np.asarray(game_arrays, dtype=np.int8).reshape(-1, self.record_size)
+        self.buffer.append(game_arrays)
+        self.N_games    += len(game_arrays)
+        self.N_buffered += len(game_arrays)
+
+        if (self.N_buffered >= self.flush_size):
+            self.flush()
+
+        pass
+
+    def flush(self):
+        '''
+        Write buffered games to the file.
+        '''
+        if (len(self.buffer) > 0):
+            self.f.write(b''.join([b.tobytes() for b in self.buffer]))
+            self.buffer     = []
+            self.N_buffered = 0
+
+        self.f.flush()
+
+        pass
+
+
+def load_binary_games(filename):
+    '''
+    Memory map a binary game file.
+    Returns (X, winners) where X is a (N_games, height, width, 1) int8 view of the grids
+    (ready for the Conv2D models) and winners a (N_games,) int8 view of the winners.
+    Nothing is read or copied until the arrays are actually used.
+    '''
+    height, width, record_size = read_binary_header(filename)
+    N_games = (os.path.getsize(filename) - HEADER_SIZE)//record_size
+
+    if (N_games == 0):
+        return np.zeros((0, height, width, 1), dtype=np.int8), np.zeros(0, dtype=np.int8)
+
+    records = np.memmap(filename, dtype=np.int8, mode='r', offset=HEADER_SIZE, shape=(N_games, record_size))
+
+    X       = records[:, :height*width].reshape(N_games, height, width, 1)
+    winners = records[:, height*width]
+
+    return X, winners
+
+
+def csv_to_binary(csv_file, binary_file, grid_size=(6,7), chunk_size=100000):
+    '''
+    Convert a csv game file (C4.save_game format) to the binary format.
+    The csv file is read chunk_size lines at a time.
+    '''
+    with open(csv_file, 'r') as f, BinaryGameSink(binary_file, grid_size=grid_size) as sink:
+        f.readline() # header
+
+        while True:
+            lines = list(itertools.islice(f, chunk_size))
+            if (len(lines) == 0):
+                break
+            sink.write_many(np.loadtxt(lines, delimiter=',', dtype=np.int8, ndmin=2))
+            sink.flush()
+
+    return sink.N_games
+
+
+# Streaming
+
+def iter_game_chunks(filename, chunk_size=100000, grid_size=(6,7)):
+    '''
+    Read a game file (csv, binary .c4b, or move file .c4m) chunk_size games at a time.
+    Yields (X, winners) with X of shape (N, height, width, 1) and winners of shape (N,), both int8.
+    Only one chunk is held in memory at a time.  The games of move files are replayed to their final grid
+    (gameRecord.iter_game_records gives the moves themselves, ex: for the positions of each game).
+    '''
+    if filename.endswith('.c4m'):
+        from gameRecord import iter_game_records
+        records = iter_game_records(filename)
+        while True:
+            chunk = list(itertools.islice(records, chunk_size))
+            if (len(chunk) == 0):
+                break
+            X = np.array([r.final_grid() for r in chunk], dtype=np.int8)
+            yield X[..., None], np.array([r.winner for r in chunk], dtype=np.int8)
+        return
+
+    if filename.endswith('.c4b'):
+        X, winners = load_binary_games(filename)
+        for start in range(0, len(X), chunk_size):
+            yield np.array(X[start:start + chunk_size]), np.array(winners[start:start + chunk_size])
+        return
+
+    with open(filename, 'r') as f:
+        f.readline() # header
+        while True:
+            lines = list(itertools.islice(f, chunk_size))
+            if (len(lines) == 0):
+                break
+            data = np.loadtxt(lines, delimiter=',', dtype=np.int8, ndmin=2)
+            yield data[:, :-1].reshape(len(data), grid_size[0], grid_size[1], 1), data[:, -1]
+
+
+def hash_games(X):
+    '''
+    Deterministic 64 bit hash of each game grid (same grid -> same hash, on any machine or run).
+    X : (N, ...) int8 array of grids.
+    '''
+    cells = X.reshape(len(X), -1).astype(np.uint64) + np.uint64(2) # 1, 2 or 3 (int8 -1 wraps to 1)
+    h = np.zeros(len(X), dtype=np.uint64) + np.uint64(14695981039346656037)
+
+    # FNV-1a style mixing over the cells (overflow wraps around, as intended)
+    with np.errstate(over='ignore'):
+        for c in cells.T:
+            h = (h ^ c)*np.uint64(1099511628211)
+        h ^= h >> np.uint64(33)
+        h *= np.uint64(0xff51afd7ed558ccd)
+        h ^= h >> np.uint64(33)
+
+    return h
+
+
+def split_mask(X, test_size=0.3):
+    '''
+    Boolean mask, True for the games that belong to the test set.
+    The assignment only depends on the grid itself (see hash_games), so it never changes
+    between epochs or runs, and duplicate games always end up on the same side.
+    '''
+    u = (hash_games(X) >> np.uint64(11)).astype(np.float64)/float(1 << 53)
+    return u < test_size
+
+
+def stream_batches(filename, batch_size=32, subset='train', test_size=0.3, shuffle_buffer=0,
+                   chunk_size=100000, loop=False, seed=None, grid_size=(6,7)):
+    '''
+    Generator of (X, y) training batches read from a game file in chunks, so the dataset 
+    does not have to fit in memory.  
+    X : (batch_size, height, width, 1) float32 grids
+    y : (batch_size,) float32 labels, 1 if Player 1 won and 0 otherwise (same as load_shape_ttsplit)
+
+    subset         : 'train', 'test' or 'all' (see split_mask for the train/test assignment)
+    shuffle_buffer : games are shuffled through a buffer of this many games (0 for no shuffling)
+    loop           : start over at the end of the file (for keras, which expects endless generators)
+
+    Can be passed directly to the fit method of the keras models made by tools.generate_CNN :
+        steps = count_games(filename, subset='train')//32
+        model.fit(stream_batches(filename, loop=True, shuffle_buffer=10000), steps_per_epoch=steps, epochs=10)
+    '''
+    rng = np.random.RandomState(seed)
+
+    buffer_X = np.zeros((0, grid_size[0], grid_size[1], 1), dtype=np.int8)
+    buffer_y = np.zeros(0, dtype=np.int8)
+
+    while True:
+        for X, winners in iter_game_chunks(filename, chunk_size, grid_size):
+
+            # Keep games from the requested subset
+            if (subset != 'all'):
+                test = split_mask(X, test_size)
+                keep = test if subset == 'test' else ~test
+                X, winners = X[keep], winners[keep]
+
+            buffer_X = np.concatenate((buffer_X, X))
+            buffer_y = np.concatenate((buffer_y, winners))
+
+            # Shuffle, and only send out what exceeds the buffer size
+            if (shuffle_buffer > 0):
+                order = rng.permutation(len(buffer_X))
+                buffer_X, buffer_y = buffer_X[order], buffer_y[order]
+
+            N_out = max(len(buffer_X) - shuffle_buffer, 0)//batch_size*batch_size
+            for start in range(0, N_out, batch_size):
+                yield (buffer_X[start:start + batch_size].astype(np.float32),
+                       (buffer_y[start:start + batch_size] == 1).astype(np.float32))
+
+            buffer_X, buffer_y = buffer_X[N_out:], buffer_y[N_out:]
+
+        if not loop:
+            break
+
+    # Remaining games at the end of the file
+    for start in range(0, len(buffer_X), batch_size):
+        yield (buffer_X[start:start + batch_size].astype(np.float32),
+               (buffer_y[start:start + batch_size] == 1).astype(np.float32))
+
+
+def count_games(filename, subset='all', test_size=0.3, chunk_size=100000, grid_size=(6,7)):
+    '''
+    Number of games in a file (or in its train/test subset), in a streaming pass.
+    Useful to get steps_per_epoch for stream_batches.
+    '''
+    N = 0
+    for X, winners in iter_game_chunks(filename, chunk_size, grid_size):
+        if (subset == 'all'):
+            N += len(X)
+        else:
+            test = split_mask(X, test_size)
+            N += int(test.sum()) if subset == 'test' else int((~test).sum())
+    return N
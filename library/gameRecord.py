@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+'''
+Move-sequence game records.
+
+Game files (csv or .c4b, see gameIO) only hold the final grid of each game, so the order of the
+moves is lost.  A GameRecord keeps the whole game : the column of every move, which player started,
+the winner and the type of each player.  Any position of the game can be rebuilt from it (replay).
+
+Records are saved in move files (.c4m) :
+    header : magic (4 bytes, b'C4GM'), version (uint16), height (uint8), width (uint8),
+             N_connect (uint8), bits per move (uint8), 6 reserved bytes  -> 16 bytes
+    record : number of moves (uint8, uint16 for grids of more than 255 positions)
+             info (uint8) : bit 0 set if Player 1 moved first, bits 1-2 the winner (0 tie, 1 Player 1, 2 Player 2)
+             player types (uint8) : index in PLAYER_TYPES of Player 1 (low 4 bits) and Player 2 (high 4 bits)
+             moves : the columns, packed with bits per move bits each (3 for 7 columns)
+A connect 4 game of 25 moves takes 13 bytes, instead of 43 integers in a csv file.
+
+    engine = C4(gametype='setset', sink=MoveSink('games.c4m'))
+    ...
+    for record in iter_game_records('games.c4m'):
+        board = record.board(10)                  # Board after the first 10 moves
+        for grid, marker, move in record.positions():
+            ...
+'''
+
+# LIBRARIES
+import numpy as np
+import os
+import struct
+
+from board import Board
+from gameIO import GameSink
+from gameState import GameState
+
+
+# Player types stored in the records (new types have to be added at the end)
+PLAYER_TYPES = ['Other', 'SetAI', 'RandomAI', 'LearningAI', 'SearchAI']
+
+MOVES_MAGIC   = b'C4GM'
+MOVES_VERSION = 1
+MOVES_HEADER  = '<4sHBBBB6x'
+MOVES_HEADER_SIZE = struct.calcsize(MOVES_HEADER)
+
+
+class Mover(object):
+    '''
+    Stand-in for a Player when a move is replayed on a Board (Board.update only needs choice and marker).
+    '''
+    def __init__(self, marker, choice):
+        self.marker = marker
+        self.choice = choice
+
+
+class GameRecord(object):
+    '''
+    One game as a list of moves.
+    moves        : column of each move, in order
+    start        : marker of the player who moved first (1 or -1)
+    winner       : marker of the winner (0 for ties)
+    player_types : (type of Player 1, type of Player 2), ex: ('SetAI', 'RandomAI')
+    '''
+
+    # Constructor
+    def __init__(self, moves, start=1, winner=0, player_types=('Other', 'Other'), grid_size=(6,7), N_connect=4):
+        self.moves        = [int(m) for m in moves]
+        self.start        = int(start)
+        self.winner       = int(winner)
+        self.player_types = tuple(player_types)
+        self.grid_size    = tuple(grid_size)
+        self.N_connect    = N_connect
+
+    def __len__(self):
+        return len(self.moves)
+
+    def marker(self, ply):
+        '''
+        Marker of the player making move number ply (counted from 0).
+        '''
+        return self.start if (ply % 2 == 0) else -self.start
+
+    def board(self, ply=None, board_class=Board):
+        '''
+        Board (or board_class object) after the first ply moves (all of them by default).
+        '''
+        ply   = len(self.moves) if ply is None else ply
+        board = board_class(self.grid_size, N_connect=self.N_connect)
+
+        for i, col in enumerate(self.moves[:ply]):
+            mover = Mover(self.marker(i), col)
+            board.update(mover)
+            board.check_vectors(mover)
+
+        return board
+
+    def positions(self):
+        '''
+        Generator over the positions of the game, made one move at a time (nothing is stored).
+        Yields (grid, marker, move) before each move : (height, width) int8 copy of the grid,
+        marker of the player to move and the column they played.
+        '''
+        state = GameState(self.grid_size, to_move=self.start, N_connect=self.N_connect)
+        for col in self.moves:
+            yield state.to_grid().copy(), state.to_move, col
+            state.play(col)
+
+    def final_grid(self):
+        '''
+        (height, width) int8 grid at the end of the game.
+        '''
+        state = GameState(self.grid_size, to_move=self.start, N_connect=self.N_connect)
+        for col in self.moves:
+            state.play(col)
+        return state.to_grid()
+
+    def game_array(self):
+        '''
+        Flattened final grid followed by the winner (same as C4.make_game_array), to write the
+        game to the other file formats (gameIO).
+        '''
+        return [int(c) for c in self.final_grid().ravel()] + [self.winner]
+
+
+def bits_per_move(width):
+    return max(1, int(width - 1).bit_length())
+
+
+def encode_game(record):
+    '''
+    Record as bytes (see module docstring).
+    '''
+    height, width = record.grid_size
+    bits = bits_per_move(width)
+
+    info  = (1 if record.start == 1 else 0) | ({0 : 0, 1 : 1, -1 : 2}[record.winner] << 1)
+    types = [PLAYER_TYPES.index(t) if t in PLAYER_TYPES else 0 for t in record.player_types]
+
+    packed = 0
+    for i, col in enumerate(record.moves):
+        packed |= col << (i*bits)
+
+    length = struct.pack('<B' if height*width < 256 else '<H', len(record.moves))
+
+    return length + bytes([info, types[0] | (types[1] << 4)]) + packed.to_bytes((len(record.moves)*bits + 7)//8, 'little')
+
+
+def decode_game(data, offset=0, grid_size=(6,7), N_connect=4):
+    '''
+    Read the record starting at data[offset] (bytes).  Returns (GameRecord, offset of the next record).
+    '''
+    height, width = grid_size
+    bits = bits_per_move(width)
+
+    if (height*width < 256):
+        N_moves = data[offset]
+        offset += 1
+    else:
+        N_moves = struct.unpack_from('<H', data, offset)[0]
+        offset += 2
+
+    info, types = data[offset], data[offset + 1]
+    offset += 2
+
+    size   = (N_moves*bits + 7)//8
+    packed = int.from_bytes(data[offset:offset + size], 'little')
+    mask   = (1 << bits) - 1
+    moves  = [(packed >> (i*bits)) & mask for i in range(N_moves)]
+
+    record = GameRecord(moves,
+                        start        = 1 if (info & 1) else -1,
+                        winner       = (0, 1, -1)[(info >> 1) & 3],
+                        player_types = (PLAYER_TYPES[types & 15], PLAYER_TYPES[types >> 4]),
+                        grid_size    = grid_size,
+                        N_connect    = N_connect)
+
+    return record, offset + size
+
+
+def read_moves_header(filename):
+    '''
+    Returns (height, width, N_connect) of a move file.
+    '''
+    with open(filename, 'rb') as f:
+        raw = f.read(MOVES_HEADER_SIZE)
+
+    if (len(raw) < MOVES_HEADER_SIZE):
+        raise ValueError('{} is not a move file (header too short)'.format(filename))
+
+    magic, version, height, width, N_connect, bits = struct.unpack(MOVES_HEADER, raw)
+    if (magic != MOVES_MAGIC) or (version != MOVES_VERSION):
+        raise ValueError('{} is not a move file (version {})'.format(filename, MOVES_VERSION))
+
+    return height, width, N_connect
+
+
+class MoveSink(GameSink):
+    '''
+    Buffered writer for move files, used like gameIO.GameSink (and can be passed to C4 as its sink,
+    C4.save_game then writes the record of the game instead of its final grid).
+    BatchC4.make_game_records() can be written with write_many.
+    Closing, flushing on close and the context manager all come from GameSink.
+    '''
+
+    # Constructor
+    def __init__(self, output_file, flush_size=1000, grid_size=(6,7), N_connect=4):
+        self.output_file = output_file
+        self.flush_size  = flush_size
+        self.grid_size   = tuple(grid_size)
+        self.N_connect   = N_connect
+        self.buffer      = []
+        self.N_games     = 0
+
+        self.f = open(output_file, 'ab')
+
+        # New file : write header, otherwise make sure we are appending to the same kind of file
+        if (self.f.tell() == 0):
+            self.f.write(struct.pack(MOVES_HEADER, MOVES_MAGIC, MOVES_VERSION, grid_size[0], grid_size[1],
+                                     N_connect, bits_per_move(grid_size[1])))
+        elif (read_moves_header(output_file) != (grid_size[0], grid_size[1], N_connect)):
+            self.f.close()
+            raise ValueError('{} holds games with a different grid size or N_connect'.format(output_file))
+
+    def write_record(self, record):
+        '''
+        Add a GameRecord to the buffer.
+        '''
+        self.buffer.append(encode_game(record))
+        self.N_games += 1
+
+        if (len(self.buffer) >= self.flush_size):
+            self.flush()
+
+        pass
+
+    # The games of this sink are GameRecords (so GameSink.write_many takes a list of records)
+    write = write_record
+
+    def flush(self):
+        '''
+        Write buffered records to the file.
+        '''
+        if (len(self.buffer) > 0):
+            self.f.write(b''.join(self.buffer))
+            self.buffer = []
+
+        self.f.flush()
+
+        pass
+
+
+def iter_game_records(filename):
+    '''
+    Generator over the GameRecords of a move file (the file is memory mapped, and records
+    are decoded one at a time).
+    '''
+    height, width, N_connect = read_moves_header(filename)
+    if (os.path.getsize(filename) == MOVES_HEADER_SIZE):
+        return
+
+    data   = np.memmap(filename, dtype=np.uint8, mode='r')
+    data   = memoryview(data)
+    offset = MOVES_HEADER_SIZE
+    while (offset < len(data)):
+        record, offset = decode_game(data, offset, (height, width), N_connect)
+        yield record
+
+
+def load_game_records(filename):
+    '''
+    List of every GameRecord of a move file.
+    '''
+    return list(iter_game_records(filename))
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+# import libraries
+import numpy as np
+
+from board import Board, get_lines, get_cell_lines
+
+
+class GameState(object):
+    '''
+    Lightweight game state for search and rollouts.
+
+    Board is built for playing one game with Player objects : it holds three grids and the 69 vector
+    views of each, which makes it slow to create or copy.  GameState only keeps what is needed to play
+    and take back moves :
+
+    grid        : flat int8 array (row*width + column), 0 for empty, 1 for Player 1 and -1 for Player 2
+    col_moves   : number of positions left in each column (same as Board.col_moves)
+    vector_sums : running sum of each vector (same order as get_lines)
+    moves       : positions played since the state was created (used by undo)
+    to_move     : marker of the player to move
+    winner      : marker of the winner (0 while nobody has won)
+
+    The line tables are shared by every state of the same grid size (see board.get_lines), so
+    play, undo and clone only touch a few small arrays :
+
+        state = GameState.from_board(Board, to_move=player.marker)
+        for c in state.legal_moves():
+            state.play(c)
+            ...
+            state.undo()
+    '''
+    __slots__ = ('height', 'width', 'grid', 'col_moves', 'vector_sums', 'moves', 'to_move', 'winner',
+                 'N_connect', 'cell_lines')
+
+    # Constructor
+    def __init__(self, grid_size=(6,7), to_move=1, N_connect=4):
+        self.height      = grid_size[0]
+        self.width       = grid_size[1]
+        self.grid        = np.zeros(self.height*self.width, dtype=np.int8)
+        self.col_moves   = np.zeros(self.width, dtype=np.int64) + self.height
+        self.vector_sums = np.zeros(len(get_lines(grid_size, N_connect)), dtype=np.int64)
+        self.moves       = []
+        self.to_move     = to_move
+        self.winner      = 0
+        self.N_connect   = N_connect                            # Pieces in a row to win (vector sum of a win, times the marker)
+        self.cell_lines  = get_cell_lines(grid_size, N_connect) # Shared table
+
+    def play(self, col):
+        '''
+        Place a piece of the player to move in column col.  Returns True if it wins the game.
+        No checks are made, the column must be one of legal_moves().
+        '''
+        marker = self.to_move
+        self.col_moves[col] -= 1
+        p = self.col_moves[col]*self.width + col
+
+        self.grid[p] = marker
+        lines = self.cell_lines[p]
+        self.vector_sums[lines] += marker
+        self.moves.append(p)
+        self.to_move = -marker
+
+        if (self.vector_sums[lines] == self.N_connect*marker).any():
+            self.winner = marker
+            return True
+        return False
+
+    def undo(self):
+        '''
+        Take back the last move played on this state.
+        '''
+        p      = self.moves.pop()
+        marker = self.grid[p]
+
+        self.grid[p] = 0
+        self.vector_sums[self.cell_lines[p]] -= marker
+        self.col_moves[p % self.width] += 1
+        self.to_move = marker
+        self.winner  = 0
+
+        return 0
+
+    def legal_moves(self):
+        '''
+        Columns that can be played (none once the game is won).
+        '''
+        if (self.winner != 0):
+            return []
+        return [c for c in range(self.width) if self.col_moves[c] != 0]
+
+    def N_moves_left(self):
+        return int(self.col_moves.sum())
+
+    def is_over(self):
+        return (self.winner != 0) or (self.N_moves_left() == 0)
+
+    def clone(self):
+        '''
+        Independent copy (only the small arrays are copied, the line tables are shared).
+        The move history is copied too, so the clone can undo past its creation.
+        '''
+        state = GameState.__new__(GameState)
+        state.height      = self.height
+        state.width       = self.width
+        state.grid        = self.grid.copy()
+        state.col_moves   = self.col_moves.copy()
+        state.vector_sums = self.vector_sums.copy()
+        state.moves       = list(self.moves)
+        state.to_move     = self.to_move
+        state.winner      = self.winner
+        state.N_connect   = self.N_connect
+        state.cell_lines  = self.cell_lines
+        return state
+
+    def to_grid(self):
+        '''
+        Game grid as a (height, width) view (same layout as Board.grid).
+        '''
+        return self.grid.reshape(self.height, self.width)
+
+    @staticmethod
+    def from_grid(grid, to_move=None, N_connect=4):
+        '''
+        State of a game grid.  If to_move isn't given, it is found from the number of pieces of
+        each player (Player 1 when they are equal, since either player can start a game).
+        Moves made before the state was created can't be undone.
+        '''
+        grid  = np.asarray(grid)
+        state = GameState(grid.shape, N_connect=N_connect)
+        state.grid[:] = grid.ravel()
+
+        # Positions left in each column : empty positions are always on top
+        state.col_moves[:]   = (grid == 0).sum(axis=0)
+        state.vector_sums[:] = state.grid[get_lines(grid.shape, N_connect)].sum(axis=1)
+
+        if (to_move is None):
+            N1, N2  = int((grid == 1).sum()), int((grid == -1).sum())
+            to_move = -1 if N1 > N2 else 1
+        state.to_move = to_move
+
+        won = state.vector_sums == state.N_connect*-to_move
+        if won.any():
+            state.winner = -to_move
+
+        return state
+
+    @staticmethod
+    def from_board(Board, to_move=None):
+        '''
+        State of a Board (see from_grid).
+        '''
+        return GameState.from_grid(Board.grid, to_move, Board.N_connect)
+
+    def to_board(self, board_class=Board):
+        '''
+        New Board (or board_class object, ex: bitboard.BitBoard) holding the same position.
+        '''
+        board = board_class((self.height, self.width), N_connect=self.N_connect)
+        grid  = self.to_grid()
+
+        board.grid[:] = grid
+        board.col_moves[:] = self.col_moves
+        board.N_moves_left = self.N_moves_left()
+        board.winner = self.winner
+
+        # Available positions : the lowest empty one of each column
+        board.bool_grid[:] = False
+        for c in range(self.width):
+            if (self.col_moves[c] != 0):
+                board.bool_grid[self.col_moves[c] - 1, c] = True
+
+        if hasattr(board, 'bitboards'):
+            from bitboard import grid_to_bitboards
+            board.bitboards, board.mask = grid_to_bitboards(grid)
+        else:
+            board.vector_sums[:] = self.vector_sums
+
+        return board
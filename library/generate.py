@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+'''
+Game generation pipeline.
+
+Games are split into shards which are played by a pool of worker processes (each with the
+BatchC4 engine and its own random number generator) and saved to their own csv file.
+A manifest listing the shards and number of games is written once every shard is done.
+
+Shard seeds only depend on the master seed and the shard number, and the split into shards only
+depends on the number of games and the shard size, so a run can be reproduced with the same master
+seed (saved in the manifest) whatever the number of workers.  Shards are kept small by default so
+that every core stays busy even for small runs (lower shard_size further if some cores sit idle).
+
+Usage from a script :
+    from generate import generate_games
+    manifest = generate_games('data/', N_games=300000, gametype='setset', seed=42)
+
+Usage from the command line :
+    python generate.py data/ --games 300000 --gametype setset --seed 42 --workers 64
+'''
+
+# LIBRARIES
+import numpy as np
+import argparse
+import json
+import os
+import time
+from multiprocessing import Pool
+
+from batchEngine import BatchC4
+
+
+def shard_seeds(seed, N_shards):
+    '''
+    Independent seeds for each shard, derived from the master seed.
+    '''
+    children = np.random.SeedSequence(seed).spawn(N_shards)
+    return [int(c.generate_state(1)[0]) for c in children]
+
+
+def play_shard(args):
+    '''
+    Worker function : plays one shard of games and saves it to its own file.
+    Returns the manifest entry of the shard.
+    '''
+    output_file, N_games, gametype, seed, grid_size, N_connect = args
+
+    engine = BatchC4(N_games, gametype=gametype, seed=seed, grid_size=grid_size, N_connect=N_connect)
+    engine.play_games()
+
+    # Write to a temporary file first so that a crashed worker never leaves a partial shard
+    tmp_file = output_file + '.tmp'
+    if os.path.isfile(tmp_file):
+        os.remove(tmp_file)
+    engine.save_games(tmp_file)
+    os.replace(tmp_file, output_file)
+
+    return {'file'    : os.path.basename(output_file),
+            'N_games' : int(N_games),
+            'seed'    : seed,
+            'winners' : {str(w) : int((engine.winners == w).sum()) for w in (1, 0, -1)}}
+
+
+def generate_games(output_dir, N_games, gametype='setset', seed=None, N_workers=None, shard_size=1000, verbose=True,
+                   grid_size=(6,7), N_connect=4):
+    '''
+    Generate N_games games of type gametype (see BatchC4) into output_dir.
+    output_dir       : directory for the shards (shard_00000.csv, ...) and manifest.json
+    seed             : master seed (random if None, the one used is saved in the manifest)
+    N_workers        : number of processes (defaults to the number of cores)
+    shard_size       : maximum number of games per shard (smaller shards spread small runs over more workers)
+    grid_size        : (height, width) of the grids
+    N_connect        : number of pieces in a row to win
+    Returns the manifest (dict).
+    '''
+    if (N_games <= 0):
+        raise ValueError('generate_games : N_games has to be positive (got {})'.format(N_games))
+
+    if seed is None:
+        seed = int(np.random.SeedSequence().generate_state(1)[0])
+
+    N_workers = N_workers or os.cpu_count() or 1
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Split games into shards of (nearly) equal size.  Only N_games and shard_size are used here
+    # (not N_workers) so the same seed gives the same games on any machine
+    N_shards = int(np.ceil(N_games/shard_size))
+    sizes    = [N_games//N_shards + (1 if i < N_games % N_shards else 0) for i in range(N_shards)]
+    seeds    = shard_seeds(seed, N_shards)
+
+    tasks = [(os.path.join(output_dir, 'shard_{:05d}.csv'.format(i)), sizes[i], gametype, seeds[i], tuple(grid_size), N_connect)
+             for i in range(N_shards)]
+
+    # Play shards across the process pool
+    start = time.time()
+    with Pool(N_workers) as pool:
+        shards = []
+        for entry in pool.imap(play_shard, tasks):
+            shards.append(entry)
+            if(verbose): print('saved {} ({} games)'.format(entry['file'], entry['N_games']))
+
+    manifest = {'gametype'  : gametype,
+                'seed'      : seed,
+                'grid_size' : list(grid_size),
+                'N_connect' : N_connect,
+                'N_games'   : int(N_games),
+                'N_shards'  : N_shards,
+                'shards'    : shards}
+
+    with open(os.path.join(output_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    if(verbose): print('{} games in {:.1f}s'.format(N_games, time.time() - start))
+
+    return manifest
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Generate Connect 4 games across a process pool.')
+    parser.add_argument('output_dir', help='directory for the shards and manifest')
+    parser.add_argument('--games',      type=int, default=100000,   help='number of games')
+    parser.add_argument('--gametype',   default='setset',           help='setset, setrand or randrand')
+    parser.add_argument('--seed',       type=int, default=None,     help='master seed')
+    parser.add_argument('--workers',    type=int, default=None,     help='number of processes (default: all cores)')
+    parser.add_argument('--shard-size', type=int, default=1000,     help='maximum number of games per shard')
+    parser.add_argument('--height',     type=int, default=6,        help='grid height')
+    parser.add_argument('--width',      type=int, default=7,        help='grid width')
+    parser.add_argument('--connect',    type=int, default=4,        help='number of pieces in a row to win')
+    args = parser.parse_args()
+
+    generate_games(args.output_dir, args.games, gametype=args.gametype, seed=args.seed,
+                   N_workers=args.workers, shard_size=args.shard_size,
+                   grid_size=(args.height, args.width), N_connect=args.connect)
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+'''
+Batched inference for the LearningAI.
+
+LearningAI.move calls model.predict on at most 7 grids, so most of the time goes to the
+keras overhead of each call.  The tools in this file gather the grids of many games
+and run a single predict call for all of them :
+
+learning_policy : policy for the BatchC4 engine (every active game in one predict call).
+InferenceBroker : stands in for the keras model of LearningAI objects playing in separate
+                  threads, collects their requests and runs them as one batch.
+PredictionCache : LRU cache of model outputs, so positions that were already seen skip the model.
+'''
+
+# LIBRARIES
+import numpy as np
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+
+def candidate_states(grids, col_moves, marker):
+    '''
+    Same as the potential states of LearningAI.move, for many games at once.
+    grids     : (N, height, width) game grids
+    col_moves : (N, width) number of positions left in each column
+    Returns states, shape (N*width, height, width, 1), with the marker placed in each column
+    (full columns are left unchanged), and the (N, width) boolean mask of legal columns.
+    '''
+    N, height, width = grids.shape
+    legal = col_moves > 0
+
+    states = np.repeat(grids[:, None], width, axis=1).astype(np.float32) # (N, width, height, width)
+    g, c   = np.where(legal)
+    states[g, c, col_moves[g, c] - 1, c] = marker
+
+    return states.reshape(N*width, height, width, 1), legal
+
+
+def predict(model, states, direct_call=False):
+    '''
+    Run the model on states and return a flat array of predictions.
+    direct_call uses model(states) instead of model.predict, which skips some of the keras overhead.
+    '''
+    if (direct_call):
+        return np.asarray(model(states, training=False)).reshape(-1)
+    return np.asarray(model.predict(states)).reshape(-1)
+
+
+def learning_policy(model, direct_call=False):
+    '''
+    Returns a BatchC4 policy that plays like the LearningAI (move with the highest prediction, or the
+    lowest for Player 2),
+    with one model call per step for all the games.  Ex, LearningAI vs SetAI :
+        engine = BatchC4(10000, gametype='setset', p1_policy=learning_policy(model))
+    '''
+    def policy(engine, games, marker):
+        states, legal = candidate_states(engine.grids[games], engine.col_moves[games], marker)
+
+        # Player 2 picks the lowest likelihood of Player 1 winning
+        predictions = predict(model, states, direct_call).reshape(legal.shape)*marker
+        predictions[~legal] = -np.inf
+
+        # argmax returns the first maximum, like LearningAI.move
+        return predictions.argmax(axis=1)
+
+    return policy
+
+
+class InferenceBroker(object):
+    '''
+    Stand-in for a keras model, shared by LearningAI objects playing in different threads.
+
+    Each call to predict blocks until either every client has sent a request, or max_wait seconds
+    have gone by.  All pending requests are then run through the model in one call and the
+    predictions are sent back to each caller.
+
+        broker = InferenceBroker(model, N_clients=64)
+        engines = [C4(gametype='learnset', keras_model=broker) for i in range(N_games)]
+        play_threaded_games(engines, broker)
+
+    Clients that stop playing must call leave() (play_threaded_games takes care of that),
+    otherwise the others wait max_wait seconds for them at every move.
+    '''
+
+    # Constructor
+    def __init__(self, model, N_clients, max_wait=0.05, direct_call=False):
+        self.model       = model
+        self.N_clients   = N_clients
+        self.max_wait    = max_wait
+        self.direct_call = direct_call
+
+        self.pending = []                     # Requests waiting for the next batch
+        self.cond    = threading.Condition()
+
+        # Counters
+        self.N_calls  = 0
+        self.N_states = 0
+
+    def predict(self, states):
+        '''
+        Same as model.predict, but batched with the other clients.
+        '''
+        request = {'states' : np.asarray(states, dtype=np.float32), 'result' : None}
+
+        with self.cond:
+            self.pending.append(request)
+
+            if (len(self.pending) >= self.N_clients):
+                self.run_batch()
+            else:
+                self.cond.wait_for(lambda : request['result'] is not None, timeout=self.max_wait)
+                if (request['result'] is None):
+                    self.run_batch()
+
+        return request['result']
+
+    def run_batch(self):
+        '''
+        Run all pending requests through the model (lock must be held).
+        '''
+        requests, self.pending = self.pending, []
+        if (len(requests) == 0):
+            return 0
+
+        sizes       = [len(r['states']) for r in requests]
+        predictions = predict(self.model, np.concatenate([r['states'] for r in requests]), self.direct_call)
+
+        for r, p in zip(requests, np.split(predictions, np.cumsum(sizes)[:-1])):
+            r['result'] = p.reshape(-1, 1)
+
+        self.N_calls  += 1
+        self.N_states += len(predictions)
+        self.cond.notify_all()
+
+        return 0
+
+    def join(self):
+        '''
+        A new client starts sending requests.
+        '''
+        with self.cond:
+            self.N_clients += 1
+
+    def leave(self):
+        '''
+        A client is done : stop waiting for it, and run the pending batch if it was the last one missing.
+        '''
+        with self.cond:
+            self.N_clients -= 1
+            if (len(self.pending) > 0) and (len(self.pending) >= self.N_clients):
+                self.run_batch()
+
+
+def play_threaded_games(engines, broker):
+    '''
+    Play a list of C4 engines (with LearningAI players using broker as their model),
+    with one thread per client of the broker.  Games are split evenly between threads.
+    Returns the list of winners (an error in any of the threads is raised once they are all done).
+    '''
+    N_threads = max(min(broker.N_clients, len(engines)), 1)
+    broker.N_clients = N_threads
+
+    errors = []
+
+    def worker(games):
+        # Leave even if a game raises, otherwise the other threads keep waiting for this client
+        try:
+            for e in games:
+                e.play_game()
+        except Exception as error:
+            errors.append(error)
+        finally:
+            broker.leave()
+
+    threads = [threading.Thread(target=worker, args=(engines[i::N_threads],)) for i in range(N_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # Errors of the threads are raised here (the first one)
+    if (len(errors) > 0):
+        raise errors[0]
+
+    return [e.Board.winner for e in engines]
+
+
+def position_keys(states):
+    '''
+    Compact keys (bytes) for a stack of grids, normalized for left-right symmetry :
+    a grid and its mirror image get the same key.
+    Each key holds two bitboards packed into bytes : positions of Player 1 and occupied positions
+    (11 bytes for a 6x7 grid).
+    '''
+    return canonical_positions(states)[0]
+
+
+def canonical_positions(states):
+    '''
+    Same as position_keys, but also returns a boolean array that is True where the 
+    key came from the mirror image of the grid (so the canonical grid is grid[:, ::-1]).
+    '''
+    states = np.asarray(states)
+    grids  = states.reshape(states.shape[0], states.shape[1], states.shape[2])
+
+    keys = []
+    for g in (grids, grids[:, :, ::-1]):
+        flat = g.reshape(len(g), -1)
+        keys.append(np.packbits(np.hstack((flat == 1, flat != 0)), axis=1))
+
+    # Keep the smallest of the two keys (same choice for a grid and its mirror)
+    canonical = []
+    mirrored  = np.zeros(len(grids), dtype=bool)
+    for i, (a, b) in enumerate(zip(keys[0], keys[1])):
+        a, b = a.tobytes(), b.tobytes()
+        canonical.append(min(a, b))
+        mirrored[i] = b < a
+
+    return canonical, mirrored
+
+
+class PredictionCache(object):
+    '''
+    LRU cache of model predictions, keyed by position (see position_keys), so a grid and its
+    mirror image share the same entry.
+    Only the positions that are not in the cache are sent to the model (in one predict call).
+
+    max_size : maximum number of positions held (least recently used ones are dropped first)
+    path     : optional file to load a warm cache from (and save it to, see save)
+
+        cache = PredictionCache(max_size=100000, path='cache.pkl')
+        player = LearningAI(model, cache=cache)
+        ...
+        cache.save()
+    '''
+
+    # Constructor
+    def __init__(self, max_size=100000, path=None):
+        self.max_size = max_size
+        self.path     = path
+        self.entries  = OrderedDict()
+
+        # Counters
+        self.hits   = 0
+        self.misses = 0
+
+        if (path is not None) and os.path.isfile(path):
+            self.load(path)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def predict(self, model, states, direct_call=False):
+        '''
+        Same as model.predict(states).flatten(), but cached positions skip the model.
+        A position that shows up several times in states (or with its mirror image) is only
+        sent to the model once, and the result is copied back to every place it came from.
+        '''
+        keys        = position_keys(states)
+        predictions = np.zeros(len(keys))
+        missing     = OrderedDict() # key of each position not in the cache -> indices in states
+
+        for i, k in enumerate(keys):
+            if k in self.entries:
+                self.entries.move_to_end(k)
+                predictions[i] = self.entries[k]
+                self.hits += 1
+            elif k in missing:
+                missing[k].append(i)
+                self.hits += 1
+            else:
+                missing[k] = [i]
+
+        self.misses += len(missing)
+
+        if (len(missing) > 0):
+            # One state per missing position
+            first  = [indices[0] for indices in missing.values()]
+            values = predict(model, np.asarray(states)[first], direct_call)
+
+            for (k, indices), value in zip(missing.items(), values):
+                predictions[indices] = value
+                self.entries[k]      = value
+
+            # Drop least recently used positions
+            while (len(self.entries) > self.max_size):
+                self.entries.popitem(last=False)
+
+        return predictions
+
+    def stats(self):
+        '''
+        Dictionary with cache size, hits, misses and hit rate.
+        '''
+        N = self.hits + self.misses
+        return {'size'     : len(self.entries),
+                'hits'     : self.hits,
+                'misses'   : self.misses,
+                'hit_rate' : self.hits/N if N > 0 else 0.}
+
+    def clear(self):
+        self.entries = OrderedDict()
+        self.hits    = 0
+        self.misses  = 0
+
+    def save(self, path=None):
+        '''
+        Save the cache entries (from least to most recently used) to path (or self.path).
+        Note that the predictions are only valid for the model they came from.
+        '''
+        path = self.path if path is None else path
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(list(self.entries.items()), f)
+        os.replace(path + '.tmp', path)
+
+    def load(self, path):
+        '''
+        Add the entries saved in path to the cache.
+        '''
+        with open(path, 'rb') as f:
+            for k, v in pickle.load(f):
+                self.entries[k] = v
+                self.entries.move_to_end(k)
+
+        while (len(self.entries) > self.max_size):
+            self.entries.popitem(last=False)
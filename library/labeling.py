@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+'''
+Position labeling pipeline.
+
+Game files only hold the final grid of SetAI games, labeled with the winner of that (rather noisy) game.
+This pipeline turns each stored game into many training examples :
+
+1. Every intermediate position of each game is extracted.  Move files (.c4m, see gameRecord) are
+   simply replayed in the order the moves were played.  The other game files don't store the order
+   of the moves, so a legal move order ending on the stored grid is rebuilt by taking pieces back off
+   the top of the columns (see unplay_game).
+2. Positions are deduplicated by their canonical key (mirror images count as the same position).
+3. Each position is labeled with its game theoretic value for the player to move (players.SearchAI,
+   exact when the search can reach the end of the game, depth limited otherwise), converted to the
+   usual winner marker : 1 if Player 1 wins, -1 if Player 2 wins, 0 for ties (or unsolved positions).
+
+Labeling runs across a process pool.  Positions are split into numbered parts, each one saved to the
+checkpoint directory as soon as it is done, so a crashed run only has to redo the missing parts.
+The output is a regular game file (csv or binary .c4b, see gameIO) that the loaders can read.
+
+Usage from a script :
+    from labeling import label_games
+    label_games('games.csv', 'labeled.c4b', checkpoint_dir='labeling_parts/', node_limit=20000)
+
+Usage from the command line :
+    python labeling.py games.csv labeled.c4b --checkpoint-dir labeling_parts/ --node-limit 20000
+'''
+
+# LIBRARIES
+import numpy as np
+import argparse
+import json
+import os
+from multiprocessing import Pool
+
+from board import get_lines
+from gameIO import iter_game_chunks, load_binary_games, BinaryGameSink, GameSink
+from gameRecord import iter_game_records
+from inference import position_keys
+from players import SearchAI
+
+
+def has_winner(grid, lines):
+    '''
+    True if any player has 4 (N_connect, the length of the lines) in a row on grid.
+    '''
+    sums = grid.ravel()[lines].sum(axis=1)
+    return bool((np.abs(sums) == lines.shape[1]).any())
+
+
+def unplay_game(grid, winner, max_nodes=100000, N_connect=4):
+    '''
+    Rebuild a legal sequence of positions ending on grid.
+    Pieces are taken back off the top of the columns (alternating players, the winner moving last),
+    making sure that no earlier position already had 4 in a row.
+    Returns the list of (grid, marker of the player to move), from the empty grid to the position
+    before the last move, or None if no sequence was found within max_nodes.
+    '''
+    height, width = grid.shape
+    lines = get_lines((height, width), N_connect)
+    grid  = np.array(grid, dtype=np.int8)
+
+    N1, N2 = int((grid == 1).sum()), int((grid == -1).sum())
+
+    # Marker of the player who made the last move
+    if (winner != 0):
+        last_movers = [int(winner)]
+    elif (N1 == N2 + 1):
+        last_movers = [1]
+    elif (N2 == N1 + 1):
+        last_movers = [-1]
+    else:
+        last_movers = [1, -1]
+
+    nodes = [0]
+
+    def backtrack(grid, marker):
+        # Sequence of positions up to the move of marker on grid
+        if (np.count_nonzero(grid) == 0):
+            return []
+
+        nodes[0] += 1
+        if (nodes[0] > max_nodes):
+            return None
+
+        for c in range(width):
+            filled = np.flatnonzero(grid[:, c])
+            if (len(filled) == 0) or (grid[filled[0], c] != marker):
+                continue
+
+            r = filled[0]
+            grid[r, c] = 0
+            if not has_winner(grid, lines):
+                before = backtrack(grid, -marker)
+                if (before is not None):
+                    before.append((grid.copy(), marker))
+                    grid[r, c] = marker
+                    return before
+            grid[r, c] = marker
+
+        return None
+
+    # A tie can't have 4 in a row
+    if (winner == 0) and has_winner(grid, lines):
+        return None
+
+    for marker in last_movers:
+        # Piece counts have to be consistent with alternating moves
+        n_last, n_other = (N1, N2) if marker == 1 else (N2, N1)
+        if (n_last - n_other) not in (0, 1):
+            continue
+
+        positions = backtrack(grid.copy(), marker)
+        if (positions is not None):
+            return positions
+
+    return None
+
+
+def extract_positions(filename, grid_size=(6,7), chunk_size=10000, N_connect=4):
+    '''
+    Extract and deduplicate the positions of every game in a game file.
+    Returns (grids, movers, labels) : unique positions, marker of the player to move in each
+    (0 for finished games), and the known label of finished games (final grids, labeled with the winner).
+    '''
+    seen   = set()
+    grids  = []
+    movers = []
+    labels = []
+
+    def add(grid, mover, label):
+        key = position_keys(grid[None, :, :, None])[0] + bytes([mover % 256])
+        if key not in seen:
+            seen.add(key)
+            grids.append(grid)
+            movers.append(mover)
+            labels.append(label)
+
+    # Move files : the real positions of each game, in the order they were played
+    if filename.endswith('.c4m'):
+        for record in iter_game_records(filename):
+            add(record.final_grid(), 0, int(record.winner))
+            for g, mover, _ in record.positions():
+                add(g, mover, 0)
+
+        return np.array(grids, dtype=np.int8), np.array(movers, dtype=np.int8), np.array(labels, dtype=np.int8)
+
+    for X, winners in iter_game_chunks(filename, chunk_size, grid_size):
+        for grid, winner in zip(X[..., 0], winners):
+            positions = unplay_game(grid, int(winner), N_connect=N_connect)
+            if (positions is None):
+                continue
+
+            # Final grid : the game is over, the label is known
+            add(np.array(grid, dtype=np.int8), 0, int(winner))
+            for g, mover in positions:
+                add(g, mover, 0)
+
+    return np.array(grids, dtype=np.int8), np.array(movers, dtype=np.int8), np.array(labels, dtype=np.int8)
+
+
+def label_part(args):
+    '''
+    Worker function : label one part of the positions and save it to the checkpoint directory.
+    '''
+    part_file, grids, movers, labels, node_limit, time_limit, N_connect = args
+
+    searcher = SearchAI(time_limit=time_limit, node_limit=node_limit, tt_size=100003)
+
+    labels = labels.copy()
+    for i in np.flatnonzero(movers):
+        score = searcher.evaluate_grid(grids[i], int(movers[i]), N_connect)
+        labels[i] = np.sign(score)*movers[i]
+
+    # Write to a temporary file first so a crash never leaves a partial part
+    tmp_file = part_file + '.tmp'
+    if os.path.isfile(tmp_file):
+        os.remove(tmp_file)
+    with BinaryGameSink(tmp_file, grid_size=grids.shape[1:]) as sink:
+        sink.write_many(np.hstack((grids.reshape(len(grids), -1), labels[:, None])))
+    os.replace(tmp_file, part_file)
+
+    return part_file
+
+
+def label_games(input_file, output_file, checkpoint_dir, N_workers=None, part_size=2000,
+                node_limit=20000, time_limit=None, grid_size=(6,7), verbose=True, N_connect=4):
+    '''
+    Run the labeling pipeline (see module docstring) on input_file, save the labeled positions
+    to output_file (.c4b for the binary format, csv otherwise).
+    checkpoint_dir : directory for the finished parts (reused to resume a crashed run with the same settings,
+                     a ValueError is raised if they changed)
+    part_size      : number of positions per part
+    node_limit, time_limit : search budget per position (None for no limit, so exact labels)
+    grid_size, N_connect   : game geometry (6x7, connect 4 by default)
+    Returns the number of labeled positions.
+    '''
+    os.makedirs(checkpoint_dir, exist_ok=True)
+
+    # Positions (deterministic for a given input, so parts match between runs)
+    grids, movers, labels = extract_positions(input_file, grid_size, N_connect=N_connect)
+    N_parts = int(np.ceil(len(grids)/part_size))
+
+    # Settings of the parts : a resumed run has to match them, or old parts would be merged with new ones
+    settings = {'input_file'  : os.path.abspath(input_file),
+                'N_positions' : len(grids),
+                'N_parts'     : N_parts,
+                'part_size'   : part_size,
+                'node_limit'  : node_limit,
+                'time_limit'  : time_limit,
+                'grid_size'   : list(grid_size),
+                'N_connect'   : N_connect}
+
+    settings_file = os.path.join(checkpoint_dir, 'positions.json')
+    if os.path.isfile(settings_file):
+        with open(settings_file) as f:
+            previous = json.load(f)
+        if (previous != settings):
+            changed = sorted(k for k in settings if previous.get(k) != settings[k])
+            raise ValueError('{} holds parts of another labeling run (different {}), use another checkpoint_dir '
+                             'or empty it'.format(checkpoint_dir, ', '.join(changed)))
+    else:
+        with open(settings_file, 'w') as f:
+            json.dump(settings, f, indent=2)
+
+    parts = [os.path.join(checkpoint_dir, 'part_{:05d}.c4b'.format(i)) for i in range(N_parts)]
+    tasks = [(parts[i], grids[i*part_size:(i+1)*part_size], movers[i*part_size:(i+1)*part_size],
+              labels[i*part_size:(i+1)*part_size], node_limit, time_limit, N_connect)
+             for i in range(N_parts) if not os.path.isfile(parts[i])]
+
+    if(verbose): print('{} positions, {} parts ({} left to label)'.format(len(grids), N_parts, len(tasks)))
+
+    if (len(tasks) > 0):
+        with Pool(N_workers) as pool:
+            for part_file in pool.imap_unordered(label_part, tasks):
+                if(verbose): print('labeled', os.path.basename(part_file))
+
+    # Merge parts in order
+    if os.path.isfile(output_file):
+        os.remove(output_file)
+    sink = BinaryGameSink(output_file, grid_size=grid_size) if output_file.endswith('.c4b') else GameSink(output_file)
+    with sink:
+        for part_file in parts:
+            X, winners = load_binary_games(part_file)
+            sink.write_many(np.hstack((X.reshape(len(X), -1), winners[:, None])))
+
+    return len(grids)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Label every position of stored games with its game theoretic value.')
+    parser.add_argument('input_file',  help='game file (csv or .c4b)')
+    parser.add_argument('output_file', help='labeled positions (csv or .c4b)')
+    parser.add_argument('--checkpoint-dir', default='labeling_parts', help='directory for finished parts')
+    parser.add_argument('--workers',    type=int,   default=None,  help='number of processes (default: all cores)')
+    parser.add_argument('--part-size',  type=int,   default=2000,  help='positions per part')
+    parser.add_argument('--node-limit', type=int,   default=20000, help='search nodes per position')
+    parser.add_argument('--time-limit', type=float, default=None,  help='search seconds per position')
+    args = parser.parse_args()
+
+    label_games(args.input_file, args.output_file, args.checkpoint_dir, N_workers=args.workers,
+                part_size=args.part_size, node_limit=args.node_limit, time_limit=args.time_limit)
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+'''
+NumPy-only inference for the models made by tools.generate_CNN.
+
+The models are tiny (Conv2D, MaxPooling2D, Flatten, Dense), so for the handful of grids of a
+LearningAI move, most of the time of a keras predict call is framework overhead.  export_model
+saves the weights and layer settings of a keras model to a .npz file, and NumpyModel runs the
+same forward pass with numpy (convolutions as one matrix product over image patches, "im2col").
+NumpyModel has a predict method like the keras models, so it can be given to the LearningAI
+(or inference.learning_policy, PredictionCache, ...) in place of the keras model, without
+importing keras at all :
+
+    export_model(keras_model, 'model.npz')       # once, where keras is installed
+    player = LearningAI(NumpyModel('model.npz'))
+
+Supported layers : Conv2D, MaxPooling2D, AveragePooling2D, Flatten, Dense, Dropout (does nothing
+at inference), with channels last data and linear, relu, tanh, sigmoid or softmax activations.
+
+From the command line (needs keras) :
+    python numpyModel.py model.h5 model.npz
+'''
+
+# LIBRARIES
+import numpy as np
+import argparse
+import json
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def softmax(x):
+    e = np.exp(x - x.max(axis=-1, keepdims=True))
+    return e/e.sum(axis=-1, keepdims=True)
+
+
+# Activation functions (sigmoid written with tanh so large inputs don't overflow)
+ACTIVATIONS = {'linear'  : lambda x : x,
+               'relu'    : lambda x : np.maximum(x, 0),
+               'tanh'    : np.tanh,
+               'sigmoid' : lambda x : 0.5*(1. + np.tanh(0.5*x)),
+               'softmax' : softmax}
+
+# Layer settings kept by the exporter (everything else in the keras config is ignored)
+SETTINGS = ('activation', 'padding', 'strides', 'pool_size', 'use_bias', 'data_format')
+
+
+def export_model(keras_model, path):
+    '''
+    Save the layers of a keras model (see module docstring) to a .npz file :
+    'config' holds the list of layers (type and settings) as JSON,
+    'layer_<i>_<j>' the weights of layer i (kernel then bias).
+    '''
+    layers  = []
+    weights = {}
+
+    for i, layer in enumerate(keras_model.layers):
+        kind   = type(layer).__name__
+        config = layer.get_config()
+
+        if (kind not in NumpyModel.LAYERS):
+            raise ValueError('export_model : unsupported layer {} ({})'.format(layer.name, kind))
+        if (config.get('data_format', 'channels_last') != 'channels_last'):
+            raise ValueError('export_model : only channels_last data is supported ({})'.format(layer.name))
+
+        settings = {k : config[k] for k in SETTINGS if k in config}
+        layers.append({'type' : kind, 'name' : layer.name, 'settings' : settings})
+
+        for j, w in enumerate(layer.get_weights()):
+            weights['layer_{}_{}'.format(i, j)] = np.asarray(w, dtype=np.float32)
+
+    np.savez(path, config=np.array(json.dumps(layers)), **weights)
+
+    return 0
+
+
+class NumpyModel(object):
+    '''
+    Forward pass of an exported model (see export_model) with numpy.
+    predict(states) takes (N, height, width, 1) grids and returns (N, 1) predictions, like keras.
+    '''
+
+    # Supported layer types
+    LAYERS = ('Conv2D', 'MaxPooling2D', 'AveragePooling2D', 'Flatten', 'Dense', 'Dropout', 'InputLayer')
+
+    # Constructor
+    def __init__(self, path=None, layers=None, weights=None):
+        '''
+        Load an exported model from path, or give the layers (list of {'type', 'settings'}) and their
+        weights (list of lists of arrays) directly.
+        '''
+        if (path is not None):
+            data    = np.load(path, allow_pickle=False)
+            layers  = json.loads(str(data['config']))
+            weights = [[data[k] for k in sorted((k for k in data.files if k.startswith('layer_{}_'.format(i))),
+                                                 key=lambda k : int(k.split('_')[-1]))]
+                       for i in range(len(layers))]
+
+        self.layers = []
+        for layer, w in zip(layers, weights):
+            self.layers.append(self.prepare(layer['type'], layer.get('settings', {}), w))
+
+    def prepare(self, kind, settings, weights):
+        '''
+        Layer as a tuple (type, settings, arrays), with the weights laid out for the forward pass.
+        '''
+        if (kind == 'Conv2D'):
+            kernel = np.asarray(weights[0], dtype=np.float32)   # (kh, kw, channels in, filters)
+            kh, kw, cin, cout = kernel.shape
+
+            # Patches come out as (channels, kh, kw), the kernel is reordered to match
+            kernel = kernel.transpose(2, 0, 1, 3).reshape(cin*kh*kw, cout)
+            bias   = np.asarray(weights[1], dtype=np.float32) if len(weights) > 1 else np.zeros(cout, dtype=np.float32)
+
+            return (kind, settings, (kernel, bias, (kh, kw)))
+
+        if (kind == 'Dense'):
+            kernel = np.asarray(weights[0], dtype=np.float32)
+            bias   = np.asarray(weights[1], dtype=np.float32) if len(weights) > 1 else np.zeros(kernel.shape[1], dtype=np.float32)
+
+            return (kind, settings, (kernel, bias))
+
+        if (kind not in NumpyModel.LAYERS):
+            raise ValueError('NumpyModel : unsupported layer type {}'.format(kind))
+
+        return (kind, settings, ())
+
+    def predict(self, states, **kwargs):
+        '''
+        Same as keras_model.predict(states).
+        '''
+        x = np.asarray(states, dtype=np.float32)
+
+        for kind, settings, arrays in self.layers:
+            if (kind == 'Conv2D'):
+                x = self.conv2d(x, settings, *arrays)
+            elif (kind in ('MaxPooling2D', 'AveragePooling2D')):
+                x = self.pool2d(x, settings, kind == 'MaxPooling2D')
+            elif (kind == 'Flatten'):
+                x = x.reshape(len(x), -1)
+            elif (kind == 'Dense'):
+                kernel, bias = arrays
+                x = ACTIVATIONS[settings.get('activation', 'linear')](x @ kernel + bias)
+
+        return x
+
+    def __call__(self, states, training=False):
+        '''
+        Same as predict (for inference.predict with direct_call=True).
+        '''
+        return self.predict(states)
+
+    def conv2d(self, x, settings, kernel, bias, kernel_size):
+        '''
+        2D convolution (channels last) as a matrix product over the image patches.
+        '''
+        N, height, width, channels = x.shape
+        index, oh, ow = patch_index((height, width, channels), kernel_size, settings.get('strides', (1, 1)),
+                                    settings.get('padding', 'valid') == 'same')
+
+        # Flattened grids, with a zero at the end for the padded positions
+        flat = np.zeros((N, height*width*channels + 1), dtype=np.float32)
+        flat[:, :-1] = x.reshape(N, -1)
+
+        # (N*oh*ow, channels*kh*kw) patches
+        patches = flat[:, index].reshape(N*oh*ow, -1)
+        out = patches @ kernel + bias
+
+        return ACTIVATIONS[settings.get('activation', 'linear')](out).reshape(N, oh, ow, -1)
+
+    def pool2d(self, x, settings, use_max):
+        '''
+        Max or average pooling (channels last).
+        '''
+        ph, pw  = settings.get('pool_size', (2, 2))
+        strides = settings.get('strides', None) or (ph, pw)
+        sh, sw  = strides
+
+        if (settings.get('padding', 'valid') == 'same'):
+            x = pad_same(x, (ph, pw), (sh, sw), -np.inf if use_max else np.nan)
+
+        # One strided slice per position of the window, combined element wise
+        oh = (x.shape[1] - ph)//sh + 1
+        ow = (x.shape[2] - pw)//sw + 1
+        slices = [x[:, i:i + (oh - 1)*sh + 1:sh, j:j + (ow - 1)*sw + 1:sw] for i in range(ph) for j in range(pw)]
+
+        if (use_max):
+            out = slices[0]
+            for s in slices[1:]:
+                out = np.maximum(out, s)
+            return out
+
+        # Padded positions don't count in the average (same as keras)
+        return np.nanmean(np.stack(slices), axis=0)
+
+    @staticmethod
+    def random(grid_size=(6,7), filters=42, seed=None):
+        '''
+        Model with the architecture of tools.generate_CNN (with no extra layers) and random weights.
+        Used for benchmarks and tests.
+        '''
+        rng = np.random.RandomState(seed)
+        pooled = (grid_size[0]//2)*(grid_size[1]//2)*filters
+
+        layers  = [{'type' : 'Conv2D',       'settings' : {'activation' : 'tanh', 'padding' : 'same', 'strides' : (1, 1)}},
+                   {'type' : 'MaxPooling2D', 'settings' : {'pool_size' : (2, 2), 'strides' : (2, 2), 'padding' : 'valid'}},
+                   {'type' : 'Flatten',      'settings' : {}},
+                   {'type' : 'Dense',        'settings' : {'activation' : 'sigmoid'}}]
+        weights = [[rng.normal(0, 0.3, (4, 4, 1, filters)), rng.normal(0, 0.1, filters)],
+                   [], [],
+                   [rng.normal(0, 0.05, (pooled, 1)), rng.normal(0, 0.1, 1)]]
+
+        return NumpyModel(layers=layers, weights=weights)
+
+
+def pad_same(x, window, strides, value=0.):
+    '''
+    Pad the height and width of x (N, height, width, channels) like keras 'same' padding :
+    the output has ceil(size/stride) positions, with the extra padding after the grid when it is odd.
+    '''
+    pads = [(0, 0)]
+    for size, k, s in zip(x.shape[1:3], window, strides):
+        total = max((int(np.ceil(size/s)) - 1)*s + k - size, 0)
+        pads.append((total//2, total - total//2))
+    pads.append((0, 0))
+
+    return np.pad(x, pads, constant_values=value)
+
+
+# Patch index tables, one per input shape and convolution settings (see patch_index)
+_patch_index = {}
+
+def patch_index(shape, kernel_size, strides, same):
+    '''
+    Index table of the im2col patches of a (height, width, channels) input, in the flattened input
+    (the index height*width*channels stands for a padded position, which holds 0).
+    Returns (index, out height, out width) with index of shape (out height*out width, channels*kh*kw).
+    Built once per shape and settings.
+    '''
+    key = (tuple(shape), tuple(kernel_size), tuple(strides), same)
+    if key in _patch_index:
+        return _patch_index[key]
+
+    height, width, channels = shape
+    kh, kw = kernel_size
+    sh, sw = strides
+
+    # Positions of the input in a padded grid (the padding gets the zero index)
+    positions = np.arange(height*width*channels).reshape(1, height, width, channels)
+    if (same):
+        positions = pad_same(positions, (kh, kw), (sh, sw), height*width*channels)
+
+    patches = sliding_window_view(positions, (kh, kw), axis=(1, 2))[0, ::sh, ::sw]  # (oh, ow, channels, kh, kw)
+    oh, ow  = patches.shape[:2]
+
+    _patch_index[key] = (np.ascontiguousarray(patches.reshape(oh*ow, -1)), oh, ow)
+
+    return _patch_index[key]
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Export a keras model (tools.generate_CNN) for NumpyModel.')
+    parser.add_argument('keras_file',  help='saved keras model')
+    parser.add_argument('output_file', help='exported weights (.npz)')
+    args = parser.parse_args()
+
+    import keras.models as km
+    export_model(km.load_model(args.keras_file), args.output_file)
+    print('exported', args.keras_file, 'to', args.output_file)
@@ -1,6 +1,15 @@
 #!/usr/bin/env python3
 
 import numpy as np
+import logging
+import time
+
+from board import get_lines
+from bitboard import grid_to_bitboards, win_shifts
+
+# Warnings of the players (nothing is printed unless the application sets up logging)
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
 
 class Player(object):
     '''
@@ -12,7 +21,23 @@ class Player(object):
         self.player  = p      # Player Number 
         self.name    = name   # Player Name (for display purposes only)
         self.marker  = 1 if self.player == 1 else -1 # Marker / token to be displayed on the Grid
-        self.target  = 4*self.marker # Target value to flag when player won the game
+        self.rng     = None          # Own random generator (None : np.random, see seed)
+
+    def seed(self, seed=None):
+        '''
+        Give the player its own random number generator, so its random choices don't depend
+        on the other player or anything else using np.random (ex: tournament games).
+        '''
+        self.rng = np.random.RandomState(seed)
+        return 0
+
+    def random_choice(self, a):
+        '''
+        Random element of a, from the player's own generator if it has one.
+        '''
+        if (self.rng is None):
+            return np.random.choice(a)
+        return self.rng.choice(a)
 
 
 class SetAI(Player):
@@ -32,123 +57,71 @@ class SetAI(Player):
         '''
         Move method : chooses which column to place token in.  Result is assigned to .choice attribute
         and gathered when updating the board. 
+
+        Instead of looping over Board.vectors, the vectors are looked up all at once in the flattened 
+        grids with the table of vector position indices (board.get_lines), so every vector sum 
+        and playable flag is computed in a single array operation.
         '''
 
         # Get columns that still have available moves.
-        available = [i for i,v in enumerate(Board.col_moves) if v != 0]
+        available = np.flatnonzero(Board.col_moves)
 
         # Fail safe : assigns random choice (ran into some bugs where 
         # script ran without errors but nothing was ever assigned to choice)
-        self.choice = np.random.choice(available)
+        self.choice = self.random_choice(available)
 
+        # Position indices of every vector (same order as Board.vectors)
+        lines = get_lines((Board.height, Board.width), Board.N_connect)
 
         # Get Vectors with available moves (True values in Board.bool_vectors)
-        playable_vector_indices = self.get_playable_vectors(Board)
-        
-        
+        playable_vector_indices = self.get_playable_vectors(Board, lines)
+
         # Select a vector to play on.
         # Details in function, but this returns the index in the list of vectors
-        vector_index_choice = self.choose_vector(playable_vector_indices, Board)
+        vector_index_choice = self.choose_vector(playable_vector_indices, Board, lines)
 
-        # Pull out vector associated to the index :
-        vector        = Board.vectors[vector_index_choice]
-        bool_vector   = Board.bool_vectors[vector_index_choice]
-        column_vector = Board.column_vectors[vector_index_choice]
+        # Pull out the positions of the vector and the first available one
+        positions      = lines[vector_index_choice]
+        true_positions = np.flatnonzero(Board.bool_grid.ravel()[positions])
 
-        # Get index of True values in the Bool Vector
-        true_positions = np.where(bool_vector == True)[0]
-
-        # Assign the column number to the choice attribute based 
-        # on the number of True values in the bool vector
-        position_choice = None
-        
-        if (len(true_positions) == 0): # Error message
-            print('True Positions Error')
-        elif(len(true_positions == 1)): # If there is only one
-            position_choice = true_positions[0]
-        elif(len(true_positions > 1)): # Random choice if more than one
-            position_choice = np.random.choice(true_positions)
-
-        if position_choice != None: 
-            # Condition due to previously mentioned fail-safe
-            self.choice = column_vector[position_choice]
+        if (len(true_positions) == 0): # Keep the random fail safe choice
+            logger.warning('SetAI %s : no available position in vector %d, playing random column %d',
+                           self.name, vector_index_choice, self.choice)
+        else:
+            # Assign the column number of that position to the choice attribute
+            self.choice = positions[true_positions[0]] % Board.width
 
         return 0
 
-    def get_playable_vectors(self, Board):
+    def get_playable_vectors(self, Board, lines):
         # Get indices of vectors with playable positions
         # that is, a True value in the Bool Vector list.
-        indices = []
-        for i, v in enumerate(Board.bool_vectors):
-            if True in v:
-                indices.append(i)
-        return indices
+        return np.flatnonzero(Board.bool_grid.ravel()[lines].any(axis=1))
 
 
-    def choose_vector(self, playable, Board):
+    def choose_vector(self, playable, Board, lines):
         # Algorithm to pick a vector to play in
         # By order of preference :
         # - Vector that lets player win on this turn
         # - Vector that keeps opponent from winning on next turn
         # - Random vector with available position (True in Bool vectors)
 
-        # Make list of of playable vectors
-        play_vectors = []
-        for i in playable:
-            play_vectors.append(Board.vectors[i])
-
-        # See if there are any winning vectors :
-        winning_vector_indices = []
-        for i in range(len(play_vectors)):
-            score = sum(play_vectors[i])
-
-            # Vectors for Player 1 (marker = 1)
-            if self.target > 0:
-                if(score == self.target - 1):
-                    # This is a winning vector for player 1
-                    winning_vector_indices.append(playable[i])
-
-            # Vectors for Player 2 (marker = -1)
-            if self.target < 0 :
-                if(score == self.target +1):
-                    # This is a winning vector for player 2
-                    winning_vector_indices.append(playable[i])
+        # Sums of the playable vectors
+        scores = Board.grid.ravel()[lines[playable]].sum(axis=1)
+        target = Board.N_connect*self.marker
 
-
-        # Return array of winning vectors (if there are any)
+        # See if there are any winning vectors (three of the players markers and an empty position)
+        winning_vector_indices = playable[scores == target - self.marker]
         if (len(winning_vector_indices) > 0):
-            return np.random.choice(winning_vector_indices)
-
-        # See if there any losing vectors
-        losing_vector_indices = []
-        for i in range(len(play_vectors)):
-            score = sum(play_vectors[i])
-
-            # Vectors for Player 1 (marker = 1)
-            if self.target > 0:
-                if(score == -1*self.target + 1):
-                    # This is a losing vector for player 1
-                    losing_vector_indices.append(playable[i])
-
-            # Vectors for Player 2 (marker = -1)
-            if self.target < 0:
-                if(score == -1*self.target - 1):
-                    # This is a losing vector for player 2
-                    losing_vector_indices.append(playable[i])
-
-        # Return array of losing vector indices (if there are any)
+            return self.random_choice(winning_vector_indices)
+
+        # See if there any losing vectors (same for the opponent)
+        losing_vector_indices = playable[scores == -1*target + self.marker]
         if (len(losing_vector_indices) > 0):
-            return np.random.choice(losing_vector_indices)
+            return self.random_choice(losing_vector_indices)
 
         # If there are no winning or losing vectors, return a random one with available positions
-        if (len(losing_vector_indices) == 0) and (len(winning_vector_indices) == 0):
-            return np.random.choice(playable)
-        else:
-            # Error message
-            print('Winning/Losing Vector Error')
-
-
-        return None
+        return self.random_choice(playable)
 
 
 class LearningAI(Player):
@@ -157,50 +130,84 @@ class LearningAI(Player):
     Player type that uses a Keras CNN model to make decisions.
     
     Model input :
-    6x7 numpy array representing the game grid, or list of such grids, but the model has to 
-    be reshaped to (N_grids, 6, 7, 1), adding an extra dimension to mimic an image.
+    height x width (6x7) numpy array representing the game grid, or list of such grids, but the model has to 
+    be reshaped to (N_grids, height, width, 1), adding an extra dimension to mimic an image.
+    The model has to be trained on the grid size of the Board (see tools.generate_CNN).
     
     Model Output Layer :
     1 Single node with Sigmoid Activation function (mean't to represent the likelihood of winning given a
     certain grid).  
     
-    Important note : for now the implementation assumes that the LearningAI is Player 1.  Because of this
-    it makes decisions based on the assumption that it wants the 1 marker to win on the game grid.
+    The model predicts the likelihood of Player 1 (the 1 marker) winning.  As Player 2, the LearningAI
+    uses 1 - prediction instead, so it always picks the move most likely to make itself win.
+
+    Any object with the same predict method can be used as the model, like a numpyModel.NumpyModel
+    (the same model run with numpy only, much faster for the few grids of each move).  A path to an
+    exported .npz file can also be given.
+
+    An optional inference.PredictionCache can be passed to skip the model for positions it has
+    already seen (or their mirror images).
+
+    With search_depth > 1, the player looks search_depth moves ahead (its own moves and the opponent's)
+    and only uses the model on the grids at the end of each line (leaves).  All leaves are sent to
+    the model in a single predict call, and the game tree is then scored by minimax : the player 
+    picks the highest prediction and assumes the opponent picks the lowest.  Finished games are scored 
+    without the model (1 if the player won, 0 if it lost and 0.5 for a tie, on the same scale as the
+    leaf predictions where 0.5 means either player is as likely to win).  Leaf predictions go through the cache
+    (one is made if none is given), so repeated positions are only predicted once.
     '''
         
     # Constructor
     def __init__(self,
                     keras_model, # Path to keras Conv2D model. 
                     p=1,
-                    name="Paul"):
+                    name="Paul",
+                    cache=None,
+                    search_depth=1):
+
+        # An exported model file (numpyModel.export_model) is loaded without keras
+        if isinstance(keras_model, str) and keras_model.endswith('.npz'):
+            from numpyModel import NumpyModel
+            keras_model = NumpyModel(keras_model)
 
-        import keras.models as km # Do it here so that we don't have to if this AI isn't playing
-        
         Player.__init__(self, p, name)        # Parent class declarations
         self.model = keras_model # Load Keras Model
         self.player_type = 'LearningAI'       # Object name (used when need arises)
+        self.cache = cache                    # Prediction cache (optional)
+        self.search_depth = search_depth      # Number of moves to look ahead
+
+        if (search_depth > 1) and (cache is None):
+            from inference import PredictionCache
+            self.cache = PredictionCache()
 
 
     def move(self, Board):
         '''
         Assigns column choice to .choice attribute.
         '''
+        if (self.search_depth > 1):
+            return self.search_move(Board)
         
-        # Get Available column and corresponding row indices
-        self.col_indices = [i for i,v in enumerate(Board.col_moves) if v != 0]
-        row_indices      = [i - 1 for i in Board.col_moves if i != 0]
+        from inference import candidate_states
 
-        # Make array of potential board states, each with the players next possible moves
-        potential_states = np.array([Board.grid.copy() for i in self.col_indices])
-        
-        for i, v in enumerate(self.col_indices):
-            potential_states[i][row_indices[i]][v] = self.marker
+        # Make array of potential board states, each with the players next possible moves,
+        # already shaped for the Conv2D model (N_grids, height, width, 1).  Only the legal ones are kept.
+        potential_states, legal = candidate_states(Board.grid[None], np.asarray(Board.col_moves)[None], self.marker)
+        legal = legal[0]
+        potential_states = potential_states[legal]
 
-        # Reshape potential states so that it fits into the Conv2D model
-        potential_states = np.array([s.reshape(6,7,1) for s in potential_states])
+        # Available columns
+        self.col_indices = [i for i in range(len(legal)) if legal[i]]
+
+        # Make predictions with Model object (or the cache)
+        if (self.cache is not None):
+            self.predictions = self.cache.predict(self.model, potential_states)
+        else:
+            self.predictions = self.model.predict(potential_states).flatten()
 
-        # Make predictions with Model object
-        self.predictions = self.model.predict(potential_states).flatten()
+        # Likelihood of this player winning (the model predicts Player 1 winning)
+        if (self.marker == -1):
+            self.predictions = 1. - self.predictions
 
 
         # Select prediction closest to 1 (likelihood of winning?)
@@ -210,6 +217,85 @@ class LearningAI(Player):
 
         return 0
 
+    def search_move(self, Board):
+        '''
+        Depth limited search with the model at the leaves (see class docstring).
+        The tree is built one level at a time for all nodes at once :
+        each level holds the grids of the nodes, and for each of their children whether
+        it is legal, a finished game (and its value), or expanded in the next level.
+        '''
+        from inference import candidate_states
+
+        height, width = Board.grid.shape
+        lines  = get_lines((height, width), Board.N_connect)
+        target = Board.N_connect
+
+        grids     = Board.grid[None].astype(np.float32)
+        col_moves = np.asarray(Board.col_moves)[None]
+        marker    = self.marker
+        levels    = []
+
+        for ply in range(self.search_depth):
+            N = len(grids)
+            states, legal = candidate_states(grids, col_moves, marker)
+            children      = states.reshape(N*width, height, width)
+            legal         = legal.ravel()
+
+            # Column counts of the children
+            child_moves = np.repeat(col_moves, width, axis=0)
+            child_moves[np.arange(N*width), np.tile(np.arange(width), N)] -= 1
+
+            # Finished games : marker won, or grid is full
+            won   = legal & (children.reshape(N*width, -1)[:, lines].sum(axis=2) == target*marker).any(axis=1)
+            full  = legal & ~won & (child_moves.sum(axis=1) == 0)
+
+            values = np.zeros(N*width)
+            values[won]  = 1. if marker == self.marker else 0.
+            values[full] = 0.5 # tie
+
+            expand = legal & ~won & ~full
+            levels.append((N, legal, values, expand, marker == self.marker))
+
+            grids     = children[expand]
+            col_moves = child_moves[expand]
+            marker    = -marker
+
+            if (len(grids) == 0):
+                break
+
+        # Leaves : one model call (through the cache)
+        if (len(grids) > 0):
+            leaves = grids.reshape(len(grids), height, width, 1)
+            leaf_values = self.cache.predict(self.model, leaves)
+            if (self.marker == -1):
+                leaf_values = 1. - leaf_values # Likelihood of this player winning
+        else:
+            leaf_values = np.zeros(0)
+
+        # Minimax back up the tree (the values of the first level are the values of each move)
+        node_values = leaf_values
+        for N, legal, values, expand, own_move in reversed(levels):
+            values = values.copy()
+            values[expand] = node_values
+            values = values.reshape(N, width)
+
+            if (own_move):
+                node_values = np.where(legal.reshape(N, width), values, -np.inf).max(axis=1)
+            else:
+                node_values = np.where(legal.reshape(N, width), values, np.inf).min(axis=1)
+
+        # Root : values of each legal move
+        legal = levels[0][1]
+        root_values = values[0]
+
+        self.col_indices = [i for i in range(width) if legal[i]]
+        self.predictions = root_values[legal]
+
+        best_move   = np.where(self.predictions == self.predictions.max())[0][0]
+        self.choice = self.col_indices[best_move]
+
+        return 0
+
     def print_move_weights(self):
         '''
         Print the predictions of the different model predictions and the max value. 
@@ -232,9 +318,274 @@ class RandomAI(Player):
         self.player_type = 'RandomAI'
 
 
-    def move(self, Board, SaveObj):
+    def move(self, Board):
 
         available = [i for i,v in enumerate(Board.col_moves) if v != 0]
-        self.choice = np.random.choice(available)
+        self.choice = self.random_choice(available)
 
         pass
+
+
+class SearchTimeout(Exception):
+    '''
+    Raised inside the SearchAI search when the time or node budget runs out.
+    '''
+    pass
+
+
+class SearchAI(Player):
+    '''
+    Player that searches the game tree with negamax alpha-beta (on bitboards, see bitboard.BitBoard).
+
+    - Iterative deepening : depth 1, 2, ... until the game is solved, max_depth is reached or 
+      the budget runs out (the move from the last completed depth is played).
+    - Transposition table : fixed size table (tt_size entries) indexed by position key,
+      holding the value, bound type, depth and best move of searched positions.
+    - Move ordering : best move from the table first, then center columns first.
+    - Budget : time_limit (seconds) and/or node_limit per move.
+
+    Scores are positive when the player to move wins (the sooner the higher), negative when it loses
+    and 0 for ties or positions that could not be solved at the searched depth.  With enough budget the 
+    player is perfect, and late game positions are solved in milliseconds, so it can be used
+    as an evaluation or labeling oracle (see evaluate).
+    '''
+
+    # Table entry types
+    EXACT, LOWER, UPPER = 0, 1, 2
+
+    # Constructor
+    def __init__(self, p=1, name="Alan", time_limit=1.0, node_limit=None, max_depth=None, tt_size=1000003):
+        Player.__init__(self, p, name)
+        self.player_type = 'SearchAI'
+
+        self.time_limit = time_limit   # Seconds per move (None for no limit)
+        self.node_limit = node_limit   # Nodes per move (None for no limit)
+        self.max_depth  = max_depth    # Maximum depth (None to search until solved)
+
+        # Transposition table (one list per field, indexed by key % tt_size)
+        # Empty slots hold the key -1 (0 is the key of the empty grid)
+        self.tt_size  = tt_size
+        self.tt_key   = [-1]*tt_size
+        self.tt_value = [0]*tt_size
+        self.tt_depth = [0]*tt_size
+        self.tt_flag  = [0]*tt_size
+        self.tt_move  = [0]*tt_size
+
+        # Info about the last search
+        self.nodes = 0
+        self.depth = 0
+        self.score = 0
+
+    def set_geometry(self, height, width, N_connect=4):
+        '''
+        Bit masks for a grid size (same layout as bitboard.BitBoard).
+        The transposition table is emptied when switching from another geometry.
+        '''
+        if hasattr(self, 'width'):
+            self.clear()
+
+        self.height      = height
+        self.width       = width
+        self.N_connect   = N_connect
+        self.N_positions = height*width
+        self.win_shifts  = win_shifts(height, N_connect)
+        self.col_bits    = height + 1
+        self.bottom_bit  = [1 << (c*self.col_bits) for c in range(width)]
+        self.top_bit     = [1 << (c*self.col_bits + height - 1) for c in range(width)]
+
+        # Center columns first
+        self.order = sorted(range(width), key=lambda c : abs(c - (width - 1)/2.))
+
+    def move(self, Board):
+        '''
+        Assigns column choice to .choice attribute.
+        '''
+        if (getattr(self, 'width', None) != Board.width) or (self.height != Board.height) or (self.N_connect != Board.N_connect):
+            self.set_geometry(Board.height, Board.width, Board.N_connect)
+
+        bitboards, mask = grid_to_bitboards(Board.grid)
+        moves_played    = self.N_positions - Board.N_moves_left
+
+        self.choice = self.search(bitboards[self.marker], mask, moves_played)
+
+        return 0
+
+    def evaluate(self, Board, marker):
+        '''
+        Score of a Board for the player with marker to move (see class docstring), within the budget.
+        '''
+        return self.evaluate_grid(Board.grid, marker, Board.N_connect)
+
+    def evaluate_grid(self, grid, marker, N_connect=4):
+        '''
+        Same as evaluate, directly from a game grid (no Board object needed).
+        '''
+        if (getattr(self, 'width', None) != grid.shape[1]) or (self.height != grid.shape[0]) or (self.N_connect != N_connect):
+            self.set_geometry(grid.shape[0], grid.shape[1], N_connect)
+
+        bitboards, mask = grid_to_bitboards(grid)
+        self.search(bitboards[marker], mask, int(np.count_nonzero(grid)))
+
+        return self.score
+
+    def search(self, position, mask, moves_played):
+        '''
+        Iterative deepening from the root, returns the best column.
+        position : bits of the player to move, mask : occupied positions
+        '''
+        self.nodes    = 0
+        self.depth    = 0
+        self.score    = 0 # Stays 0 if not even depth 1 is done within the budget
+        self.deadline = None if self.time_limit is None else time.time() + self.time_limit
+
+        playable  = [c for c in self.order if (mask & self.top_bit[c]) == 0]
+        best_move = playable[0]
+
+        # Immediate win
+        for c in playable:
+            if self.is_win(position | ((mask + self.bottom_bit[c]) & ~mask)):
+                self.depth, self.score = 1, self.N_positions + 1 - moves_played
+                return c
+
+        moves_left = self.N_positions - moves_played
+        max_depth  = moves_left if self.max_depth is None else min(self.max_depth, moves_left)
+
+        for depth in range(1, max_depth + 1):
+            try:
+                score, move = self.root(position, mask, moves_played, depth)
+            except SearchTimeout:
+                break
+
+            best_move, self.score, self.depth = move, score, depth
+
+            # Stop when the result is a proven win or loss
+            if (score != 0):
+                break
+
+        return best_move
+
+    def root(self, position, mask, moves_played, depth):
+        '''
+        Search all root moves at a given depth.  Returns (score, best column).
+        '''
+        alpha, beta = -self.N_positions - 1, self.N_positions + 1
+        best_score, best_move = None, None
+
+        for c in self.ordered_moves(position, mask):
+            new_mask = mask | (mask + self.bottom_bit[c])
+            score    = -self.negamax(position ^ mask, new_mask, moves_played + 1, depth - 1, -beta, -alpha)
+
+            if (best_score is None) or (score > best_score):
+                best_score, best_move = score, c
+            alpha = max(alpha, score)
+
+        return best_score, best_move
+
+    def negamax(self, position, mask, moves_played, depth, alpha, beta):
+        '''
+        Negamax alpha-beta.  position holds the bits of the player to move.
+        '''
+        self.nodes += 1
+        if (self.nodes & 1023) == 0:
+            self.check_budget()
+
+        if (moves_played == self.N_positions):
+            return 0
+
+        # Win on this move
+        playable = [c for c in self.order if (mask & self.top_bit[c]) == 0]
+        for c in playable:
+            if self.is_win(position | ((mask + self.bottom_bit[c]) & ~mask)):
+                return self.N_positions + 1 - moves_played
+
+        if (depth == 0):
+            return 0
+
+        # Transposition table
+        key   = position + mask
+        index = key % self.tt_size
+        tt_move = None
+        if (self.tt_key[index] == key):
+            tt_move = self.tt_move[index]
+            if (self.tt_depth[index] >= depth):
+                value, flag = self.tt_value[index], self.tt_flag[index]
+                if (flag == SearchAI.EXACT):
+                    return value
+                elif (flag == SearchAI.LOWER):
+                    alpha = max(alpha, value)
+                elif (flag == SearchAI.UPPER):
+                    beta = min(beta, value)
+                if (alpha >= beta):
+                    return value
+
+        # Move ordering : table move first, then center first
+        if (tt_move is not None) and (tt_move in playable):
+            playable.remove(tt_move)
+            playable.insert(0, tt_move)
+
+        alpha0 = alpha
+        best_score, best_move = -self.N_positions - 1, playable[0]
+        for c in playable:
+            new_mask = mask | (mask + self.bottom_bit[c])
+            score    = -self.negamax(position ^ mask, new_mask, moves_played + 1, depth - 1, -beta, -alpha)
+
+            if (score > best_score):
+                best_score, best_move = score, c
+            if (score > alpha):
+                alpha = score
+            if (alpha >= beta):
+                break
+
+        # Store result
+        if (best_score <= alpha0):
+            flag = SearchAI.UPPER
+        elif (best_score >= beta):
+            flag = SearchAI.LOWER
+        else:
+            flag = SearchAI.EXACT
+
+        self.tt_key[index]   = key
+        self.tt_value[index] = best_score
+        self.tt_depth[index] = depth
+        self.tt_flag[index]  = flag
+        self.tt_move[index]  = best_move
+
+        return best_score
+
+    def ordered_moves(self, position, mask):
+        '''
+        Playable columns, table move first then center first.
+        '''
+        playable = [c for c in self.order if (mask & self.top_bit[c]) == 0]
+
+        key   = position + mask
+        index = key % self.tt_size
+        if (self.tt_key[index] == key) and (self.tt_move[index] in playable):
+            playable.remove(self.tt_move[index])
+            playable.insert(0, self.tt_move[index])
+
+        return playable
+
+    def is_win(self, pos):
+        '''
+        N_connect in a row check with bit shifts (see BitBoard.check_vectors).
+        '''
+        for shifts in self.win_shifts:
+            m = pos
+            for s in shifts:
+                m &= m >> s
+            if (m):
+                return True
+        return False
+
+    def check_budget(self):
+        if (self.node_limit is not None) and (self.nodes >= self.node_limit):
+            raise SearchTimeout()
+        if (self.deadline is not None) and (time.time() >= self.deadline):
+            raise SearchTimeout()
+
+    def clear(self):
+        '''
+        Empty the transposition table.
+        '''
+        self.tt_key = [-1]*self.tt_size
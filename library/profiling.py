@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+# LIBRARIES
+import numpy as np
+import json
+import os
+import time
+
+
+class GameProfiler(object):
+    '''
+    Optional instrumentation for C4 (C4(..., profiler=GameProfiler())).
+
+    The engine times each phase of the game through the profiler :
+    move          : player.move (Player decision)
+    update        : Board.update
+    check_vectors : Board.check_vectors
+    save_game     : C4.save_game
+    For each phase and player type, it keeps the number of calls, total time and a histogram of
+    call times.  The same profiler can be shared by many C4 objects, and exported to a dictionary,
+    JSON, or a Prometheus style text file.
+
+    Hooks can be added to run code around every phase (see add_hook).
+    When C4 has no profiler, none of this code runs.
+    '''
+
+    # Upper bounds (seconds) of the histogram buckets (the last one catches everything else)
+    BUCKETS = [1e-6, 3e-6, 1e-5, 3e-5, 1e-4, 3e-4, 1e-3, 3e-3, 1e-2, 3e-2, 1e-1, 3e-1, 1., np.inf]
+
+    # Constructor
+    def __init__(self):
+        self.hooks   = []
+        self.N_games = 0
+        self.reset()
+
+    def reset(self):
+        '''
+        Clear all counters.
+        '''
+        self.counts     = {} # (phase, player_type) -> number of calls
+        self.totals     = {} # (phase, player_type) -> total time
+        self.histograms = {} # (phase, player_type) -> calls per bucket
+        self.N_games    = 0
+
+    def add_hook(self, hook):
+        '''
+        Add an object with before(phase, player) and/or after(phase, player, elapsed) methods,
+        called around every phase.  player is the Player object (None for save_game).
+        '''
+        self.hooks.append(hook)
+
+    def call(self, phase, player, fn, *args):
+        '''
+        Run fn(*args), timing it as phase for the player's type.  Returns what fn returned.
+        '''
+        for h in self.hooks:
+            if hasattr(h, 'before'): h.before(phase, player)
+
+        start   = time.perf_counter()
+        result  = fn(*args)
+        elapsed = time.perf_counter() - start
+
+        self.record(phase, getattr(player, 'player_type', 'engine'), elapsed)
+
+        for h in self.hooks:
+            if hasattr(h, 'after'): h.after(phase, player, elapsed)
+
+        return result
+
+    def record(self, phase, player_type, elapsed):
+        '''
+        Add one call of elapsed seconds to the counters.
+        '''
+        key = (phase, player_type)
+        if key not in self.counts:
+            self.counts[key]     = 0
+            self.totals[key]     = 0.
+            self.histograms[key] = [0]*len(GameProfiler.BUCKETS)
+
+        self.counts[key] += 1
+        self.totals[key] += elapsed
+
+        # First bucket the time fits in
+        for i, b in enumerate(GameProfiler.BUCKETS):
+            if (elapsed <= b):
+                self.histograms[key][i] += 1
+                break
+
+    def game_done(self):
+        self.N_games += 1
+
+    def to_dict(self):
+        '''
+        Counters as a dictionary : {'N_games', 'phases' : {phase : {player_type : {...}}}}
+        '''
+        phases = {}
+        for (phase, player_type), N in sorted(self.counts.items()):
+            total = self.totals[(phase, player_type)]
+            phases.setdefault(phase, {})[player_type] = {
+                'count'     : N,
+                'total_s'   : total,
+                'mean_s'    : total/N,
+                'histogram' : {str(b) : c for b, c in zip(GameProfiler.BUCKETS, self.histograms[(phase, player_type)])}}
+
+        return {'N_games' : self.N_games, 'phases' : phases}
+
+    def to_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def to_prometheus(self, path=None):
+        '''
+        Counters in the Prometheus text format (cumulative histogram buckets).
+        Written to path if given (ex: a file read by the node exporter), returned as a string.
+        '''
+        lines = ['# HELP c4_games_total Number of games played.',
+                 '# TYPE c4_games_total counter',
+                 'c4_games_total {}'.format(self.N_games),
+                 '# HELP c4_phase_seconds Time spent in each phase of the game.',
+                 '# TYPE c4_phase_seconds histogram']
+
+        for (phase, player_type), N in sorted(self.counts.items()):
+            labels = 'phase="{}",player_type="{}"'.format(phase, player_type)
+            cumulative = np.cumsum(self.histograms[(phase, player_type)])
+            for b, c in zip(GameProfiler.BUCKETS, cumulative):
+                le = '+Inf' if b == np.inf else repr(b)
+                lines.append('c4_phase_seconds_bucket{{{},le="{}"}} {}'.format(labels, le, c))
+            lines.append('c4_phase_seconds_sum{{{}}} {}'.format(labels, self.totals[(phase, player_type)]))
+            lines.append('c4_phase_seconds_count{{{}}} {}'.format(labels, N))
+
+        text = '\n'.join(lines) + '\n'
+
+        if (path is not None):
+            with open(path + '.tmp', 'w') as f:
+                f.write(text)
+            os.replace(path + '.tmp', path)
+
+        return text
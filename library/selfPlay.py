@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+'''
+Self-play training loop.
+
+Instead of fitting the model once on SetAI games, the model keeps learning from the games it plays
+against itself :
+
+- Generator processes play batches of self-play games (BatchC4, both players using the latest model
+  checkpoint through a numpyModel.NumpyModel, with epsilon random moves so the games differ), and send
+  every position of the games, labeled with the result of the game, to the trainer.
+- The trainer (main process) keeps the positions in a ReplayBuffer : fixed capacity ring arrays,
+  where new positions replace the oldest ones once it is full.  Once enough new positions came in,
+  the model (tools.generate_CNN) is trained on a random sample of the buffer, and saved as a new
+  checkpoint version, which the generators pick up before their next batch.
+
+Generators keep playing (with the previous version) while the model is trained, so neither side waits
+for the other, except for the bounded queue between them (generators wait if the trainer falls behind).
+
+Labels are the same as the model's usual target, from Player 1's point of view : 1 if Player 1 won
+the game, 0 if Player 2 won, and 0.5 for ties.  Player 2 picks the move with the lowest prediction.
+
+Output directory :
+    checkpoints/model_0000.keras, model_0000.npz, ...  every version (keras and exported for the generators)
+    checkpoints/latest.json                          version and files of the newest checkpoint
+    history.jsonl                                    one line per training round (loss, buffer, games ...)
+    replay.npz                                       replay buffer (saved at the end, to resume a run)
+
+Usage from a script :
+    from selfPlay import self_play_loop
+    self_play_loop('selfplay/', N_rounds=50, capacity=200000, N_generators=3)
+
+Usage from the command line :
+    python selfPlay.py selfplay/ --rounds 50 --capacity 200000 --generators 3
+'''
+
+# LIBRARIES
+import numpy as np
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import time
+
+from batchEngine import BatchC4
+from inference import candidate_states, predict
+
+
+class ReplayBuffer(object):
+    '''
+    Fixed capacity store of training positions (ring arrays : once full, new positions overwrite the oldest).
+    states   : (capacity, height, width) int8 grids
+    labels   : (capacity,) float32 targets
+    versions : (capacity,) model version that played each position
+    '''
+
+    # Constructor
+    def __init__(self, capacity, grid_size=(6,7)):
+        self.capacity = capacity
+        self.grid_size = tuple(grid_size)
+        self.states   = np.zeros((capacity,) + self.grid_size, dtype=np.int8)
+        self.labels   = np.zeros(capacity, dtype=np.float32)
+        self.versions = np.zeros(capacity, dtype=np.int32)
+        self.position = 0  # Next index to write to
+        self.N        = 0  # Number of positions held
+        self.N_added  = 0  # Number of positions ever added (evicted ones included)
+
+    def __len__(self):
+        return self.N
+
+    def add(self, states, labels, version=0):
+        '''
+        Add positions, evicting the oldest ones when the buffer is full.
+        '''
+        N = len(states)
+        self.N_added += N
+
+        # Only the newest capacity positions can fit
+        if (N > self.capacity):
+            states, labels = states[-self.capacity:], labels[-self.capacity:]
+            N = self.capacity
+
+        # Write up to the end of the arrays, then wrap around
+        index = (self.position + np.arange(N)) % self.capacity
+        self.states[index]   = states
+        self.labels[index]   = labels
+        self.versions[index] = version
+
+        self.position = (self.position + N) % self.capacity
+        self.N = min(self.N + N, self.capacity)
+
+        return 0
+
+    def sample(self, N, rng=np.random):
+        '''
+        N random positions (with replacement), shaped for the model : ((N, height, width, 1) float32, (N,) labels).
+        '''
+        if (self.N == 0):
+            raise ValueError('ReplayBuffer.sample : the buffer is empty')
+
+        index = rng.randint(0, self.N, N)
+        return self.states[index, :, :, None].astype(np.float32), self.labels[index]
+
+    def save(self, path):
+        '''
+        Save the held positions (oldest first) to a .npz file.
+        '''
+        index = (self.position - self.N + np.arange(self.N)) % self.capacity
+        np.savez(path, states=self.states[index], labels=self.labels[index], versions=self.versions[index],
+                 N_added=self.N_added)
+
+        return 0
+
+    @staticmethod
+    def load(path, capacity):
+        '''
+        Buffer of the given capacity with the positions of a saved buffer (the newest ones if it doesn't fit).
+        '''
+        data   = np.load(path)
+        buffer = ReplayBuffer(capacity, data['states'].shape[1:])
+
+        states, labels, versions = data['states'][-capacity:], data['labels'][-capacity:], data['versions'][-capacity:]
+        buffer.states[:len(states)]   = states
+        buffer.labels[:len(states)]   = labels
+        buffer.versions[:len(states)] = versions
+        buffer.N        = len(states)
+        buffer.position = len(states) % capacity
+        buffer.N_added  = int(data['N_added'])
+
+        return buffer
+
+
+def self_play_policy(model, epsilon=0.1):
+    '''
+    BatchC4 policy for self-play : Player 1 picks the move with the highest prediction (likelihood of
+    Player 1 winning), Player 2 the lowest, and a random legal move is played instead with probability epsilon.
+    '''
+    def policy(engine, games, marker):
+        states, legal = candidate_states(engine.grids[games], engine.col_moves[games], marker)
+
+        predictions = predict(model, states).reshape(legal.shape)
+        values = predictions if marker == 1 else -predictions
+        values[~legal] = -np.inf
+        choice = values.argmax(axis=1)
+
+        # Exploration moves
+        explore = engine.rng.rand(len(games)) < epsilon
+        if explore.any():
+            choice[explore] = engine.random_choice(legal[explore])
+
+        return choice
+
+    return policy
+
+
+def game_positions(engine):
+    '''
+    Every position of the games of a BatchC4 (after play_games), replayed from engine.moves one move at
+    a time for all games at once.  Returns ((N_positions, height, width) int8 grids, labels) with the
+    labels of the positions of each game set from its winner (1, 0.5 for ties, 0).
+    '''
+    N, height, width = engine.grids.shape
+    grids     = np.zeros((N, height, width), dtype=np.int8)
+    col_moves = np.zeros((N, width), dtype=np.int64) + height
+    results   = (engine.winners.astype(np.float32) + 1.)/2.
+    games     = np.arange(N)
+
+    states, labels = [], []
+    for ply in range(engine.N_positions):
+        active = games[engine.N_moves > ply]
+        if (len(active) == 0):
+            break
+
+        cols   = engine.moves[active, ply].astype(np.int64)
+        marker = engine.starts[active]*(1 if ply % 2 == 0 else -1)
+        col_moves[active, cols] -= 1
+        grids[active, col_moves[active, cols], cols] = marker
+
+        states.append(grids[active].copy())
+        labels.append(results[active])
+
+    return np.concatenate(states), np.concatenate(labels)
+
+
+def play_self_play(model, N_games, epsilon=0.1, seed=None, grid_size=(6,7), N_connect=4):
+    '''
+    Play N_games self-play games (see self_play_policy).  Returns (states, labels, winners).
+    '''
+    policy = self_play_policy(model, epsilon)
+    engine = BatchC4(N_games, p1_policy=policy, p2_policy=policy, grid_size=grid_size, seed=seed, N_connect=N_connect)
+    engine.play_games()
+
+    states, labels = game_positions(engine)
+
+    return states, labels, engine.winners
+
+
+def save_checkpoint(model, directory, version, info=None):
+    '''
+    Save a keras model as checkpoint version (keras file and numpyModel export for the generators),
+    then point latest.json to it.  Files are written under temporary names first, so readers never
+    see a partial checkpoint.
+    '''
+    from numpyModel import export_model
+
+    name = 'model_{:04d}'.format(version)
+    base = os.path.join(directory, name)
+    model.save(base + '.keras')
+    export_model(model, base + '.tmp.npz')
+    os.replace(base + '.tmp.npz', base + '.npz')
+
+    write_latest(directory, version, {'keras' : name + '.keras', 'npz' : name + '.npz'}, info)
+
+    return 0
+
+
+def write_latest(directory, version, files, info=None):
+    '''
+    Point latest.json to checkpoint version.  files : {'keras', 'npz'} file names, relative to directory
+    (so the checkpoints can be moved, or used from another working directory).
+    '''
+    latest = dict(files, version=version, time=time.time())
+    if (info is not None):
+        latest['info'] = info
+
+    with open(os.path.join(directory, 'latest.tmp'), 'w') as f:
+        json.dump(latest, f, indent=2)
+    os.replace(os.path.join(directory, 'latest.tmp'), os.path.join(directory, 'latest.json'))
+
+    return 0
+
+
+def latest_checkpoint(directory):
+    '''
+    Contents of latest.json (version, keras and npz files, with the directory joined to the file names),
+    None if there is no checkpoint yet.
+    '''
+    path = os.path.join(directory, 'latest.json')
+    if not os.path.isfile(path):
+        return None
+
+    with open(path) as f:
+        latest = json.load(f)
+
+    for k in ('keras', 'npz'):
+        if (latest.get(k) is not None):
+            latest[k] = os.path.join(directory, latest[k])
+
+    return latest
+
+
+def load_checkpoint(latest):
+    '''
+    Keras model of a checkpoint (see latest_checkpoint), to continue training it.
+    '''
+    import keras.models as km
+    return km.load_model(latest['keras'])
+
+
+def generator_loop(worker, directory, out_queue, stop, N_games, epsilon, seed, grid_size, N_connect):
+    '''
+    Generator process : plays batches of self-play games with the latest checkpoint (reloaded when a
+    new version is saved) and sends (worker, version, states, labels, winners) to out_queue until stop is set.
+    Each batch gets its own seed from the master seed, worker and batch number.
+    '''
+    from numpyModel import NumpyModel
+
+    version, model = None, None
+    batch = 0
+
+    while not stop.is_set():
+        latest = latest_checkpoint(directory)
+        if (latest is None):
+            time.sleep(0.1)
+            continue
+        if (latest['version'] != version):
+            version = latest['version']
+            model   = NumpyModel(latest['npz'])
+
+        batch_seed = int(np.random.SeedSequence([seed, worker, batch]).generate_state(1)[0])
+        states, labels, winners = play_self_play(model, N_games, epsilon, batch_seed, grid_size, N_connect)
+        batch += 1
+
+        # Wait for room in the queue (the trainer is behind), but don't hang once stopped
+        while not stop.is_set():
+            try:
+                out_queue.put((worker, version, states, labels, winners), timeout=0.5)
+                break
+            except queue.Full:
+                pass
+
+    return 0
+
+
+def self_play_loop(output_dir, N_rounds=10, capacity=200000, N_generators=None, games_per_batch=200, new_positions=20000,
+                   train_samples=50000, batch_size=256, epochs=1, epsilon=0.1, seed=None, model=None,
+                   grid_size=(6,7), N_connect=4, verbose=True):
+    '''
+    Run the self-play loop (see module docstring) for N_rounds training rounds.
+    output_dir      : directory for the checkpoints, history and replay buffer (a run in it is continued)
+    capacity        : maximum number of positions in the replay buffer
+    N_generators    : number of generator processes (defaults to the number of cores minus one)
+    games_per_batch : games per generator batch
+    new_positions   : new positions needed before each training round (at least one batch is always waited for)
+    train_samples   : positions sampled from the buffer for each round (fit with batch_size and epochs)
+    epsilon         : probability of a random move in self-play games
+    model           : keras model to start from (tools.generate_CNN() by default)
+    Returns the last checkpoint version.
+    '''
+    checkpoint_dir = os.path.join(output_dir, 'checkpoints')
+    replay_file    = os.path.join(output_dir, 'replay.npz')
+    os.makedirs(checkpoint_dir, exist_ok=True)
+
+    if seed is None:
+        seed = int(np.random.SeedSequence().generate_state(1)[0])
+    rng = np.random.RandomState(seed)
+
+    # Continue a run (newest checkpoint and saved buffer), or start one from version 0
+    latest = latest_checkpoint(checkpoint_dir)
+    if (latest is not None):
+        model   = load_checkpoint(latest)
+        version = latest['version']
+    else:
+        if (model is None):
+            from tools import generate_CNN
+            model = generate_CNN(grid_size=grid_size)
+        version = 0
+        save_checkpoint(model, checkpoint_dir, version)
+
+    if os.path.isfile(replay_file):
+        buffer = ReplayBuffer.load(replay_file, capacity)
+    else:
+        buffer = ReplayBuffer(capacity, grid_size)
+
+    # Generators run in their own (spawned, so keras isn't copied over) processes
+    N_generators = N_generators or max(1, (os.cpu_count() or 2) - 1)
+    context      = multiprocessing.get_context('spawn')
+    positions    = context.Queue(maxsize=2*N_generators)
+    stop         = context.Event()
+    generators   = [context.Process(target=generator_loop,
+                                    args=(w, checkpoint_dir, positions, stop, games_per_batch, epsilon,
+                                          seed + version, tuple(grid_size), N_connect))
+                    for w in range(N_generators)]
+    for g in generators:
+        g.start()
+
+    start = time.time()
+    try:
+        for r in range(N_rounds):
+            # Wait for enough new positions (at least one batch)
+            batches = []
+            N_new   = 0
+            while (N_new < new_positions) or (N_new == 0):
+                try:
+                    batches.append(positions.get(timeout=1.))
+                except queue.Empty:
+                    if not any(g.is_alive() for g in generators):
+                        raise RuntimeError('self_play_loop : every generator process stopped')
+                    continue
+                N_new += len(batches[-1][2])
+
+            # Then take the batches already waiting, at most one per generator (they may keep the queue full)
+            for extra in range(N_generators):
+                try:
+                    batches.append(positions.get_nowait())
+                except queue.Empty:
+                    break
+
+            N_new, N_games, winners = 0, 0, np.zeros(3, dtype=np.int64)
+            for worker, played_by, states, labels, results in batches:
+                buffer.add(states, labels, played_by)
+                N_new   += len(states)
+                N_games += len(results)
+                winners += [(results == w).sum() for w in (1, 0, -1)]
+
+            # Train on a sample of the buffer
+            X, y = buffer.sample(train_samples, rng)
+            history = model.fit(X, y, batch_size=batch_size, epochs=epochs, verbose=0)
+            loss = float(history.history['loss'][-1])
+
+            version += 1
+            info = {'round'       : r,
+                    'version'     : version,
+                    'loss'        : loss,
+                    'N_games'     : N_games,
+                    'N_new'       : N_new,
+                    'buffer_size' : len(buffer),
+                    'N_added'     : buffer.N_added,
+                    'staleness'   : float(version - 1 - buffer.versions[:len(buffer)].mean()),
+                    'winners'     : {str(w) : int(c) for w, c in zip((1, 0, -1), winners)},
+                    'time'        : time.time() - start}
+            save_checkpoint(model, checkpoint_dir, version, info)
+
+            with open(os.path.join(output_dir, 'history.jsonl'), 'a') as f:
+                f.write(json.dumps(info) + '\n')
+
+            if(verbose): print('version {} : loss {:.4f}, {} new positions ({} games), buffer {}/{}, {:.1f}s'.format(
+                version, loss, N_new, N_games, len(buffer), capacity, info['time']))
+
+    finally:
+        # Stop the generators, emptying the queue so none of them is stuck on a put
+        stop.set()
+        while any(g.is_alive() for g in generators):
+            try:
+                positions.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        for g in generators:
+            g.join()
+
+        buffer.save(replay_file)
+
+    return version
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Self-play training loop with a replay buffer.')
+    parser.add_argument('output_dir', help='directory for checkpoints, history and replay buffer')
+    parser.add_argument('--rounds',        type=int,   default=10,     help='number of training rounds')
+    parser.add_argument('--capacity',      type=int,   default=200000, help='replay buffer capacity (positions)')
+    parser.add_argument('--generators',    type=int,   default=None,   help='generator processes (default: cores - 1)')
+    parser.add_argument('--games',         type=int,   default=200,    help='games per generator batch')
+    parser.add_argument('--new-positions', type=int,   default=20000,  help='new positions per training round')
+    parser.add_argument('--samples',       type=int,   default=50000,  help='positions sampled per training round')
+    parser.add_argument('--batch-size',    type=int,   default=256,    help='training batch size')
+    parser.add_argument('--epochs',        type=int,   default=1,      help='epochs per training round')
+    parser.add_argument('--epsilon',       type=float, default=0.1,    help='probability of a random move')
+    parser.add_argument('--seed',          type=int,   default=None,   help='master seed')
+    parser.add_argument('--height',        type=int,   default=6,      help='grid height')
+    parser.add_argument('--width',         type=int,   default=7,      help='grid width')
+    parser.add_argument('--connect',       type=int,   default=4,      help='number of pieces in a row to win')
+    args = parser.parse_args()
+
+    self_play_loop(args.output_dir, N_rounds=args.rounds, capacity=args.capacity, N_generators=args.generators,
+                   games_per_batch=args.games, new_positions=args.new_positions, train_samples=args.samples,
+                   batch_size=args.batch_size, epochs=args.epochs, epsilon=args.epsilon, seed=args.seed,
+                   grid_size=(args.height, args.width), N_connect=args.connect)
@@ -3,28 +3,32 @@
 # Basic Libraries
 import numpy as np
 
-# Keras Libraries (ANNs)
-from keras.models import Sequential
-from keras.layers import Dense, Conv2D, Flatten, AveragePooling2D, MaxPooling2D
-from keras import losses
-from keras import optimizers
+from gameIO import load_binary_games
 
-from sklearn.model_selection import train_test_split
+# Keras (and tensorflow) and sklearn take seconds to import, so they are only imported
+# by the functions that need them.
 
 
-def generate_CNN(conv_layers=[], dense_layers=[], lr=0.01):
+def generate_CNN(conv_layers=[], dense_layers=[], lr=0.01, grid_size=(6,7)):
     '''
     Generate a 2D Convolutional Neural Network.
     Input parameters are : 
     conv_layers  : a list of Conv2D layers (before flattening the values for the dense layers)
     dense_layers : a list of Dense layers (after flattening)
     lr           : learning rate for the optimizer
+    grid_size    : (height, width) of the game grids the model plays on
     '''
 
+    # Keras Libraries (ANNs)
+    from keras.models import Sequential
+    from keras.layers import Dense, Conv2D, Flatten, AveragePooling2D, MaxPooling2D
+    from keras import losses
+    from keras import optimizers
+
     # Basic Input Layers : Conv2D layer with 4x4 filter, followed by 2x2 filter
     # This seems to work pretty well, so it will be kept for all model variations
     model = Sequential()
-    model.add(Conv2D(42, (4,4), input_shape=(6,7,1), activation='tanh', padding='same'))
+    model.add(Conv2D(42, (4,4), input_shape=(grid_size[0], grid_size[1], 1), activation='tanh', padding='same'))
     model.add(MaxPooling2D(pool_size=(2, 2), strides=(2,2)))
 
     # Add pre-flattening layers
@@ -36,38 +40,41 @@ def generate_CNN(conv_layers=[], dense_layers=[], lr=0.01):
 
     # Add Post flattening layers
     if len(dense_layers) > 0:
-        for l in new_layers:
+        for l in dense_layers:
             model.add(l)
 
     model.add(Dense(1,   activation='sigmoid'))
 
-    # Define optimizer with provided learning rate
-    adam_optimizer = optimizers.Adam(lr=lr)
+    # Define optimizer with provided learning rate (called lr before keras 2.3)
+    try:
+        adam_optimizer = optimizers.Adam(learning_rate=lr)
+    except TypeError:
+        adam_optimizer = optimizers.Adam(lr=lr)
     
     # compile and return model :
     model.compile(optimizer=adam_optimizer, loss=losses.mean_squared_error, metrics=['accuracy'])
     return model
 
 
-def load_shape_ttsplit(filename, test_size=0.3):
+def load_shape_ttsplit(filename, test_size=0.3, grid_size=(6,7)):
     ''' 
     Custom function to load reshape and train_test_split data from game data base.
     Somewhat specific function, not great for general use.
+    filename can be a csv file (C4.save_game) or a binary game file (gameIO.BinaryGameSink, .c4b),
+    which is memory mapped instead of parsed.
+    grid_size is only needed for csv files (binary files store it in their header).
     '''
 
-    data = np.genfromtxt(filename, delimiter=',')
-    
-    X0 = data[:, :-1].copy()
-    y0 = data[:, -1].copy()
+    from sklearn.model_selection import train_test_split
 
-    for i, v in enumerate(y0):
-        if(v != 1):
-            y0[i] = 0
+    if filename.endswith('.c4b'):
+        X0, y0 = load_binary_games(filename)
+    else:
+        data = np.loadtxt(filename, delimiter=',', skiprows=1, dtype=np.int8, ndmin=2)
+        X0 = data[:, :-1].reshape(data.shape[0], grid_size[0], grid_size[1], 1)
+        y0 = data[:, -1]
 
-    X0 = X0.reshape(X0.shape[0], 6, 7, 1)
-    
-    return train_test_split(X0, y0, test_size=test_size)
+    # Binarize target : 1 if Player 1 won, 0 otherwise
+    y0 = (y0 == 1).astype(np.float64)
 
-    
-    
-    
+    return train_test_split(X0, y0, test_size=test_size)
@@ -0,0 +1,537 @@
+#!/usr/bin/env python3
+'''
+Tournaments between players, with Elo ratings.
+
+Pairings (round robin : every player against every other one, or gauntlet : one challenger
+against everyone else) are split into batches of games, played by a pool of worker processes.
+In each pairing the first player is always Player 1 (marker 1) and the second Player 2 (every player
+type plays for its own marker, including the LearningAI), and the player who moves first alternates
+from one game to the next (even games : Player 1 starts).  Each player gets its own seed for every game (see Player.seed), derived
+from the master seed, the pairing and the game number, so a game is the same whatever the number
+of workers or the order the batches are played in.
+
+Results are appended to a JSON lines file as the batches come back : a header line with the
+tournament settings, then one line per game.  Running the same tournament on the same file picks
+up where it stopped.  Once done, the ratings (Elo fitted on every game, with confidence intervals
+from the Fisher information of the fit) and the score of each pairing are saved next to it
+(<results>_summary.json).
+
+With sprt=(elo0, elo1), each pairing is stopped as soon as a sequential probability ratio test
+decides whether the first player is elo1 points stronger than the second (H1) or only elo0 (H0),
+so lopsided matchups (ex: SetAI against RandomAI) only take a few dozen games.  Only a couple of
+batches of each pairing are played at a time (PAIRING_SLOTS), the other workers play the other pairings.
+
+Players are given as dictionaries {'name', 'type', 'kwargs'} or strings [name=]Type[:key=value,...] :
+    SetAI
+    RandomAI
+    deep=SearchAI:node_limit=5000,time_limit=None
+    cnn=LearningAI:keras_model=model.npz,search_depth=2
+
+Usage from a script :
+    from tournament import run_tournament
+    summary = run_tournament('results.jsonl', ['SetAI', 'RandomAI', 'cnn=LearningAI:keras_model=model.npz'],
+                             N_games=400, seed=42, sprt=(0, 50))
+
+Usage from the command line :
+    python tournament.py results.jsonl --players SetAI RandomAI cnn=LearningAI:keras_model=model.npz --games 400 --sprt 0 50
+'''
+
+# LIBRARIES
+import numpy as np
+import argparse
+import json
+import os
+import queue
+import time
+from multiprocessing import Pool
+
+from connect4Engine import C4
+from players import SetAI, RandomAI, LearningAI, SearchAI
+
+
+# Player types that can be used in a tournament
+PLAYER_CLASSES = {'SetAI'      : SetAI,
+                  'RandomAI'   : RandomAI,
+                  'LearningAI' : LearningAI,
+                  'SearchAI'   : SearchAI}
+
+# With an SPRT, batches of a pairing that can be in flight at once (the other workers are given batches
+# of the other pairings, so few games are wasted once a pairing is decided)
+PAIRING_SLOTS = 2
+
+
+def parse_value(text):
+    '''
+    Player option from the command line : int, float, None, True, False or string.
+    '''
+    if text in ('None', 'True', 'False'):
+        return {'None' : None, 'True' : True, 'False' : False}[text]
+    for kind in (int, float):
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+    return text
+
+
+def parse_player(text):
+    '''
+    Player description from a string [name=]Type[:key=value,...] (see module docstring).
+    The name defaults to the whole string.
+    '''
+    head, _, options = text.partition(':')
+    name, _, kind    = head.rpartition('=')
+
+    if (kind not in PLAYER_CLASSES):
+        raise ValueError('unknown player type {} (one of {})'.format(kind, ', '.join(PLAYER_CLASSES)))
+
+    kwargs = {}
+    for option in filter(None, options.split(',')):
+        key, _, value = option.partition('=')
+        kwargs[key] = parse_value(value)
+
+    return {'name' : name or text, 'type' : kind, 'kwargs' : kwargs}
+
+
+# Models loaded by this process (one per file, shared by the players of every batch)
+_models = {}
+
+def make_player(spec, p):
+    '''
+    Player object of a player description.  LearningAI models given as file paths are loaded
+    once per process (.npz files as a numpyModel.NumpyModel, anything else with keras).
+    '''
+    kwargs = dict(spec.get('kwargs', {}))
+
+    model = kwargs.get('keras_model')
+    if isinstance(model, str):
+        if model not in _models:
+            if model.endswith('.npz'):
+                from numpyModel import NumpyModel
+                _models[model] = NumpyModel(model)
+            else:
+                import keras.models as km
+                _models[model] = km.load_model(model)
+        kwargs['keras_model'] = _models[model]
+
+    return PLAYER_CLASSES[spec['type']](p=p, name=spec['name'], **kwargs)
+
+
+def round_robin(N_players):
+    '''
+    Pairings (index of Player 1, index of Player 2) of every player against every other one.
+    '''
+    return [(i, j) for i in range(N_players) for j in range(i + 1, N_players)]
+
+
+def gauntlet(N_players, challenger=0):
+    '''
+    Pairings of the challenger against every other player.
+    '''
+    return [(challenger, j) for j in range(N_players) if j != challenger]
+
+
+def game_seeds(seed, pairing, game):
+    '''
+    Seeds of Player 1 and Player 2 for one game (only depend on the master seed, pairing and game number).
+    '''
+    return [int(s) for s in np.random.SeedSequence([seed, pairing, game]).generate_state(2)]
+
+
+def play_batch(args):
+    '''
+    Worker function : plays games of one pairing.  Returns one result dictionary per game,
+    with the score of Player 1 (1 win, 0.5 tie, 0 loss).  A player making an invalid move loses.
+    '''
+    pairing, specs, games, seed, grid_size, N_connect = args
+
+    p1, p2 = make_player(specs[0], 1), make_player(specs[1], -1)
+    engine = C4(players=[p1, p2], first=1, on_invalid='record', grid_size=grid_size, N_connect=N_connect)
+    names  = {1 : p1.name, -1 : p2.name}
+
+    results = []
+    for game in games:
+        seeds = game_seeds(seed, pairing, game)
+        p1.seed(seeds[0])
+        p2.seed(seeds[1])
+
+        # Player 1 starts the even games, Player 2 the odd ones
+        engine.reset(first=1 if game % 2 == 0 else -1)
+        engine.play_game()
+
+        winner = engine.Board.winner
+        error  = engine.invalid_move
+        if (error is not None):
+            winner = -error.marker
+
+        results.append({'pairing' : pairing,
+                        'game'    : game,
+                        'p1'      : names[1],
+                        'p2'      : names[-1],
+                        'first'   : names[engine.start],
+                        'winner'  : names.get(winner),
+                        'score'   : {1 : 1., 0 : 0.5, -1 : 0.}[winner],
+                        'moves'   : len(engine.moves),
+                        'invalid' : None if error is None else names[error.marker]})
+
+    return results
+
+
+def expected_score(elo):
+    '''
+    Expected score of a player elo points stronger than its opponent.
+    '''
+    return 1./(1. + 10**(-elo/400.))
+
+
+def score_to_elo(score, eps=1e-3):
+    '''
+    Elo difference for an expected score (clipped to [eps, 1 - eps], i.e. about +-1200).
+    '''
+    score = min(max(score, eps), 1. - eps)
+    return -400.*np.log10(1./score - 1.)
+
+
+def score_stats(wins, draws, losses, pseudo=0.5):
+    '''
+    Mean and variance (per game) of the score of a pairing.  pseudo wins and losses are added
+    so the variance isn't 0 when one player won every game.
+    '''
+    w, d, l = wins + pseudo, draws, losses + pseudo
+    N = w + d + l
+    s = (w + 0.5*d)/N
+    var = (w*(1. - s)**2 + d*(0.5 - s)**2 + l*s**2)/N
+
+    return s, var
+
+
+def pairwise_elo(wins, draws, losses, z=1.96):
+    '''
+    Elo difference of a pairing (from Player 1's point of view) and its confidence interval
+    (normal approximation of the mean score, z=1.96 for 95%).  Returns (elo, low, high).
+    '''
+    N = wins + draws + losses
+    if (N == 0):
+        return 0., -np.inf, np.inf
+
+    s  = (wins + 0.5*draws)/N
+    _, var = score_stats(wins, draws, losses)
+    se = np.sqrt(var/N)
+
+    return score_to_elo(s), score_to_elo(s - z*se), score_to_elo(s + z*se)
+
+
+def sprt_llr(wins, draws, losses, elo0, elo1):
+    '''
+    Log likelihood ratio of H1 (Player 1 is elo1 stronger) against H0 (elo0 stronger), with the
+    normal approximation of the score used by chess engine testing (generalized SPRT).
+    '''
+    N = wins + draws + losses
+    if (N == 0):
+        return 0.
+
+    s, var = score_stats(wins, draws, losses)
+    s0, s1 = expected_score(elo0), expected_score(elo1)
+
+    return N*(s1 - s0)*(2*s - s0 - s1)/(2*var)
+
+
+def sprt_status(wins, draws, losses, elo0, elo1, alpha=0.05, beta=0.05):
+    '''
+    'H1' or 'H0' once the test is decided (error rates alpha and beta), None while it isn't.
+    '''
+    llr   = sprt_llr(wins, draws, losses, elo0, elo1)
+    lower = np.log(beta/(1. - alpha))
+    upper = np.log((1. - beta)/alpha)
+
+    if (llr >= upper):
+        return 'H1'
+    if (llr <= lower):
+        return 'H0'
+    return None
+
+
+def game_matrix(names, games, prior=1.):
+    '''
+    Games played between each pair of players (N x N) and total score of each player (N,), from a list of
+    games (name of Player 1, name of Player 2, score of Player 1).  Ties count as half a win.
+    prior virtual ties are added to each pairing that was played, so players who won or lost every game
+    still get finite ratings.
+    '''
+    index = {n : i for i, n in enumerate(names)}
+    N     = len(names)
+
+    played = np.zeros((N, N))
+    scores = np.zeros(N)
+    for a, b, s in games:
+        i, j = index[a], index[b]
+        played[i, j] += 1
+        played[j, i] += 1
+        scores[i] += s
+        scores[j] += 1. - s
+
+    # Virtual ties
+    met = played > 0
+    played += prior*met
+    scores += 0.5*prior*met.sum(axis=1)
+
+    return played, scores
+
+
+def fit_elo(names, games, prior=1.):
+    '''
+    Elo of each player (average 0) from a list of games (name of Player 1, name of Player 2, score of Player 1),
+    fitted with the Bradley-Terry model (ties count as half a win) by minorization-maximization.
+    prior virtual ties are added to each pairing (see game_matrix).
+    '''
+    played, scores = game_matrix(names, games, prior)
+
+    gamma = np.ones(len(names))
+    for it in range(1000):
+        new = scores/np.maximum((played/(gamma[:, None] + gamma[None, :])).sum(axis=1), 1e-300)
+        new = np.where(played.sum(axis=1) > 0, new, 1.)
+        new = new/np.exp(np.log(new).mean())
+        done = np.abs(new - gamma).max() < 1e-10
+        gamma = new
+        if (done):
+            break
+
+    elo = 400.*np.log10(gamma)
+
+    return elo - elo.mean()
+
+
+def ratings(names, games, prior=1., z=1.96):
+    '''
+    Elo of each player with a confidence interval (z=1.96 for 95%).
+    Returns {name : {'elo', 'low', 'high', 'games', 'score'}}.
+
+    The intervals come from the curvature of the Bradley-Terry likelihood at the fit (Fisher information,
+    virtual ties included) : the information between two players is the number of games times p*(1-p),
+    p being the expected score.  Thanks to the virtual ties p never reaches 0 or 1, so even a player who
+    won every game gets an interval of finite, non zero width (resampling the games of a one sided
+    pairing always gives the same result, so a bootstrap would say 0).
+    Players without any game get an infinite interval.
+    '''
+    elo = fit_elo(names, games, prior)
+    played, _ = game_matrix(names, games, prior)
+
+    # Fisher information of the log strengths (natural log, elo = 400*log10(gamma))
+    p    = 1./(1. + 10**((elo[None, :] - elo[:, None])/400.)) # expected score of i against j
+    info = played*p*(1. - p)
+    info = np.diag(info.sum(axis=1)) - info
+
+    # Ratings are only known up to a constant (average 0) : the pseudo inverse takes care of it
+    se = 400./np.log(10.)*np.sqrt(np.maximum(np.diag(np.linalg.pinv(info)), 0.))
+
+    table = {}
+    for i, n in enumerate(names):
+        mine  = [g for g in games if n in g[:2]]
+        score = sum(g[2] if g[0] == n else 1. - g[2] for g in mine)
+        width = z*se[i] if (played[i].sum() > 0) else np.inf
+        table[n] = {'elo'   : float(elo[i]),
+                    'low'   : float(elo[i] - width),
+                    'high'  : float(elo[i] + width),
+                    'games' : len(mine),
+                    'score' : score}
+
+    return table
+
+
+def load_results(filename):
+    '''
+    Header (tournament settings) and list of game results of a results file.
+    A partial last line (interrupted write) is ignored.
+    '''
+    header, games = None, []
+    with open(filename) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if 'tournament' in entry:
+                header = entry['tournament']
+            else:
+                games.append(entry)
+
+    return header, games
+
+
+def summarize(header, games, sprt_status_of=None):
+    '''
+    Ratings and pairing scores (wins, ties and losses of Player 1, Elo difference) of a tournament.
+    '''
+    names = [s['name'] for s in header['players']]
+
+    counts = {}
+    for g in games:
+        c = counts.setdefault(g['pairing'], [0, 0, 0])
+        c[{1. : 0, 0.5 : 1, 0. : 2}[g['score']]] += 1
+
+    pairings = []
+    for k, (i, j) in enumerate(header['pairings']):
+        w, d, l = counts.get(k, [0, 0, 0])
+        elo, low, high = pairwise_elo(w, d, l)
+        pairings.append({'p1' : names[i], 'p2' : names[j], 'wins' : w, 'ties' : d, 'losses' : l,
+                         'elo' : elo, 'low' : low, 'high' : high,
+                         'sprt' : None if sprt_status_of is None else sprt_status_of(w, d, l)})
+
+    return {'N_games'  : len(games),
+            'ratings'  : ratings(names, [(g['p1'], g['p2'], g['score']) for g in games]),
+            'pairings' : pairings}
+
+
+def print_summary(summary):
+    table = sorted(summary['ratings'].items(), key=lambda kv : -kv[1]['elo'])
+    print('{:<24} {:>7} {:>17} {:>7} {:>7}'.format('player', 'elo', '95% interval', 'games', 'score'))
+    for name, r in table:
+        print('{:<24} {:>7.0f} {:>8.0f} {:>8.0f} {:>7} {:>7.1f}'.format(name, r['elo'], r['low'], r['high'], r['games'], r['score']))
+
+    for p in summary['pairings']:
+        print('{} - {} : +{} ={} -{}  elo {:.0f} [{:.0f}, {:.0f}]{}'.format(
+            p['p1'], p['p2'], p['wins'], p['ties'], p['losses'], p['elo'], p['low'], p['high'],
+            '' if p['sprt'] is None else '  (SPRT {})'.format(p['sprt'])))
+
+
+def run_tournament(output_file, players, schedule='round_robin', N_games=100, seed=None, N_workers=None, batch_size=10,
+                   sprt=None, alpha=0.05, beta=0.05, challenger=0, grid_size=(6,7), N_connect=4, verbose=True):
+    '''
+    Play a tournament (see module docstring) and return its summary (see summarize).
+    output_file : results file (JSON lines, a tournament already in it is continued)
+    players     : list of player descriptions (dictionaries or strings)
+    schedule    : 'round_robin' or 'gauntlet' (challenger : index of the player facing all others)
+    N_games     : maximum number of games per pairing
+    seed        : master seed (random if None, the one used is saved in the header)
+    N_workers   : number of processes (defaults to the number of cores)
+    batch_size  : games per task sent to a worker (even, so both players start as often)
+    sprt        : (elo0, elo1) to stop pairings once decided (error rates alpha and beta), None to play all games
+    '''
+    specs = [parse_player(p) if isinstance(p, str) else p for p in players]
+    names = [s['name'] for s in specs]
+    if (len(set(names)) != len(names)):
+        raise ValueError('run_tournament : player names have to be different ({})'.format(names))
+
+    if (schedule == 'round_robin'):
+        pairs = round_robin(len(specs))
+    elif (schedule == 'gauntlet'):
+        pairs = gauntlet(len(specs), challenger)
+    else:
+        raise ValueError('run_tournament : unknown schedule {}'.format(schedule))
+
+    # Continue a tournament (same settings) or start a new file
+    header, games = None, []
+    if os.path.isfile(output_file):
+        header, games = load_results(output_file)
+
+    if (header is None):
+        if seed is None:
+            seed = int(np.random.SeedSequence().generate_state(1)[0])
+        header = {'players' : specs, 'pairings' : [list(p) for p in pairs], 'seed' : seed,
+                  'grid_size' : list(grid_size), 'N_connect' : N_connect}
+        with open(output_file, 'a') as f:
+            f.write(json.dumps({'tournament' : header}) + '\n')
+    else:
+        if (header['players'] != specs) or (header['pairings'] != [list(p) for p in pairs]) or \
+           (header['grid_size'] != list(grid_size)) or (header['N_connect'] != N_connect):
+            raise ValueError('{} holds a different tournament'.format(output_file))
+        seed = header['seed']
+
+    def status(w, d, l):
+        return sprt_status(w, d, l, sprt[0], sprt[1], alpha, beta)
+
+    # Games left and score counts of each pairing
+    done     = set((g['pairing'], g['game']) for g in games)
+    left     = [[n for n in range(N_games) if (k, n) not in done] for k in range(len(pairs))]
+    counts   = [[0, 0, 0] for k in range(len(pairs))]
+    for g in games:
+        counts[g['pairing']][{1. : 0, 0.5 : 1, 0. : 2}[g['score']]] += 1
+    decided  = [None if sprt is None else status(*c) for c in counts]
+
+    def next_task(k):
+        batch, left[k] = left[k][:batch_size], left[k][batch_size:]
+        i, j = pairs[k]
+        return (k, (specs[i], specs[j]), batch, seed, tuple(grid_size), N_connect)
+
+    N_workers = N_workers or os.cpu_count()
+    N_slots   = 2*N_workers # Tasks in flight (enough to keep every worker busy)
+    max_slots = N_slots if sprt is None else PAIRING_SLOTS # Tasks in flight per pairing
+
+    start   = time.time()
+    results = queue.Queue()
+    with Pool(N_workers) as pool, open(output_file, 'a') as f:
+        in_flight      = 0
+        pairing_flight = [0]*len(pairs) # Tasks in flight of each pairing
+        k_next         = 0
+
+        while True:
+            # Submit batches of the undecided pairings, taking turns
+            while (in_flight < N_slots):
+                open_pairings = [k for k in range(len(pairs))
+                                 if left[k] and decided[k] is None and pairing_flight[k] < max_slots]
+                if (len(open_pairings) == 0):
+                    break
+                k = min(open_pairings, key=lambda k : (k - k_next) % len(pairs))
+                k_next = k + 1
+                pool.apply_async(play_batch, (next_task(k),), callback=results.put,
+                                 error_callback=lambda e : results.put(e))
+                in_flight += 1
+                pairing_flight[k] += 1
+
+            if (in_flight == 0):
+                break
+
+            batch = results.get()
+            in_flight -= 1
+            if isinstance(batch, Exception):
+                raise batch
+
+            # Save the games as soon as they come back
+            f.write(''.join(json.dumps(g) + '\n' for g in batch))
+            f.flush()
+            games += batch
+
+            k = batch[0]['pairing']
+            pairing_flight[k] -= 1
+            for g in batch:
+                counts[k][{1. : 0, 0.5 : 1, 0. : 2}[g['score']]] += 1
+
+            if (sprt is not None) and (decided[k] is None):
+                decided[k] = status(*counts[k])
+                if (verbose) and (decided[k] is not None):
+                    print('{} - {} : SPRT {} after {} games'.format(names[pairs[k][0]], names[pairs[k][1]],
+                                                                   decided[k], sum(counts[k])))
+
+            if (verbose): print('{} games, {:.1f}s'.format(len(games), time.time() - start))
+
+    summary = summarize(header, games, None if sprt is None else status)
+
+    with open(os.path.splitext(output_file)[0] + '_summary.json', 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    if (verbose): print_summary(summary)
+
+    return summary
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Tournament between Connect 4 players, with Elo ratings.')
+    parser.add_argument('output_file', help='results file (JSON lines, continued if it exists)')
+    parser.add_argument('--players',    nargs='+', required=True, help='players, [name=]Type[:key=value,...]')
+    parser.add_argument('--schedule',   default='round_robin',    help='round_robin or gauntlet')
+    parser.add_argument('--challenger', type=int, default=0,      help='index of the gauntlet challenger')
+    parser.add_argument('--games',      type=int, default=100,    help='maximum number of games per pairing')
+    parser.add_argument('--seed',       type=int, default=None,   help='master seed')
+    parser.add_argument('--workers',    type=int, default=None,   help='number of processes (default: all cores)')
+    parser.add_argument('--batch-size', type=int, default=10,     help='games per worker task')
+    parser.add_argument('--sprt',       type=float, nargs=2, default=None, metavar=('ELO0', 'ELO1'),
+                        help='stop pairings once an SPRT of elo0 against elo1 is decided')
+    parser.add_argument('--height',     type=int, default=6,      help='grid height')
+    parser.add_argument('--width',      type=int, default=7,      help='grid width')
+    parser.add_argument('--connect',    type=int, default=4,      help='number of pieces in a row to win')
+    args = parser.parse_args()
+
+    run_tournament(args.output_file, args.players, schedule=args.schedule, N_games=args.games, seed=args.seed,
+                   N_workers=args.workers, batch_size=args.batch_size, sprt=args.sprt, challenger=args.challenger,
+                   grid_size=(args.height, args.width), N_connect=args.connect)
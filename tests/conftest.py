@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The library modules import each other by name (from board import Board, ...)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'library'))
@@ -0,0 +1,102 @@
+import numpy as np
+
+from bitboard import BitBoard
+from board import Board
+
+
+# Board geometries the checks are run on (height, width, N_connect)
+GEOMETRIES = [(6, 7, 4), (5, 5, 3), (7, 9, 5), (4, 4, 4), (8, 8, 6)]
+
+
+class Mover(object):
+    '''
+    Bare bones player : the boards only read .choice and .marker
+    '''
+    def __init__(self, marker):
+        self.marker = marker
+        self.choice = None
+
+
+def random_games(height, width, N_connect, N_games=40, seed=0):
+    '''
+    Yields seeded random move sequences (column choices) played until the grid is full.
+    The checks stop at the first win, like C4.play_game does.
+    '''
+    rng = np.random.default_rng(seed)
+    for _ in range(N_games):
+        heights = np.zeros(width, dtype=int)
+        moves   = []
+        while (heights < height).any():
+            column = rng.choice(np.flatnonzero(heights < height))
+            heights[column] += 1
+            moves.append(int(column))
+        yield moves
+
+
+def has_won(grid, marker, N_connect):
+    '''
+    Brute force win check : walks every row, column and diagonal of the grid cell by cell.
+    '''
+    height, width = grid.shape
+    for row in range(height):
+        for col in range(width):
+            for d_row, d_col in [(0, 1), (1, 0), (1, 1), (1, -1)]:
+                end_row, end_col = row + (N_connect - 1)*d_row, col + (N_connect - 1)*d_col
+                if (end_row >= height) or (end_col < 0) or (end_col >= width):
+                    continue
+                if all(grid[row + k*d_row, col + k*d_col] == marker for k in range(N_connect)):
+                    return True
+    return False
+
+
+def test_check_vectors_matches_full_scan():
+    # The running vector sums have to give the same answer as scanning the whole grid
+    for height, width, N_connect in GEOMETRIES:
+        for moves in random_games(height, width, N_connect, seed=height + width):
+            board   = Board((height, width), N_connect=N_connect)
+            players = [Mover(1), Mover(-1)]
+
+            for i, column in enumerate(moves):
+                mover, other = players[i % 2], players[(i + 1) % 2]
+                mover.choice = column
+                board.update(mover)
+
+                # Opponent : check over all vector sums
+                assert board.check_vectors(other) == has_won(board.grid, other.marker, N_connect)
+
+                # Last mover : check over the vectors going through the new piece only
+                won = board.check_vectors(mover)
+                assert won == has_won(board.grid, mover.marker, N_connect)
+                if (won):
+                    break
+
+            # Running sums still match the grid at the end of the game
+            lines = board.geometry.lines
+            assert (board.vector_sums == board.grid.ravel()[lines].sum(axis=1)).all()
+
+
+def test_bitboard_matches_board():
+    # Both boards play the same games : grids, move counts and win flags have to agree at every move
+    for height, width, N_connect in GEOMETRIES:
+        for moves in random_games(height, width, N_connect, seed=height*width):
+            board, bitboard = Board((height, width), N_connect=N_connect), BitBoard((height, width), N_connect=N_connect)
+            players = [Mover(1), Mover(-1)]
+
+            for i, column in enumerate(moves):
+                mover, other = players[i % 2], players[(i + 1) % 2]
+                mover.choice = other.choice = column
+
+                board.update(mover)
+                bitboard.update(mover)
+
+                assert (board.grid == bitboard.grid).all()
+                assert (board.bool_grid == bitboard.bool_grid).all()
+                assert list(board.col_moves) == list(bitboard.col_moves)
+                assert board.N_moves_left == bitboard.N_moves_left
+                assert board.check_vectors(other) == bitboard.check_vectors(other)
+
+                won = board.check_vectors(mover)
+                assert won == bitboard.check_vectors(mover)
+                if (won):
+                    assert board.winner == bitboard.winner == mover.marker
+                    break
@@ -0,0 +1,44 @@
+import os
+
+import pytest
+
+from connect4Engine import C4
+from gameRecord import MoveSink, load_game_records
+from players import RandomAI
+
+
+class BadAI(RandomAI):
+    '''
+    Always plays a column that doesn't exist.
+    '''
+    def move(self, Board):
+        self.choice = Board.width + 1
+
+
+def test_aborted_games_are_not_saved(tmp_path):
+    csv_file   = str(tmp_path / 'games.csv')
+    moves_file = str(tmp_path / 'games.c4m')
+
+    engine = C4(players=[BadAI(1), RandomAI(2)], first=1, on_invalid='record')
+    engine.play_game()
+    assert engine.invalid_move is not None
+    assert engine.Board.winner == 0
+
+    # Not written as a tie, neither to a csv file nor through a sink
+    assert engine.save_game(csv_file) == 1
+    assert not os.path.isfile(csv_file)
+
+    sink = MoveSink(moves_file)
+    engine.sink = sink
+    assert engine.save_game() == 1
+    sink.close()
+    assert list(load_game_records(moves_file)) == []
+
+    with pytest.raises(ValueError):
+        engine.make_game_record()
+
+    # Complete games are still saved
+    engine = C4(players=[RandomAI(1), RandomAI(2)], first=1, on_invalid='record')
+    engine.play_game()
+    assert engine.save_game(csv_file) == 0
+    assert os.path.isfile(csv_file)
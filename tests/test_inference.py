@@ -0,0 +1,38 @@
+import numpy as np
+
+from inference import PredictionCache
+
+
+class CountingModel(object):
+    '''
+    Stand-in model : sum of the grid, and a record of every batch it was asked to predict.
+    '''
+    def __init__(self):
+        self.batches = []
+
+    def predict(self, states, **kwargs):
+        states = np.asarray(states)
+        self.batches.append(len(states))
+        return states.reshape(len(states), -1).sum(axis=1, keepdims=True)
+
+
+def test_cache_sends_each_missing_position_once():
+    grid = np.zeros((6, 7, 1))
+    grid[0, 0] = 1
+    other = np.zeros((6, 7, 1))
+    other[0, 3] = -1
+
+    # grid, its mirror image, grid again and another position
+    states = np.array([grid, grid[:, ::-1], grid, other])
+
+    model = CountingModel()
+    cache = PredictionCache()
+    predictions = cache.predict(model, states)
+
+    assert model.batches == [2]
+    assert list(predictions) == [1, 1, 1, -1]
+    assert len(cache) == 2
+
+    # Everything is cached now
+    assert list(cache.predict(model, states)) == [1, 1, 1, -1]
+    assert model.batches == [2]
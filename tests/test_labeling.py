@@ -0,0 +1,23 @@
+import numpy as np
+
+from gameRecord import GameRecord, MoveSink
+from labeling import extract_positions
+
+
+def test_move_files_use_the_played_positions(tmp_path):
+    moves_file = str(tmp_path / 'games.c4m')
+
+    # Player 1 wins on the bottom row.  Taking pieces back off the final grid could rebuild
+    # another move order, the move file knows the real one
+    record = GameRecord([3, 3, 4, 4, 2, 2, 5], start=1, winner=1, player_types=('SetAI', 'SetAI'))
+    with MoveSink(moves_file) as sink:
+        sink.write_record(record)
+
+    grids, movers, labels = extract_positions(moves_file)
+
+    # Final grid (labeled with the winner) and every position before a move
+    expected = [(record.final_grid(), 0, 1)] + [(g, mover, 0) for g, mover, _ in record.positions()]
+    assert len(grids) == len(expected)
+    for (g, mover, label), grid, m, l in zip(expected, grids, movers, labels):
+        assert (g == grid).all()
+        assert (mover, label) == (m, l)
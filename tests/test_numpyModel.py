@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from numpyModel import NumpyModel, export_model
+
+keras = pytest.importorskip('keras')
+
+
+def random_grids(N, grid_size, seed=0):
+    rng = np.random.RandomState(seed)
+    return rng.randint(-1, 2, (N, grid_size[0], grid_size[1], 1)).astype(np.float32)
+
+
+@pytest.mark.parametrize('grid_size', [(6, 7), (5, 5), (7, 9)])
+def test_matches_keras_generate_CNN(tmp_path, grid_size):
+    from tools import generate_CNN
+
+    model = generate_CNN(grid_size=grid_size)
+    path  = str(tmp_path / 'model.npz')
+    export_model(model, path)
+
+    X = random_grids(64, grid_size)
+    assert np.allclose(NumpyModel(path).predict(X), model.predict(X, verbose=0), atol=1e-5)
+
+
+def test_matches_keras_extra_layers(tmp_path):
+    from keras.layers import Conv2D, Dense, Dropout
+    from tools import generate_CNN
+
+    model = generate_CNN(conv_layers=[Conv2D(16, (2, 2), activation='relu', padding='valid')],
+                         dense_layers=[Dense(32, activation='relu'), Dropout(0.2), Dense(8, activation='tanh')])
+    path  = str(tmp_path / 'model.npz')
+    export_model(model, path)
+
+    X = random_grids(64, (6, 7), seed=1)
+    assert np.allclose(NumpyModel(path).predict(X), model.predict(X, verbose=0), atol=1e-5)
@@ -0,0 +1,91 @@
+import numpy as np
+
+from board import Board
+from players import LearningAI, SetAI
+
+
+def reference_setai_move(board, marker, random):
+    '''
+    The original SetAI.move, looping over Board.vectors (kept here to check the vectorized one).
+    random is np.random or a RandomState, the draws are made in the same order as SetAI.
+    '''
+    target = board.N_connect*marker
+
+    # Fail safe random column first (same draw as SetAI)
+    available = [i for i, v in enumerate(board.col_moves) if v != 0]
+    choice    = random.choice(available)
+
+    playable = [i for i, v in enumerate(board.bool_vectors) if True in v]
+    scores   = [sum(board.vectors[i]) for i in playable]
+
+    winning = [i for i, s in zip(playable, scores) if s == target - marker]
+    losing  = [i for i, s in zip(playable, scores) if s == -1*target + marker]
+    if (len(winning) > 0):
+        index = random.choice(winning)
+    elif (len(losing) > 0):
+        index = random.choice(losing)
+    else:
+        index = random.choice(playable)
+
+    # First available position of the vector
+    true_positions = np.where(board.bool_vectors[index] == True)[0]
+    if (len(true_positions) > 0):
+        choice = board.column_vectors[index][true_positions[0]]
+    return choice
+
+
+def test_setai_matches_loop_version():
+    # Same seeds, same choices : SetAI vs SetAI games on a few board sizes,
+    # with the global np.random state and with the players' own generators
+    for grid_size, N_connect in [((6, 7), 4), ((5, 5), 3), ((7, 9), 5)]:
+        for game in range(30):
+            board   = Board(grid_size, N_connect=N_connect)
+            players = [SetAI(1), SetAI(2)]
+            own_rng = (game % 2 == 1)
+
+            turn = 0
+            while (board.N_moves_left > 0):
+                player = players[turn % 2]
+                seed   = 1000*game + turn
+
+                if (own_rng):
+                    expected = reference_setai_move(board, player.marker, np.random.RandomState(seed))
+                    player.seed(seed)
+                else:
+                    np.random.seed(seed)
+                    expected = reference_setai_move(board, player.marker, np.random)
+                    np.random.seed(seed)
+
+                player.move(board)
+                assert player.choice == expected
+
+                board.update(player)
+                if (board.check_vectors(player)):
+                    break
+                turn += 1
+
+
+class ConstantModel(object):
+    def predict(self, states, **kwargs):
+        return np.full((len(states), 1), 0.3)
+
+
+def test_search_scores_ties_as_even():
+    # 4x4 grid with no line of four and one empty cell (top left) : the last move ties the game
+    rows = [[ 1,  1, -1, -1],
+            [-1, -1,  1,  1],
+            [ 1,  1, -1, -1],
+            [-1, -1,  1,  1]]
+    board = Board((4, 4), N_connect=4)
+    piece = SetAI(1)
+    for row in range(3, -1, -1):
+        for col in range(4):
+            if (row, col) != (0, 0):
+                piece.marker, piece.choice = rows[row][col], col
+                board.update(piece)
+
+    player = LearningAI(ConstantModel(), p=1, search_depth=2)
+    player.move(board)
+
+    assert player.choice == 0
+    assert list(player.predictions) == [0.5]
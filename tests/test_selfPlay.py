@@ -0,0 +1,147 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import selfPlay
+from batchEngine import BatchC4
+from numpyModel import NumpyModel
+from selfPlay import ReplayBuffer, game_positions, latest_checkpoint, self_play_policy, write_latest
+
+
+def filled_buffer(capacity, N_batches, batch=4):
+    buffer = ReplayBuffer(capacity, (2, 3))
+    for i in range(N_batches):
+        buffer.add(np.full((batch, 2, 3), i, dtype=np.int8), np.full(batch, i, dtype=np.float32), version=i)
+    return buffer
+
+
+def test_buffer_wraps_around_and_evicts_oldest():
+    buffer = filled_buffer(10, 4)
+
+    assert len(buffer) == 10
+    assert buffer.N_added == 16
+    assert buffer.position == 6
+    # Batch 0 and half of batch 1 were evicted by batch 3
+    assert sorted(buffer.labels.tolist()) == [1, 1, 2, 2, 2, 2, 3, 3, 3, 3]
+    assert (buffer.versions == buffer.labels).all()
+
+
+def test_buffer_keeps_newest_of_a_large_batch():
+    buffer = filled_buffer(10, 1)
+    buffer.add(np.zeros((25, 2, 3), dtype=np.int8), np.arange(25, dtype=np.float32))
+
+    assert len(buffer) == 10
+    assert sorted(buffer.labels.tolist()) == list(range(15, 25))
+
+
+def test_buffer_save_load_keeps_newest(tmp_path):
+    path   = str(tmp_path / 'replay.npz')
+    filled_buffer(10, 4).save(path)
+
+    same = ReplayBuffer.load(path, 10)
+    assert same.labels.tolist() == [1, 1, 2, 2, 2, 2, 3, 3, 3, 3]
+    assert same.N_added == 16
+
+    smaller = ReplayBuffer.load(path, 4)
+    assert smaller.labels.tolist() == [3, 3, 3, 3]
+
+    # A loaded buffer keeps evicting the oldest positions
+    smaller.add(np.zeros((2, 2, 3), dtype=np.int8), np.full(2, 9, dtype=np.float32))
+    assert sorted(smaller.labels.tolist()) == [3, 3, 9, 9]
+
+
+def test_sample_shape_and_empty_buffer():
+    X, y = filled_buffer(10, 2).sample(7)
+    assert X.shape == (7, 2, 3, 1) and X.dtype == np.float32
+    assert y.shape == (7,)
+
+    with pytest.raises(ValueError):
+        ReplayBuffer(10, (2, 3)).sample(1)
+
+
+def test_game_positions_labels_and_markers():
+    model  = NumpyModel.random(seed=0)
+    policy = self_play_policy(model, epsilon=0.3)
+    engine = BatchC4(20, p1_policy=policy, p2_policy=policy, seed=1)
+    engine.play_games()
+
+    states, labels = game_positions(engine)
+
+    # Same positions as replaying each game record (after every move), labeled with its result
+    expected = []
+    for record in engine.make_game_records():
+        grids = [grid for grid, marker, move in record.positions()][1:] + [record.final_grid()]
+        expected += [(g.tobytes(), (record.winner + 1)/2.) for g in grids]
+
+    assert len(states) == int(engine.N_moves.sum())
+    assert sorted(expected) == sorted((s.tobytes(), float(l)) for s, l in zip(states, labels))
+    assert set(np.unique(labels)) <= {0., 0.5, 1.}
+
+    # Players alternate : after each move, the pieces of the two players differ by at most one
+    difference = (states == 1).sum(axis=(1, 2)) - (states == -1).sum(axis=(1, 2))
+    assert np.isin(difference, (-1, 0, 1)).all()
+
+
+def test_latest_checkpoint_paths_relative_to_directory(tmp_path, monkeypatch):
+    directory = str(tmp_path / 'checkpoints')
+    os.makedirs(directory)
+    write_latest(directory, 3, {'keras' : 'model_0003.h5', 'npz' : 'model_0003.npz'})
+
+    with open(os.path.join(directory, 'latest.json')) as f:
+        assert json.load(f)['npz'] == 'model_0003.npz'
+
+    monkeypatch.chdir(tmp_path)
+    latest = latest_checkpoint('checkpoints')
+    assert latest['version'] == 3
+    assert latest['npz'] == os.path.join('checkpoints', 'model_0003.npz')
+
+
+# Self-play loop without keras : the model is a stand-in and checkpoints are written as NumpyModel files
+
+class History(object):
+    def __init__(self, loss):
+        self.history = {'loss' : [loss]}
+
+
+class StandInModel(object):
+    def fit(self, X, y, **kwargs):
+        return History(float(((y - y.mean())**2).mean()))
+
+
+def save_stand_in(model, directory, version, info=None):
+    rng     = np.random.RandomState(version)
+    layers  = [{'type' : 'Conv2D',       'settings' : {'activation' : 'tanh', 'padding' : 'same', 'strides' : [1, 1]}},
+               {'type' : 'MaxPooling2D', 'settings' : {'pool_size' : [2, 2], 'strides' : [2, 2], 'padding' : 'valid'}},
+               {'type' : 'Flatten',      'settings' : {}},
+               {'type' : 'Dense',        'settings' : {'activation' : 'sigmoid'}}]
+    weights = {'layer_0_0' : rng.normal(0, 0.3, (4, 4, 1, 4)), 'layer_0_1' : np.zeros(4),
+               'layer_3_0' : rng.normal(0, 0.1, (3*3*4, 1)),   'layer_3_1' : np.zeros(1)}
+
+    name = 'model_{:04d}'.format(version)
+    np.savez(os.path.join(directory, name + '.npz'), config=np.array(json.dumps(layers)), **weights)
+    write_latest(directory, version, {'keras' : None, 'npz' : name + '.npz'}, info)
+
+
+def test_self_play_loop_and_resume(tmp_path, monkeypatch):
+    monkeypatch.setattr(selfPlay, 'save_checkpoint', save_stand_in)
+    monkeypatch.setattr(selfPlay, 'load_checkpoint', lambda latest : StandInModel())
+
+    output_dir = str(tmp_path / 'run')
+    settings   = dict(capacity=3000, N_generators=2, games_per_batch=20, new_positions=500,
+                      train_samples=200, seed=1, verbose=False)
+
+    assert selfPlay.self_play_loop(output_dir, N_rounds=2, model=StandInModel(), **settings) == 2
+    N_added = ReplayBuffer.load(os.path.join(output_dir, 'replay.npz'), 3000).N_added
+    assert N_added >= 1000
+
+    # Resume : next versions, same buffer
+    assert selfPlay.self_play_loop(output_dir, N_rounds=1, **settings) == 3
+
+    with open(os.path.join(output_dir, 'history.jsonl')) as f:
+        history = [json.loads(line) for line in f]
+    assert [h['version'] for h in history] == [1, 2, 3]
+    assert history[-1]['N_added'] >= N_added + 500
+    assert latest_checkpoint(os.path.join(output_dir, 'checkpoints'))['version'] == 3
+    assert ReplayBuffer.load(os.path.join(output_dir, 'replay.npz'), 3000).N_added == history[-1]['N_added']
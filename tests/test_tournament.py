@@ -0,0 +1,80 @@
+import pickle
+
+import numpy as np
+
+from board import Board, get_lines
+from players import LearningAI, RandomAI, SetAI
+from tournament import play_batch, ratings
+
+
+class WinnerModel(object):
+    '''
+    Stand-in model : 1 if Player 1 has N_connect in a row, 0 if Player 2 has, 0.5 otherwise.
+    '''
+    def __init__(self, grid_size=(6, 7), N_connect=4):
+        self.lines  = get_lines(grid_size, N_connect)
+        self.target = N_connect
+
+    def predict(self, states, **kwargs):
+        sums = np.asarray(states).reshape(len(states), -1)[:, self.lines].sum(axis=2)
+        p1   = (sums == self.target).any(axis=1)
+        p2   = (sums == -self.target).any(axis=1)
+        return np.where(p1, 1., np.where(p2, 0., 0.5)).reshape(-1, 1)
+
+
+def board_with(pieces):
+    board = Board()
+    for row, col, marker in pieces:
+        board.grid[row, col] = marker
+        board.col_moves[col] -= 1
+        board.bool_grid[row, col] = False
+        if (row > 0):
+            board.bool_grid[row - 1, col] = True
+    return board
+
+
+def test_learning_ai_takes_its_own_win_as_player_2():
+    # Player 2 has three in column 2, Player 1 three in column 5
+    board = board_with([(5, 2, -1), (4, 2, -1), (3, 2, -1), (5, 5, 1), (4, 5, 1), (3, 5, 1)])
+
+    for search_depth in (1, 2):
+        player = LearningAI(WinnerModel(), p=-1, search_depth=search_depth)
+        player.move(board)
+        assert player.choice == 2
+
+    player = LearningAI(WinnerModel(), p=1)
+    player.move(board)
+    assert player.choice == 5
+
+
+def test_learning_ai_in_second_slot_of_a_pairing():
+    specs = [{'name' : 'random', 'type' : 'RandomAI', 'kwargs' : {}},
+             {'name' : 'cnn', 'type' : 'LearningAI', 'kwargs' : {'keras_model' : WinnerModel()}}]
+
+    results = play_batch((0, specs, list(range(20)), 1, (6, 7), 4))
+
+    assert all(r['p2'] == 'cnn' for r in results)
+    assert [r['first'] for r in results[:2]] == ['random', 'cnn']
+    # Score of the RandomAI (Player 1) : about 1 if the LearningAI played for Player 1's win
+    assert np.mean([r['score'] for r in results]) < 0.5
+
+
+def test_players_can_be_pickled():
+    for player in (RandomAI(), SetAI(p=-1)):
+        assert pickle.loads(pickle.dumps(player)).rng is None
+        player.seed(3)
+        copy = pickle.loads(pickle.dumps(player))
+        assert copy.random_choice(np.arange(100)) == player.random_choice(np.arange(100))
+
+
+def test_ratings_of_one_sided_pairings_have_intervals():
+    # A won every game : resampling these games always gives the same ratings, the intervals must not collapse
+    table = ratings(['A', 'B', 'C'], [('A', 'B', 1.)]*30 + [('B', 'A', 0.)]*30)
+
+    assert table['A']['elo'] > 0 > table['B']['elo']
+    for name in ('A', 'B'):
+        assert table[name]['low'] < table[name]['elo'] < table[name]['high']
+        assert np.isfinite([table[name]['low'], table[name]['high']]).all()
+
+    # C never played
+    assert table['C']['low'] == -np.inf and table['C']['high'] == np.inf